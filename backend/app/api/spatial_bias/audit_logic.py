@@ -3,18 +3,29 @@
 from .models import (
     AuditRequest,
     AuditResponse,
+    BatchAuditEntry,
+    BatchAuditRequest,
+    BatchAuditResponse,
+    SignifLevelEntry,
     StatEntry,
 )
 import numpy as np
 import pandas as pd
-from app.services.spatial_bias.methods.audit import run_spatial_audit
+from app.services.spatial_bias.methods.audit import (
+    rerun_spatial_audit,
+    run_spatial_audit,
+    run_spatial_audit_batch,
+)
 from app.services.spatial_bias.utils.api_visual_utils import (
     generate_fairness_map_html,
     generate_distribution_map,
     generate_synthetic_distribution_plot,
     generate_synthetic_fairness_map_plot,
 )
-from app.services.spatial_bias.utils.data_utils import get_positive_rates
+from app.services.spatial_bias.utils.data_utils import (
+    apply_prediction_changes,
+    get_positive_rates,
+)
 from app.services.spatial_bias.utils.scores import (
     get_fair_stat_ratios,
 )
@@ -26,13 +37,30 @@ from app.services.spatial_bias.utils.input_utils import prepare_inputs
 
 
 def run_audit_pipeline(
-    req: AuditRequest, max_stat=None, zoom_start=9, synth_layout=None
+    req: AuditRequest,
+    max_stat=None,
+    zoom_start=9,
+    synth_layout=None,
+    with_state=False,
+    state=None,
+    changes=None,
 ) -> AuditResponse:
+    # with_state also returns the state of the audit. Passing it back as `state`, with
+    # the (index, old, new) prediction `changes` since that audit, updates the audit
+    # (and the state, in place: both its predictions and its audit) instead of
+    # re-partitioning and rescanning everything.
+
+    if state is None:
+        input_data = prepare_inputs(req=req, synth_layout=synth_layout)
+    else:
+        ## checked against the predictions of the state before anything is updated
+        input_data = dict(state["input_data"])
+        input_data["y_pred"] = apply_prediction_changes(input_data["y_pred"], changes)
 
-    input_data = prepare_inputs(req=req, synth_layout=synth_layout)
     y_pred = input_data["y_pred"]
     y_true = input_data["y_true"]
     region_indices = input_data["region_indices"]
+    region_membership = input_data["region_membership"]
     lats = input_data["lats"]
     lons = input_data["lons"]
     indiv_coords_given = input_data["indiv_coords_given"]
@@ -40,20 +68,41 @@ def run_audit_pipeline(
     synth_layout = input_data["synth_layout"]
 
     # Step 2: Run audit
-    df_scanned, signif_thresh, sbi_score = run_spatial_audit(
-        y_pred=y_pred,
-        y_true=y_true if req.equal_opp else None,
-        region_indices=region_indices,
-        signif_level=req.signif_level,
-        n_worlds=req.n_worlds,
-    )
+    if state is None:
+        df_scanned, signif_thresh, sbi_score, audit_info, audit_state = (
+            run_spatial_audit(
+                y_pred=y_pred,
+                y_true=y_true if req.equal_opp else None,
+                region_indices=region_membership,
+                signif_level=req.signif_level,
+                n_worlds=req.n_worlds,
+                n_worlds_tol=req.n_worlds_tol,
+                max_n_worlds=req.max_n_worlds,
+                with_info=True,
+                signif_levels=req.signif_levels,
+                with_state=True,
+                approx_fraction=req.approx_fraction,
+                max_individuals=req.max_individuals,
+                threshold_method=req.threshold_method,
+                significance=req.significance,
+                null_model=input_data["null_model"],
+            )
+        )
+    else:
+        audit_state = state["audit_state"]
+        df_scanned, signif_thresh, sbi_score, audit_info = rerun_spatial_audit(
+            audit_state, changes, with_info=True
+        )
+        state["input_data"] = input_data
+
+    approx = "ambiguous" in df_scanned
 
     # Step 3: Generate visual outputs
     stats = df_scanned["statistic"].tolist()
     max_stat = max(stats) if max_stat is None else max_stat
 
     PR, pr_regions = get_positive_rates(
-        y_pred, region_indices, y_true=y_true if req.equal_opp else None
+        y_pred, region_membership, y_true=y_true if req.equal_opp else None
     )
 
     regions_fair_stats, _ = get_fair_stat_ratios(
@@ -121,16 +170,99 @@ def run_audit_pipeline(
             tp=req.equal_opp,
         )
 
-    return AuditResponse(
+    response = AuditResponse(
         sbi_score=sbi_score,
         signif_thresh=signif_thresh,
+        signif_thresh_ci=list(audit_info["signif_thresh_ci"]),
+        n_worlds_used=audit_info["n_worlds"],
+        threshold_method=audit_info["threshold_method"],
+        signif_levels=(
+            [
+                SignifLevelEntry(
+                    signif_level=level,
+                    signif_thresh=thresh,
+                    total_signif_regions=int((df_scanned["statistic"] >= thresh).sum()),
+                )
+                for level, thresh in audit_info["signif_threshs"].items()
+            ]
+            if req.signif_levels
+            else None
+        ),
         total_signif_regions=int(df_scanned["signif"].sum()),
         fair_map_html=map_html,
         fair_map_image=map_image,
         stats=[
-            StatEntry(idx=i, stat=stat, is_signif=bool(df_scanned["signif"][i]))
+            StatEntry(
+                idx=i,
+                stat=stat,
+                is_signif=bool(df_scanned["signif"][i]),
+                p_value=df_scanned["p_value"][i],
+                stat_ci=(
+                    [
+                        df_scanned["statistic_ci_low"][i],
+                        df_scanned["statistic_ci_high"][i],
+                    ]
+                    if approx
+                    else None
+                ),
+                ambiguous=bool(df_scanned["ambiguous"][i]) if approx else None,
+            )
             for i, stat in enumerate(stats)
         ],
         distribution_map_html=distribution_map_html,
         distribution_map_image=distribution_map_image,
     )
+
+    if with_state:
+        return response, {"input_data": input_data, "audit_state": audit_state}
+
+    return response
+
+
+def run_batch_audit_pipeline(req: BatchAuditRequest) -> BatchAuditResponse:
+
+    # no maps are drawn for batch audits, so the synthetic layout is skipped
+    input_data = prepare_inputs(req=req, synth_layout={})
+    y_true = input_data["y_true"]
+
+    df_scanned, signif_threshs, sbi_scores, audit_info = run_spatial_audit_batch(
+        y_preds=np.array(req.y_preds),
+        y_true=y_true if req.equal_opp else None,
+        region_indices=input_data["region_membership"],
+        signif_level=req.signif_level,
+        n_worlds=req.n_worlds,
+        n_worlds_tol=req.n_worlds_tol,
+        max_n_worlds=req.max_n_worlds,
+        p_bucket=req.p_bucket,
+        with_info=True,
+        threshold_method=req.threshold_method,
+        significance=req.significance,
+    )
+
+    results = []
+    for m, df_model in df_scanned.groupby("model"):
+        results.append(
+            BatchAuditEntry(
+                model=int(m),
+                sbi_score=sbi_scores[m],
+                signif_thresh=signif_threshs[m],
+                n_worlds_used=int(audit_info["n_worlds"][m]),
+                total_signif_regions=int(df_model["signif"].sum()),
+                stats=[
+                    StatEntry(
+                        idx=int(region),
+                        stat=stat,
+                        is_signif=bool(signif),
+                        p_value=p_value,
+                    )
+                    for region, stat, signif, p_value in zip(
+                        df_model["region"],
+                        df_model["statistic"],
+                        df_model["signif"],
+                        df_model["p_value"],
+                    )
+                ],
+            )
+        )
+
+    return BatchAuditResponse(results=results)
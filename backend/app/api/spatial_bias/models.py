@@ -1,8 +1,11 @@
 # src/api/models.py
 
-from typing import List, Optional, Dict
+from typing import Annotated, List, Optional, Dict, Literal, Union
 from pydantic import BaseModel, Field, ConfigDict, model_validator
 
+# number of alternative worlds, or "auto" to simulate until the threshold converges
+NWorlds = Union[Literal["auto"], Annotated[int, Field(ge=1, le=100_000)]]
+
 
 class IndivInfo(BaseModel):
     model_config = ConfigDict(extra="forbid")  # catch unknown keys
@@ -59,11 +62,27 @@ class RegionInfo(BaseModel):
 class AuditRequest(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
-    n_worlds: int = Field(400, ge=1, le=100_000)
+    n_worlds: NWorlds = 400
+    n_worlds_tol: float = Field(0.05, gt=0, lt=1)
+    max_n_worlds: int = Field(100_000, ge=1, le=100_000)
     signif_level: float = Field(0.005, gt=0, lt=1)
+    # extra levels whose thresholds are computed from the same simulation
+    signif_levels: Optional[List[Annotated[float, Field(gt=0, lt=1)]]] = None
     equal_opp: bool = True
     indiv_info: List[IndivInfo] = Field(..., min_length=1)
     region_info: Optional[List[RegionInfo]] = None
+    # how individuals given only by coordinates are partitioned: k-means clusters or the
+    # leaves of a quadtree refined where the statistic is high
+    partitioning: Literal["cluster", "quadtree"] = "cluster"
+    # approximate audit on a region-stratified sample of the individuals, with a
+    # confidence interval of every statistic
+    approx_fraction: Optional[float] = Field(None, gt=0, le=1)
+    max_individuals: Optional[int] = Field(None, ge=1)
+    # estimator of the threshold: the order statistic of the null maxima, a tail model
+    # of the maxima, or "auto" (the Gumbel tail when signif_level * n_worlds < 10)
+    threshold_method: Literal["auto", "empirical", "gpd", "gumbel"] = "auto"
+    # "analytic" skips the simulation for a conservative threshold and p-values
+    significance: Literal["simulated", "analytic"] = "simulated"
 
     @model_validator(mode="after")
     def _cross_field(self):
@@ -103,6 +122,30 @@ class AuditRequest(BaseModel):
         return self
 
 
+class BatchAuditRequest(AuditRequest):
+    # (models x individuals) predictions audited against the partitioning of indiv_info,
+    # whose own y_pred is not used
+    y_preds: List[List[Annotated[int, Field(ge=0, le=1)]]] = Field(..., min_length=1)
+    # models whose number of positives fall in the same bucket share a null distribution
+    p_bucket: int = Field(1, ge=1)
+
+    @model_validator(mode="after")
+    def _validate_y_preds(self):
+        bad = [m for m, y in enumerate(self.y_preds) if len(y) != len(self.indiv_info)]
+        if bad:
+            raise ValueError(
+                f"every row of y_preds must have one prediction per individual (bad rows {bad[:10]})"
+            )
+        # the quadtree is refined from one prediction vector, not shared across models
+        if self.partitioning == "quadtree":
+            raise ValueError(
+                "partitioning='quadtree' is not supported for batch audits"
+            )
+        if self.approx_fraction is not None or self.max_individuals is not None:
+            raise ValueError("approximate audits are not supported for batch audits")
+        return self
+
+
 class MitigationRequest(BaseModel):
     model_config = ConfigDict(extra="forbid")
 
@@ -110,8 +153,11 @@ class MitigationRequest(BaseModel):
     budget_constr: float = Field(0.2, ge=0.0, le=1.0)
     pr_constr: float = Field(0.1, ge=0.0, le=1.0)
     equal_opp: bool = True
-    n_worlds: int = Field(400, ge=1, le=100_000)
+    n_worlds: NWorlds = 400
+    n_worlds_tol: float = Field(0.05, gt=0, lt=1)
+    max_n_worlds: int = Field(100_000, ge=1, le=100_000)
     signif_level: float = Field(0.005, gt=0, lt=1)
+    threshold_method: Literal["auto", "empirical", "gpd", "gumbel"] = "auto"
     work_limit: Optional[int] = Field(30, ge=1)
 
 
@@ -124,6 +170,8 @@ class RelabelingRequest(MitigationRequest):
         # reuse AuditRequest logic for indiv/region checks
         AuditRequest(
             n_worlds=self.n_worlds,
+            n_worlds_tol=self.n_worlds_tol,
+            max_n_worlds=self.max_n_worlds,
             signif_level=self.signif_level,
             equal_opp=self.equal_opp,
             indiv_info=self.indiv_info,
@@ -211,11 +259,26 @@ class StatEntry(BaseModel):
     idx: int
     stat: float
     is_signif: bool = False
+    p_value: Optional[float] = None
+    # approximate audits only: confidence interval of the statistic, and whether it
+    # contains the threshold
+    stat_ci: Optional[List[float]] = None
+    ambiguous: Optional[bool] = None
+
+
+class SignifLevelEntry(BaseModel):
+    signif_level: float
+    signif_thresh: float
+    total_signif_regions: int
 
 
 class AuditResponse(BaseModel):
     sbi_score: float
     signif_thresh: float
+    signif_thresh_ci: Optional[List[float]] = None
+    n_worlds_used: Optional[int] = None
+    threshold_method: Optional[str] = None
+    signif_levels: Optional[List[SignifLevelEntry]] = None
     total_signif_regions: int
     fair_map_html: str
     fair_map_image: str
@@ -224,6 +287,19 @@ class AuditResponse(BaseModel):
     distribution_map_image: str
 
 
+class BatchAuditEntry(BaseModel):
+    model: int
+    sbi_score: float
+    signif_thresh: float
+    n_worlds_used: Optional[int] = None
+    total_signif_regions: int
+    stats: List[StatEntry]
+
+
+class BatchAuditResponse(BaseModel):
+    results: List[BatchAuditEntry]
+
+
 class Metric(BaseModel):
     name: str
     value: float
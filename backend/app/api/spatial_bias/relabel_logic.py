@@ -15,7 +15,11 @@ from app.services.spatial_bias.utils.api_visual_utils import (
 from app.services.spatial_bias.methods.models.optimization_model import (
     SpatialOptimFairnessModel,
 )
-from app.services.spatial_bias.utils.data_utils import get_metric, get_positive_rates
+from app.services.spatial_bias.utils.data_utils import (
+    get_metric,
+    get_positive_rates,
+    get_prediction_changes,
+)
 from app.services.spatial_bias.utils.geo_utils import (
     compute_map_info,
     compute_optimal_radius,
@@ -49,16 +53,21 @@ def run_relabel_mitigation(req: RelabelingRequest) -> RelabelingResponse:
         else []
     )
 
-    audit_result_before = run_audit_pipeline(
-        req=AuditRequest(
-            n_worlds=req.n_worlds,
-            signif_level=req.signif_level,
-            equal_opp=req.equal_opp,
-            indiv_info=req.indiv_info,
-            region_info=req.region_info,
-        ),
+    audit_req = AuditRequest(
+        n_worlds=req.n_worlds,
+        n_worlds_tol=req.n_worlds_tol,
+        max_n_worlds=req.max_n_worlds,
+        signif_level=req.signif_level,
+        threshold_method=req.threshold_method,
+        equal_opp=req.equal_opp,
+        indiv_info=req.indiv_info,
+        region_info=req.region_info,
+    )
+    audit_result_before, audit_state = run_audit_pipeline(
+        req=audit_req,
         zoom_start=9,
         synth_layout=synth_layout,
+        with_state=True,
     )
 
     # Step 3: Run mitigation
@@ -81,21 +90,11 @@ def run_relabel_mitigation(req: RelabelingRequest) -> RelabelingResponse:
     # Get the new predictions
     mitigated_pred = fair_model.predict(region_indices, y_pred, apply_fit_flips=True)
 
-    # Build new indiv_info with mitigated predictions
-    mitigated_indiv_info = [
-        {**ind.model_dump(), "y_pred": int(mitigated_pred[i])}
-        for i, ind in enumerate(req.indiv_info)
-    ]
-
-    # Step 4: Compute metrics after mitigation
+    # Step 4: Compute metrics after mitigation, updating the audit with the flips only
     audit_result_after = run_audit_pipeline(
-        req=AuditRequest(
-            n_worlds=req.n_worlds,
-            signif_level=req.signif_level,
-            equal_opp=req.equal_opp,
-            indiv_info=mitigated_indiv_info,
-            region_info=req.region_info,
-        ),
+        req=audit_req,
+        state=audit_state,
+        changes=get_prediction_changes(y_pred, mitigated_pred),
         max_stat=max(
             [
                 audit_result_before.stats[i].stat
@@ -4,6 +4,8 @@ from fastapi import APIRouter
 from .models import (
     AuditRequest,
     AuditResponse,
+    BatchAuditRequest,
+    BatchAuditResponse,
     RelabelingRequest,
     ThresholdAdjustmentRequest,
     RelabelingResponse,
@@ -11,6 +13,7 @@ from .models import (
 )
 from .audit_logic import (
     run_audit_pipeline,
+    run_batch_audit_pipeline,
 )
 
 from .relabel_logic import (
@@ -29,6 +32,11 @@ def audit_endpoint(req: AuditRequest):
     return run_audit_pipeline(req)
 
 
+@router.post("/audit/batch", response_model=BatchAuditResponse)
+def batch_audit_endpoint(req: BatchAuditRequest):
+    return run_batch_audit_pipeline(req)
+
+
 @router.post("/mitigate/relabel", response_model=RelabelingResponse)
 def relabel_endpoint(req: RelabelingRequest):
     return run_relabel_mitigation(req)
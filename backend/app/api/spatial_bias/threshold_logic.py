@@ -20,6 +20,7 @@ from app.services.spatial_bias.methods.models.optimization_model import (
 from app.services.spatial_bias.utils.data_utils import (
     get_metric,
     get_positive_rates,
+    get_prediction_changes,
 )
 from app.services.spatial_bias.utils.scores import get_fair_stat_ratios
 from app.services.spatial_bias.utils.geo_utils import (
@@ -75,16 +76,21 @@ def run_threshold_mitigation(
         else []
     )
 
-    audit_result_before = run_audit_pipeline(
-        req=AuditRequest(
-            n_worlds=req.n_worlds,
-            signif_level=req.signif_level,
-            equal_opp=req.equal_opp,
-            indiv_info=req.predict_indiv_info,
-            region_info=req.predict_region_info,
-        ),
+    audit_req = AuditRequest(
+        n_worlds=req.n_worlds,
+        n_worlds_tol=req.n_worlds_tol,
+        max_n_worlds=req.max_n_worlds,
+        signif_level=req.signif_level,
+        threshold_method=req.threshold_method,
+        equal_opp=req.equal_opp,
+        indiv_info=req.predict_indiv_info,
+        region_info=req.predict_region_info,
+    )
+    audit_result_before, audit_state = run_audit_pipeline(
+        req=audit_req,
         zoom_start=9,
         synth_layout=synth_layout,
+        with_state=True,
     )
 
     max_stat = max(
@@ -120,22 +126,11 @@ def run_threshold_mitigation(
         region_indices_test, y_pred_probs_test, apply_fit_flips=False
     )
 
-    mitigated_indiv_info = []
-    for i, ind in enumerate(req.predict_indiv_info):
-        new_ind = ind.model_dump()
-        new_ind["y_pred"] = int(mitigated_pred[i])
-        new_ind.pop("y_pred_prob", None)  # remove to comply with AuditRequest
-        mitigated_indiv_info.append(new_ind)
-
-    # Step 4: Compute metrics after mitigation
+    # Step 4: Compute metrics after mitigation, updating the audit with the changes only
     audit_result_after = run_audit_pipeline(
-        req=AuditRequest(
-            n_worlds=req.n_worlds,
-            signif_level=req.signif_level,
-            equal_opp=req.equal_opp,
-            indiv_info=mitigated_indiv_info,
-            region_info=req.predict_region_info,
-        ),
+        req=audit_req,
+        state=audit_state,
+        changes=get_prediction_changes(y_pred_test, mitigated_pred),
         max_stat=max_stat,
         zoom_start=9,
         synth_layout=synth_layout,
@@ -0,0 +1,67 @@
+# this script compares the two statistic kernels of the alternative worlds scan
+# ("float" with log calls and "table" with a precomputed k*log(k) table) on a
+# synthetic partitioning of 1M individuals.
+# Run it with the backend directory in PYTHONPATH.
+
+import time
+
+import numpy as np
+
+from app.services.spatial_bias.utils.audit_utils import get_alt_worlds_maxima
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
+from app.services.spatial_bias.utils.scores import (
+    compute_statistics_table,
+    compute_statistics_vec,
+    get_xlogx_table,
+)
+
+N = 1_000_000
+P = 300_000
+n_regions = 10_000
+n_worlds = 200
+seed = 42
+
+
+def time_it(fn, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+rng = np.random.default_rng(seed)
+## non-overlapping partitioning of 1M individuals into regions of random sizes
+cuts = np.sort(rng.choice(np.arange(1, N), n_regions - 1, replace=False))
+regions = np.split(rng.permutation(N), cuts)
+membership = RegionMembership.from_regions(regions, N)
+
+## scoring step only: (regions x worlds) counts with per-world totals
+n_s = membership.sizes[:, None]
+counts = rng.binomial(n_s, P / N, size=(n_regions, n_worlds))
+worlds_P = counts.sum(axis=0)
+table = get_xlogx_table(N)
+
+t_float = time_it(lambda: compute_statistics_vec(n_s, counts, N, worlds_P))
+t_table = time_it(lambda: compute_statistics_table(n_s, counts, N, worlds_P, table))
+t_build = time_it(lambda: get_xlogx_table(N))
+max_diff = np.abs(
+    compute_statistics_vec(n_s, counts, N, worlds_P)[2]
+    - compute_statistics_table(n_s, counts, N, worlds_P, table)[2]
+).max()
+
+print(f"scoring {n_regions} regions x {n_worlds} worlds, N={N}")
+print(f"  float kernel: {t_float:.3f}s")
+print(f"  table kernel: {t_table:.3f}s (table built in {t_build:.3f}s)")
+print(f"  speedup: {t_float / t_table:.1f}x, max score difference: {max_diff:.2e}")
+
+## end to end with the counts engine, where scoring dominates
+for stat_kernel in ["float", "table"]:
+    elapsed = time_it(
+        lambda: get_alt_worlds_maxima(
+            membership, N, P, 0, n_worlds, seed, "counts", stat_kernel=stat_kernel
+        ),
+        repeat=1,
+    )
+    print(f"counts engine, {stat_kernel} kernel: {elapsed:.3f}s for {n_worlds} worlds")
@@ -3,7 +3,39 @@ import numpy as np
 import pandas as pd
 
 
-def run_spatial_audit(y_pred, y_true, region_indices, signif_level=0.005, n_worlds=400):
+def run_spatial_audit(
+    y_pred,
+    y_true,
+    region_indices,
+    signif_level=0.005,
+    n_worlds=400,
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    with_info=False,
+    signif_levels=None,
+    with_state=False,
+    approx_fraction=None,
+    max_individuals=None,
+    threshold_method="empirical",
+    significance="simulated",
+    null_model=None,
+    seed=42,
+):
+    # with approx_fraction or max_individuals, the audit runs on a sample stratified by
+    # region and the dataframe gets per-region statistic intervals and an "ambiguous"
+    # flag, see get_signif_thresh_scanned_regions
+
+    # threshold_method="auto" reads the threshold from a Gumbel tail of the null maxima
+    # when fewer than 10 worlds are expected above it (signif_level * n_worlds < 10),
+    # see NullDistribution. The default is the empirical order statistic, like the
+    # other audits; the API requests default to "auto"
+
+    # significance="analytic" skips the simulation: the threshold and the p-values
+    # are conservative Bonferroni/Chernoff bounds, see AnalyticNullDistribution
+
+    # null_model replaces the simulation of the regions when they were selected from a
+    # larger scanned family, e.g. the QuadTreeNullModel of quadtree leaves
+
     # print(f"input:")
     # print(f"y_pred: {y_pred}")
     # print(f"y_true: {y_true}")
@@ -13,14 +45,85 @@ def run_spatial_audit(y_pred, y_true, region_indices, signif_level=0.005, n_worl
         get_signif_thresh_scanned_regions,
     )
 
-    df_scanned_regs, signif_thresh = get_signif_thresh_scanned_regions(
+    df_scanned_regs, signif_thresh, info, state = get_signif_thresh_scanned_regions(
         signif_level=signif_level,
         n_alt_worlds=n_worlds,
         regions=region_indices,
         y_pred=y_pred,
         y_true=y_true,
-        seed=42,
+        seed=seed,
+        n_worlds_tol=n_worlds_tol,
+        max_n_worlds=max_n_worlds,
+        with_info=True,
+        signif_levels=signif_levels,
+        with_state=True,
+        approx_fraction=approx_fraction,
+        max_individuals=max_individuals,
+        threshold_method=threshold_method,
+        significance=significance,
+        null_model=null_model,
     )
 
     sbi = np.mean(df_scanned_regs["statistic"])
+    outputs = (df_scanned_regs, signif_thresh, sbi)
+    if with_info:
+        outputs += (info,)
+    if with_state:
+        outputs += (state,)
+
+    return outputs
+
+
+def rerun_spatial_audit(state, changes, with_info=False):
+    # updates the audit of `run_spatial_audit(..., with_state=True)` after the
+    # (index, old, new) prediction changes, without rescanning the individuals
+    state.apply_changes(changes)
+    df_scanned_regs, signif_thresh, info = state.results()
+
+    sbi = np.mean(df_scanned_regs["statistic"])
+    if with_info:
+        return df_scanned_regs, signif_thresh, sbi, info
+
     return df_scanned_regs, signif_thresh, sbi
+
+
+def run_spatial_audit_batch(
+    y_preds,
+    y_true,
+    region_indices,
+    signif_level=0.005,
+    n_worlds=400,
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    p_bucket=1,
+    with_info=False,
+    threshold_method="empirical",
+    significance="simulated",
+    seed=42,
+):
+    # every model is audited with the same seed, so its results are the ones of
+    # run_spatial_audit with that seed
+
+    from app.services.spatial_bias.utils.audit_utils import (
+        get_signif_thresh_scanned_regions_batch,
+    )
+
+    df_scanned_regs, signif_threshs, info = get_signif_thresh_scanned_regions_batch(
+        signif_level=signif_level,
+        n_alt_worlds=n_worlds,
+        regions=region_indices,
+        y_preds=y_preds,
+        y_true=y_true,
+        seed=seed,
+        n_worlds_tol=n_worlds_tol,
+        max_n_worlds=max_n_worlds,
+        p_bucket=p_bucket,
+        threshold_method=threshold_method,
+        significance=significance,
+    )
+
+    sbis = df_scanned_regs.groupby("model")["statistic"].mean().to_numpy()
+    if with_info:
+        return df_scanned_regs, signif_threshs, sbis, info
+
+    return df_scanned_regs, signif_threshs, sbis
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 import numpy as np
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
 
 
 class SpatialFairnessModel(ABC):
@@ -185,17 +186,11 @@ class SpatialFairnessModel(ABC):
                 - pos_points_per_region (list): Lists of positive-label points per region.
         """
 
-        pos_y_true_indices = np.where(np.array(y_true) == 1)[0]
-        point_2_new_pos_set_idx = {
-            point: i for i, point in enumerate(pos_y_true_indices)
-        }
+        pos_mask = np.asarray(y_true) == 1
+        pos_y_true_indices = np.where(pos_mask)[0]
 
-        pos_points_per_region = [[] for _ in range(len(points_per_region))]
-        for region_idx, pts in enumerate(points_per_region):
-            for point in pts:
-                if point in pos_y_true_indices:
-                    pos_points_per_region[region_idx].append(
-                        point_2_new_pos_set_idx[point]
-                    )
+        pos_membership = RegionMembership.from_regions(
+            points_per_region, len(pos_mask)
+        ).subset(pos_mask)
 
-        return pos_y_true_indices, pos_points_per_region
+        return pos_y_true_indices, pos_membership.to_lists()
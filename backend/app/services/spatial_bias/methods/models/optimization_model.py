@@ -7,6 +7,7 @@ from app.services.spatial_bias.methods.models.abstract_model import (
     SpatialFairnessModel,
 )
 import numpy as np
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
 from app.services.spatial_bias.utils.thresholds_utils import (
     adjusted_thresholds,
     convert_indiv_sol_2_regions_sol,
@@ -507,13 +508,7 @@ class SpatialOptimFairnessModel(SpatialFairnessModel):
         Returns:
             bool: True if regions are overlapping, False otherwise.
         """
-        seen_points = set()
-        for region in points_per_region:
-            for point in region:
-                if point in seen_points:
-                    return True
-                seen_points.add(point)
-        return False
+        return RegionMembership.from_regions(points_per_region).is_overlapping()
 
     def _combined_regions(self, points_per_region):
         """
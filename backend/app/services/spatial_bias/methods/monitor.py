@@ -0,0 +1,432 @@
+# online audit of a stream of scored events: per-region counts are kept over sliding
+# time windows and the regions are periodically scanned against a cached threshold
+import json
+import math
+import os
+import queue
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RegionWindowCounts:
+    """
+    Per-region counts of the events of a sliding time window.
+
+    The window is split into `n_buckets` time buckets kept in a ring buffer. An event is
+    added to the bucket of its timestamp and to the running window sums, and when time
+    advances, the buckets that leave the window are subtracted from the sums and
+    cleared, so every update costs O(1) plus the buckets that expired.
+
+    Attributes:
+        n (np.ndarray): Events of every region in the window.
+        p (np.ndarray): Positive predictions of every region in the window.
+        N (int): Events in the window, including the ones outside all the regions.
+        P (int): Positive predictions in the window.
+    """
+
+    def __init__(self, n_regions, window, n_buckets=60):
+        """
+        Args:
+            n_regions (int): Number of regions.
+            window (float): Length of the window, in the unit of the timestamps.
+            n_buckets (int, optional): Number of time buckets of the window. Defaults to 60.
+        """
+
+        self.window = window
+        self.n_buckets = n_buckets
+        self.bucket_width = window / n_buckets
+        self._bucket_n = np.zeros((n_buckets, n_regions), dtype=np.int64)
+        self._bucket_p = np.zeros((n_buckets, n_regions), dtype=np.int64)
+        self._bucket_N = np.zeros(n_buckets, dtype=np.int64)
+        self._bucket_P = np.zeros(n_buckets, dtype=np.int64)
+        self.n = np.zeros(n_regions, dtype=np.int64)
+        self.p = np.zeros(n_regions, dtype=np.int64)
+        self.N = 0
+        self.P = 0
+        self._current = None
+
+    def advance(self, timestamp):
+        """
+        Moves the window to a timestamp, expiring the buckets that left it.
+
+        Args:
+            timestamp (float): Current time.
+        """
+
+        bucket = math.floor(timestamp / self.bucket_width)
+        if self._current is None:
+            self._current = bucket
+            return
+        if bucket <= self._current:
+            return
+
+        for expired in range(
+            self._current + 1, min(bucket, self._current + self.n_buckets) + 1
+        ):
+            slot = expired % self.n_buckets
+            self.n -= self._bucket_n[slot]
+            self.p -= self._bucket_p[slot]
+            self.N -= int(self._bucket_N[slot])
+            self.P -= int(self._bucket_P[slot])
+            self._bucket_n[slot] = 0
+            self._bucket_p[slot] = 0
+            self._bucket_N[slot] = 0
+            self._bucket_P[slot] = 0
+        self._current = bucket
+
+    def add(self, timestamp, region_id, y_pred):
+        """
+        Adds an event, ignored if it is older than the window.
+
+        Args:
+            timestamp (float): Time of the event.
+            region_id (int): Region of the event, -1 for none.
+            y_pred (int): Predicted label of the event.
+        """
+
+        self.advance(timestamp)
+        bucket = math.floor(timestamp / self.bucket_width)
+        if bucket <= self._current - self.n_buckets:
+            return
+
+        slot = bucket % self.n_buckets
+        self._bucket_N[slot] += 1
+        self._bucket_P[slot] += y_pred
+        self.N += 1
+        self.P += y_pred
+        if region_id >= 0:
+            self._bucket_n[slot, region_id] += 1
+            self._bucket_p[slot, region_id] += y_pred
+            self.n[region_id] += 1
+            self.p[region_id] += y_pred
+
+
+class SpatialBiasMonitor:
+    """
+    Sliding-window audit of a stream of scored events over non-overlapping regions.
+
+    Every window keeps its counts in a `RegionWindowCounts`. On `check`, the statistics
+    of the regions are computed from the window counts and compared to the threshold of
+    a null distribution simulated in count space. The null is cached per bucket of the
+    window totals: N in buckets of relative width `size_tol` and the positive rate
+    P / N in buckets of width `rate_bucket`, and simulated for the representative N and
+    P of the bucket. The maximum statistic does not depend on the order of the regions,
+    so the null is simulated for the sorted shares of the regions in the window (the
+    size profile) and reused while the profile of the windows in the bucket stays within
+    a total variation distance of `profile_tol` of it. Steady traffic then keeps hitting
+    the same null, however many regions there are.
+
+    Alerts are emitted when a region becomes significant in a window, and when it stops
+    being significant.
+    """
+
+    def __init__(
+        self,
+        n_regions,
+        windows=None,
+        signif_level=0.005,
+        n_worlds=400,
+        equal_opp=False,
+        n_buckets=60,
+        size_tol=0.1,
+        rate_bucket=0.01,
+        profile_tol=0.1,
+        seed=42,
+        max_cached_nulls=64,
+        threshold_method="empirical",
+    ):
+        """
+        Args:
+            n_regions (int): Number of regions.
+            windows (dict, optional): Length of every window by name, in the unit of the
+                timestamps. Defaults to 1h, 24h and 7d in seconds.
+            signif_level (float, optional): Significance level. Defaults to 0.005.
+            n_worlds (int, optional): Number of alternative worlds of a null. Defaults to 400.
+            equal_opp (bool, optional): Whether to only count the events with y_true == 1.
+                Defaults to False.
+            n_buckets (int, optional): Number of time buckets per window. Defaults to 60.
+            size_tol (float, optional): Relative width of the buckets of N sharing a
+                null. Defaults to 0.1.
+            rate_bucket (float, optional): Width of the buckets of the positive rate
+                sharing a null. Defaults to 0.01.
+            profile_tol (float, optional): Total variation distance between the size
+                profile of a window and the one of a cached null beyond which the null is
+                simulated again. Defaults to 0.1.
+            seed (int, optional): Seed of the null simulations. Defaults to 42.
+            max_cached_nulls (int, optional): Maximum number of cached nulls. Defaults to 64.
+            threshold_method (str, optional): Threshold estimator, see
+                `NullDistribution`. Defaults to "empirical".
+        """
+
+        from app.services.spatial_bias.utils.null_cache import NullCache
+
+        if windows is None:
+            windows = {"1h": 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600}
+
+        self.n_regions = n_regions
+        self.signif_level = signif_level
+        self.n_worlds = n_worlds
+        self.equal_opp = equal_opp
+        self.size_tol = size_tol
+        self.rate_bucket = rate_bucket
+        self.profile_tol = profile_tol
+        self.seed = seed
+        self.threshold_method = threshold_method
+        self.counts = {
+            name: RegionWindowCounts(n_regions, window, n_buckets)
+            for name, window in windows.items()
+        }
+        self.signif = {name: np.zeros(n_regions, dtype=bool) for name in windows}
+        self._nulls = NullCache(max_entries=max_cached_nulls)
+        ## size profile every cached null was simulated for
+        self._profiles = OrderedDict()
+        self.max_cached_nulls = max_cached_nulls
+
+    def update(self, timestamp, region_id, y_pred, y_true=None):
+        """
+        Adds a scored event to every window.
+
+        Args:
+            timestamp (float): Time of the event.
+            region_id (int): Region of the event, -1 for none.
+            y_pred (int): Predicted label of the event.
+            y_true (int, optional): True label, required for equal opportunity.
+        """
+
+        if self.equal_opp and y_true != 1:
+            return
+
+        for counts in self.counts.values():
+            counts.add(timestamp, int(region_id), int(y_pred))
+
+    def get_null_bucket(self, name):
+        """
+        Rounds the totals of a window to the representative totals of their bucket.
+
+        Args:
+            name (str): Name of the window.
+
+        Returns:
+            tuple: The representative N and P, and the key of the bucket.
+        """
+
+        counts = self.counts[name]
+        log_base = math.log1p(self.size_tol)
+
+        N_bucket = round(math.log(counts.N) / log_base)
+        rate_bucket = round(counts.P / counts.N / self.rate_bucket)
+
+        N = max(1, round(math.exp(N_bucket * log_base)))
+        ## a rate of exactly 0 or 1 has no null, the extreme buckets are kept inside
+        rate = np.clip(
+            rate_bucket * self.rate_bucket,
+            self.rate_bucket / 2,
+            1 - self.rate_bucket / 2,
+        )
+        P = int(round(rate * N))
+
+        return N, P, f"{N_bucket}|{rate_bucket}"
+
+    def get_size_profile(self, name):
+        """
+        Returns:
+            np.ndarray: The shares of the events of a window in every region, sorted in
+            decreasing order, followed by the share outside the regions.
+        """
+
+        counts = self.counts[name]
+        shares = np.sort(counts.n)[::-1] / counts.N
+
+        return np.append(shares, 1 - shares.sum())
+
+    def get_null_distribution(self, name):
+        """
+        Looks up (or simulates) the null distribution of the current bucket of a window,
+        see `get_null_bucket`.
+
+        Args:
+            name (str): Name of the window.
+
+        Returns:
+            NullDistribution: The null distribution.
+        """
+
+        from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+        from app.services.spatial_bias.utils.membership_utils import CountSpaceRegions
+        from app.services.spatial_bias.utils.null_distribution import NullDistribution
+
+        N, P, key = self.get_null_bucket(name)
+        profile = self.get_size_profile(name)
+        maxima = self._nulls.get(key)
+        reference = self._profiles.get(key)
+
+        if (
+            maxima is None
+            or reference is None
+            or 0.5 * np.abs(profile - reference).sum() > self.profile_tol
+        ):
+            ## rounded down, so that the regions never hold more than N events
+            n_s = np.floor(profile[:-1] * N).astype(np.int64)
+            null_distr = scan_alt_worlds(
+                self.n_worlds,
+                CountSpaceRegions(n_s),
+                N,
+                P,
+                self.seed,
+                engine="counts",
+            )
+            self._nulls.put(key, null_distr.maxima)
+            self._profiles[key] = profile
+            self._profiles.move_to_end(key)
+            while len(self._profiles) > self.max_cached_nulls:
+                self._profiles.popitem(last=False)
+        else:
+            null_distr = NullDistribution(len(maxima))
+            null_distr.add(maxima)
+        null_distr.threshold_method = self.threshold_method
+
+        return null_distr
+
+    def check(self, timestamp=None):
+        """
+        Scans the regions of every window and lists the significance changes.
+
+        Args:
+            timestamp (float, optional): Current time, to expire old events first.
+                Defaults to None.
+
+        Returns:
+            list: An alert dict ("window", "region", "event" ("signif" or "cleared"),
+            "statistic", "p_value", "signif_thresh", "N" and "P") per region whose
+            significance changed since the previous check.
+        """
+
+        from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+        alerts = []
+        for name, counts in self.counts.items():
+            if timestamp is not None:
+                counts.advance(timestamp)
+            if counts.N == 0:
+                continue
+
+            null_distr = self.get_null_distribution(name)
+            signif_thresh = null_distr.threshold(self.signif_level)
+            _, _, scores = compute_statistics_vec(
+                counts.n, counts.p, counts.N, counts.P
+            )
+            ## a zero statistic (e.g. no events in the region) is never flagged, even
+            ## against a zero threshold
+            signif = (scores >= signif_thresh) & (scores > 0)
+            p_values = null_distr.p_values(scores)
+
+            for region in np.flatnonzero(signif != self.signif[name]):
+                alerts.append(
+                    {
+                        "window": name,
+                        "region": int(region),
+                        "event": "signif" if signif[region] else "cleared",
+                        "statistic": float(scores[region]),
+                        "p_value": float(p_values[region]),
+                        "signif_thresh": signif_thresh,
+                        "N": counts.N,
+                        "P": counts.P,
+                    }
+                )
+            self.signif[name] = signif
+
+        return alerts
+
+
+def tail_events(path, poll_interval=1.0, from_start=True, stop=None):
+    """
+    Follows a JSON-lines file of events, like `tail -f`.
+
+    Every line is a JSON object with "ts", "region_id", "y_pred" and optionally
+    "y_true". Partial lines are only parsed once complete.
+
+    Args:
+        path (str): Path of the file.
+        poll_interval (float, optional): Seconds between polls at the end of the file.
+            Defaults to 1.0.
+        from_start (bool, optional): Whether to read the existing lines first. Defaults
+            to True.
+        stop (callable, optional): Called at the end of the file; the tail stops when it
+            returns True. Defaults to None (follow forever).
+
+    Yields:
+        dict: The next event.
+    """
+
+    with open(path, "r") as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        partial = ""
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                if partial.endswith("\n"):
+                    if partial.strip():
+                        yield json.loads(partial)
+                    partial = ""
+                continue
+            if stop is not None and stop():
+                return
+            time.sleep(poll_interval)
+
+
+def iter_queue_events(events_queue, sentinel=None, timeout=None):
+    """
+    Reads events from a `queue.Queue` until the sentinel (or a timeout).
+
+    Args:
+        events_queue (queue.Queue): Queue of event dicts, see `tail_events`.
+        sentinel (optional): Item that ends the stream. Defaults to None.
+        timeout (float, optional): Seconds to wait for an event before stopping.
+            Defaults to None (wait forever).
+
+    Yields:
+        dict: The next event.
+    """
+
+    while True:
+        try:
+            event = events_queue.get(timeout=timeout)
+        except queue.Empty:
+            return
+        if event is sentinel:
+            return
+        yield event
+
+
+def run_monitor(monitor, events, check_every=60, on_alert=None):
+    """
+    Feeds a stream of events to a monitor and checks it periodically.
+
+    Args:
+        monitor (SpatialBiasMonitor): The monitor.
+        events (iterable): Event dicts, e.g. from `tail_events` or `iter_queue_events`.
+        check_every (float, optional): Event time between two checks. Defaults to 60.
+        on_alert (callable, optional): Called with every alert, e.g. `print` or a
+            logger method. Defaults to None (the alerts are dropped).
+
+    Returns:
+        SpatialBiasMonitor: The monitor, after the last event.
+    """
+
+    next_check = None
+    for event in events:
+        ts = event["ts"]
+        monitor.update(ts, event["region_id"], event["y_pred"], event.get("y_true"))
+
+        next_check = ts + check_every if next_check is None else next_check
+        if ts >= next_check:
+            for alert in monitor.check(ts):
+                if on_alert is not None:
+                    on_alert(alert)
+            next_check = ts + check_every
+
+    return monitor
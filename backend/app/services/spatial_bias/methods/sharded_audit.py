@@ -0,0 +1,493 @@
+# map-reduce audit of individuals split into shards (CSV/Parquet files). Every step
+# reads its inputs from files and writes an .npz file, so the shards can be mapped on
+# different machines and only the small count files are gathered for the reduce:
+#   1. map_shard_counts on every shard, reduce_shard_counts on their outputs (N, P),
+#   2. for null_mode="shards" (required for overlapping regions), map_shard_null on
+#      every shard with the reduced N and P, and reduce_shard_nulls on their outputs,
+#   3. audit_reduced_counts on the reduced counts (and null).
+# run_sharded_audit drives the three steps with local worker processes.
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from app.services.spatial_bias.methods.streaming_audit import iter_table_chunks
+
+COUNT_NAMES = ["n", "p", "n_true", "tp"]
+
+
+def get_shard_world_rng(seed, world_idx, shard_idx):
+    """
+    Returns the random generator of the draws of one shard in one alternative world.
+
+    Args:
+        seed (int): Seed of the simulation.
+        world_idx (int): Index of the world.
+        shard_idx (int): Index of the shard.
+
+    Returns:
+        np.random.Generator: The generator of the shard in the world.
+    """
+
+    from app.services.spatial_bias.utils.rng_utils import get_world_rng
+
+    ## sub-stream 0 of a world is the one of the in-memory engines
+    return get_world_rng(seed, world_idx, stream_idx=shard_idx + 1)
+
+
+def parse_region_ids(value):
+    """
+    Parses the region cell of an individual into its region ids.
+
+    Args:
+        value: An integer, a string of "|"-separated region ids, or an empty cell
+            (None, NaN or "").
+
+    Returns:
+        list: The region ids, without the negative ones (no region).
+    """
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+
+    ids = []
+    for token in str(value).split("|"):
+        token = token.strip()
+        if token in ["", "nan"]:
+            continue
+        ## integer columns with empty cells are read as floats, e.g. "3.0"
+        region_id = int(float(token))
+        if region_id >= 0:
+            ids.append(region_id)
+
+    return ids
+
+
+def get_chunk_membership(region_values, n_regions):
+    """
+    Builds the (individuals x regions) membership of a chunk from its region column.
+
+    Pandas infers the type of the column per chunk, so the same column may come as
+    integers, floats (integers with empty cells) or strings. Negative ids, empty cells
+    and NaNs mean no region.
+
+    Args:
+        region_values (np.ndarray): Region of every individual as a number (-1 for
+            none), or as a string of "|"-separated region ids for overlapping regions.
+        n_regions (int): Total number of regions.
+
+    Raises:
+        ValueError: If a region id is not below n_regions.
+
+    Returns:
+        scipy.sparse.csr_matrix: The membership of the chunk.
+    """
+
+    if np.issubdtype(region_values.dtype, np.number):
+        region_values = region_values.astype(np.float64)
+        inside = region_values >= 0
+        flat = region_values[inside].astype(np.int64)
+        offsets = np.zeros(len(region_values) + 1, dtype=np.int64)
+        np.cumsum(inside, out=offsets[1:])
+    else:
+        ids = [parse_region_ids(value) for value in region_values]
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum([len(row) for row in ids], out=offsets[1:])
+        flat = np.fromiter((r for row in ids for r in row), np.int64, offsets[-1])
+
+    if np.any(flat >= n_regions):
+        raise ValueError(
+            f"Region id {flat.max()} is out of range for {n_regions} regions"
+        )
+
+    return sparse.csr_matrix(
+        (np.ones(len(flat), dtype=np.int64), flat, offsets),
+        shape=(len(region_values), n_regions),
+    )
+
+
+def map_shard_counts(
+    shard_path,
+    out_path,
+    n_regions,
+    region_col="region_ids",
+    pred_col="y_pred",
+    true_col="y_true",
+    equal_opp=False,
+    chunk_size=1_000_000,
+):
+    """
+    Counts the individuals and positives of every region in a shard.
+
+    Args:
+        shard_path (str): CSV or Parquet file of the shard, see `iter_table_chunks`.
+        out_path (str): .npz file of the partial counts ("n", "p", "n_true", "tp" per
+            region, "totals" of the same counts over all the individuals and
+            "overlaps", the individuals and the ones with y_true == 1 that belong to
+            more than one region).
+        n_regions (int): Total number of regions.
+        region_col (str, optional): Column of the regions, see `get_chunk_membership`.
+            Defaults to "region_ids".
+        pred_col (str, optional): Column of the predicted labels. Defaults to "y_pred".
+        true_col (str, optional): Column of the true labels. Defaults to "y_true".
+        equal_opp (bool, optional): Whether the true labels are read. Defaults to False.
+        chunk_size (int, optional): Number of rows per chunk. Defaults to 1_000_000.
+
+    Returns:
+        str: The output path.
+    """
+
+    counts = {name: np.zeros(n_regions, dtype=np.int64) for name in COUNT_NAMES}
+    totals = np.zeros(len(COUNT_NAMES), dtype=np.int64)
+    overlaps = np.zeros(2, dtype=np.int64)
+
+    columns = [region_col, pred_col] + ([true_col] if equal_opp else [])
+    for chunk in iter_table_chunks(shard_path, columns, chunk_size):
+        membership = get_chunk_membership(chunk[region_col].to_numpy(), n_regions)
+        y_pred = chunk[pred_col].to_numpy().astype(np.int64)
+        y_true = (
+            chunk[true_col].to_numpy().astype(np.int64)
+            if equal_opp
+            else np.zeros_like(y_pred)
+        )
+
+        values = np.column_stack(
+            [np.ones_like(y_pred), y_pred, y_true, y_pred * y_true]
+        )
+        partial = membership.T @ values
+        for i, name in enumerate(COUNT_NAMES):
+            counts[name] += partial[:, i]
+        totals += values.sum(axis=0)
+
+        multiple = np.diff(membership.indptr) > 1
+        overlaps += [multiple.sum(), (multiple & (y_true == 1)).sum()]
+
+    np.savez(out_path, totals=totals, overlaps=overlaps, **counts)
+
+    return out_path
+
+
+def reduce_shard_counts(paths):
+    """
+    Sums the partial counts of the shards.
+
+    Args:
+        paths (list): .npz files written by `map_shard_counts`.
+
+    Returns:
+        dict: The summed "n", "p", "n_true", "tp", "totals" and "overlaps".
+    """
+
+    reduced = None
+    for path in paths:
+        with np.load(path) as partial:
+            if reduced is None:
+                reduced = {name: partial[name].copy() for name in partial.files}
+            else:
+                for name in partial.files:
+                    reduced[name] += partial[name]
+
+    return reduced
+
+
+def get_audited_counts(counts, equal_opp=False):
+    """
+    Selects the counts of the audit from reduced counts.
+
+    Args:
+        counts (dict): Reduced counts, see `reduce_shard_counts`.
+        equal_opp (bool, optional): Whether the audit is restricted to the individuals
+            with y_true == 1 (true positives as positives). Defaults to False.
+
+    Returns:
+        tuple: The individuals and positives of every region, and the total N and P.
+    """
+
+    totals = dict(zip(COUNT_NAMES, counts["totals"].tolist()))
+    if equal_opp:
+        return counts["n_true"], counts["tp"], totals["n_true"], totals["tp"]
+
+    return counts["n"], counts["p"], totals["n"], totals["p"]
+
+
+def has_overlapping_regions(counts, equal_opp=False):
+    """
+    Checks whether audited individuals belong to more than one region.
+
+    Args:
+        counts (dict): Reduced counts, see `reduce_shard_counts`.
+        equal_opp (bool, optional): Whether the audit is restricted to the individuals
+            with y_true == 1. Defaults to False.
+
+    Returns:
+        bool: Whether the audited regions overlap.
+    """
+
+    n_s, _, N, _ = get_audited_counts(counts, equal_opp)
+    if "overlaps" not in counts:
+        ## counts mapped without the overlap flag: overlaps are only seen when the
+        ## regions hold more individuals than there are
+        return bool(n_s.sum() > N)
+
+    return bool(counts["overlaps"][1 if equal_opp else 0] > 0)
+
+
+def map_shard_null(
+    shard_path,
+    out_path,
+    n_regions,
+    N,
+    P,
+    n_worlds,
+    seed,
+    shard_idx,
+    region_col="region_ids",
+    true_col="y_true",
+    equal_opp=False,
+    chunk_size=1_000_000,
+):
+    """
+    Draws the null labels of the individuals of a shard and counts them per region.
+
+    Every audited individual is positive with probability P / N in every world, drawn
+    from the (world, shard) stream of `get_shard_world_rng`, so the shards draw
+    independent shares of the same worlds and only ship (regions x worlds) counts.
+    Unlike the count-space sampler, this is valid for overlapping regions.
+
+    Args:
+        shard_path (str): CSV or Parquet file of the shard.
+        out_path (str): .npz file of the "counts" (regions x worlds) and of the
+            positives of every world ("worlds_P").
+        n_regions (int): Total number of regions.
+        N (int): Total number of audited individuals, over all the shards.
+        P (int): Total number of audited positives, over all the shards.
+        n_worlds (int): Number of alternative worlds.
+        seed (int): Seed of the simulation.
+        shard_idx (int): Index of the shard.
+        region_col (str, optional): Column of the regions. Defaults to "region_ids".
+        true_col (str, optional): Column of the true labels. Defaults to "y_true".
+        equal_opp (bool, optional): Whether only the individuals with y_true == 1 are
+            audited. Defaults to False.
+        chunk_size (int, optional): Number of rows per chunk. Defaults to 1_000_000.
+
+    Returns:
+        str: The output path.
+    """
+
+    rngs = [get_shard_world_rng(seed, w, shard_idx) for w in range(n_worlds)]
+    counts = np.zeros((n_regions, n_worlds), dtype=np.int64)
+    worlds_P = np.zeros(n_worlds, dtype=np.int64)
+
+    columns = [region_col] + ([true_col] if equal_opp else [])
+    for chunk in iter_table_chunks(shard_path, columns, chunk_size):
+        membership = get_chunk_membership(chunk[region_col].to_numpy(), n_regions)
+        if equal_opp:
+            membership = membership[chunk[true_col].to_numpy() == 1]
+
+        ## one world at a time keeps the memory O(chunk), and the streams are consumed
+        ## in row order, so the draws do not depend on the chunking
+        membership_t = membership.T.tocsr()
+        for w, rng in enumerate(rngs):
+            labels = (rng.random(membership.shape[0]) < P / N).astype(np.int64)
+            counts[:, w] += membership_t @ labels
+            worlds_P[w] += labels.sum()
+
+    np.savez(out_path, counts=counts, worlds_P=worlds_P)
+
+    return out_path
+
+
+def reduce_shard_nulls(paths):
+    """
+    Sums the null counts of the shards.
+
+    Args:
+        paths (list): .npz files written by `map_shard_null`.
+
+    Returns:
+        tuple: The (regions x worlds) positives and the positives of every world.
+    """
+
+    counts, worlds_P = None, None
+    for path in paths:
+        with np.load(path) as partial:
+            if counts is None:
+                counts, worlds_P = partial["counts"].copy(), partial["worlds_P"].copy()
+            else:
+                counts += partial["counts"]
+                worlds_P += partial["worlds_P"]
+
+    return counts, worlds_P
+
+
+def audit_reduced_counts(
+    n_s,
+    p_s,
+    N,
+    P,
+    signif_level=0.005,
+    n_worlds=400,
+    seed=42,
+    null_counts=None,
+    threshold_method="empirical",
+):
+    """
+    Scans the regions from their reduced counts.
+
+    Args:
+        n_s (np.ndarray): Individuals of every region.
+        p_s (np.ndarray): Positives of every region.
+        N (int): Total number of individuals.
+        P (int): Total number of positives.
+        signif_level (float, optional): Significance level. Defaults to 0.005.
+        n_worlds (int, optional): Number of alternative worlds of the count-space null.
+            Defaults to 400.
+        seed (int, optional): Seed of the count-space null. Defaults to 42.
+        null_counts (tuple, optional): Reduced shard nulls, see `reduce_shard_nulls`.
+            Defaults to None (count-space null, for non-overlapping regions only).
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+
+    Raises:
+        ValueError: If null_counts is None and the regions hold more individuals than
+            N, i.e. they overlap.
+
+    Returns:
+        tuple: The scanned regions dataframe ("n", "p", "signif", "statistic" and
+        "p_value" columns), the significance threshold and the null distribution.
+    """
+
+    from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+    from app.services.spatial_bias.utils.membership_utils import CountSpaceRegions
+    from app.services.spatial_bias.utils.null_distribution import NullDistribution
+    from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+    if null_counts is None:
+        if np.sum(n_s) > N:
+            raise ValueError("The count-space null requires non-overlapping regions")
+        null_distr = scan_alt_worlds(
+            n_worlds, CountSpaceRegions(n_s), N, P, seed, engine="counts"
+        )
+    else:
+        counts, worlds_P = null_counts
+        _, _, scores = compute_statistics_vec(n_s[:, None], counts, N, worlds_P)
+        null_distr = NullDistribution(len(worlds_P))
+        null_distr.add(scores.max(axis=0, initial=-np.inf))
+    null_distr.threshold_method = threshold_method
+    signif_thresh = null_distr.threshold(signif_level)
+
+    _, _, scores = compute_statistics_vec(n_s, p_s, N, P)
+    df_scanned_regs = pd.DataFrame(
+        {
+            "n": n_s,
+            "p": p_s,
+            "signif": scores >= signif_thresh,
+            "statistic": scores,
+            "p_value": null_distr.p_values(scores),
+        }
+    )
+
+    return df_scanned_regs, signif_thresh, null_distr
+
+
+def run_sharded_audit(
+    shard_paths,
+    work_dir,
+    n_regions,
+    signif_level=0.005,
+    n_worlds=400,
+    equal_opp=False,
+    null_mode="auto",
+    region_col="region_ids",
+    pred_col="y_pred",
+    true_col="y_true",
+    chunk_size=1_000_000,
+    seed=42,
+    n_workers=None,
+    with_info=False,
+    threshold_method="empirical",
+):
+    # local driver of the map-reduce: every shard is mapped in a worker process and
+    # writes its .npz file in work_dir. null_mode "counts" simulates the null from the
+    # reduced counts (non-overlapping regions), "shards" maps the null draws too and
+    # "auto" picks "shards" when the map step saw individuals in several regions.
+    from app.services.spatial_bias.utils.audit_utils import get_n_workers
+
+    assert null_mode in ["auto", "counts", "shards"], f"Invalid null mode: {null_mode}"
+    os.makedirs(work_dir, exist_ok=True)
+    n_workers = get_n_workers() if n_workers is None else n_workers
+
+    ## spawned like the world scan workers: forking a process that already started the
+    ## thread pool of the compiled kernels leaves it hanging at exit
+    with ProcessPoolExecutor(
+        max_workers=max(1, n_workers), mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        count_paths = list(
+            executor.map(
+                map_shard_counts,
+                shard_paths,
+                [
+                    os.path.join(work_dir, f"counts_{i}.npz")
+                    for i in range(len(shard_paths))
+                ],
+                [n_regions] * len(shard_paths),
+                [region_col] * len(shard_paths),
+                [pred_col] * len(shard_paths),
+                [true_col] * len(shard_paths),
+                [equal_opp] * len(shard_paths),
+                [chunk_size] * len(shard_paths),
+            )
+        )
+        counts = reduce_shard_counts(count_paths)
+        n_s, p_s, N, P = get_audited_counts(counts, equal_opp)
+
+        overlapping = has_overlapping_regions(counts, equal_opp)
+        if null_mode == "auto":
+            null_mode = "shards" if overlapping else "counts"
+        elif null_mode == "counts" and overlapping:
+            raise ValueError("The counts null mode requires non-overlapping regions")
+
+        null_counts = None
+        if null_mode == "shards":
+            null_paths = list(
+                executor.map(
+                    map_shard_null,
+                    shard_paths,
+                    [
+                        os.path.join(work_dir, f"null_{i}.npz")
+                        for i in range(len(shard_paths))
+                    ],
+                    [n_regions] * len(shard_paths),
+                    [N] * len(shard_paths),
+                    [P] * len(shard_paths),
+                    [n_worlds] * len(shard_paths),
+                    [seed] * len(shard_paths),
+                    range(len(shard_paths)),
+                    [region_col] * len(shard_paths),
+                    [true_col] * len(shard_paths),
+                    [equal_opp] * len(shard_paths),
+                    [chunk_size] * len(shard_paths),
+                )
+            )
+            null_counts = reduce_shard_nulls(null_paths)
+
+    df_scanned_regs, signif_thresh, null_distr = audit_reduced_counts(
+        n_s, p_s, N, P, signif_level, n_worlds, seed, null_counts, threshold_method
+    )
+
+    sbi = np.mean(df_scanned_regs["statistic"])
+    if with_info:
+        info = {
+            "N": N,
+            "P": P,
+            "n_worlds": null_distr.n_worlds,
+            "null_mode": null_mode,
+            "signif_thresh_ci": null_distr.threshold_ci(signif_level),
+            "threshold_method": null_distr.tail_model(signif_level) or "empirical",
+        }
+        return df_scanned_regs, signif_thresh, sbi, info
+
+    return df_scanned_regs, signif_thresh, sbi
@@ -0,0 +1,257 @@
+# out-of-core audit of non-overlapping regions: the individuals are read in chunks and
+# only the per-region counts are kept, so the memory is bounded by the chunk size plus
+# the number of regions instead of the number of individuals
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def iter_table_chunks(path, columns, chunk_size=1_000_000):
+    """
+    Reads the columns of a CSV or Parquet file in chunks of rows.
+
+    Args:
+        path (str): Path of the file, read as Parquet if it ends in ".parquet" or ".pq".
+        columns (list): Columns to read.
+        chunk_size (int, optional): Number of rows per chunk. Defaults to 1_000_000.
+
+    Yields:
+        pd.DataFrame: The next chunk of rows.
+    """
+
+    if os.path.splitext(path)[1].lower() in [".parquet", ".pq"]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Reading Parquet files requires pyarrow") from e
+
+        for batch in pq.ParquetFile(path).iter_batches(
+            batch_size=chunk_size, columns=columns
+        ):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_size)
+
+
+def get_polygon_region_ids(polygons):
+    """
+    Builds a vectorized point-in-polygon assignment over an STRtree of the polygons.
+
+    Args:
+        polygons (list): Polygons of the regions, each a list of [lon, lat] points.
+
+    Returns:
+        callable: A function of (lats, lons) returning the region of every point, -1 for
+        the points outside all the polygons (the first polygon if several contain it).
+    """
+
+    import shapely
+    from shapely.geometry import Polygon
+    from shapely.strtree import STRtree
+
+    tree = STRtree([Polygon(polygon) for polygon in polygons])
+
+    def assign(lats, lons):
+        points = shapely.points(np.asarray(lons, float), np.asarray(lats, float))
+        point_idx, polygon_idx = tree.query(points, predicate="within")
+
+        region_ids = np.full(len(points), len(polygons), dtype=np.int64)
+        np.minimum.at(region_ids, point_idx, polygon_idx)
+        region_ids[region_ids == len(polygons)] = -1
+
+        return region_ids
+
+    return assign
+
+
+class RegionCountsAccumulator:
+    """
+    Per-region counts of a stream of individuals, in arrays of one entry per region.
+
+    Without a number of regions, the regions are the distinct ids seen so far, in
+    sorted order like `build_region_membership`, so sparse ids (e.g. tract codes) only
+    cost one entry each and the regions are the ones of an in-memory audit of the same
+    ids. The table of ids grows when a chunk brings new ids.
+
+    Attributes:
+        ids (np.ndarray): Sorted id of every region.
+        n (np.ndarray): Individuals of every region.
+        p (np.ndarray): Predicted positives of every region.
+        n_true (np.ndarray): Actual positives (y_true == 1) of every region.
+        tp (np.ndarray): True positives of every region.
+        totals (dict): The same counts over all the individuals, including the ones
+            outside all the regions ("n", "p", "n_true" and "tp").
+    """
+
+    def __init__(self, n_regions=None):
+        """
+        Args:
+            n_regions (int, optional): Number of regions, whose ids are then
+                0..n_regions-1 (including the regions without individuals). Defaults to
+                None (the distinct ids seen).
+        """
+
+        self.fixed = n_regions is not None
+        self.ids = np.arange(n_regions if self.fixed else 0, dtype=np.int64)
+        self.n = np.zeros(len(self.ids), dtype=np.int64)
+        self.p = np.zeros(len(self.ids), dtype=np.int64)
+        self.n_true = np.zeros(len(self.ids), dtype=np.int64)
+        self.tp = np.zeros(len(self.ids), dtype=np.int64)
+        self.totals = {"n": 0, "p": 0, "n_true": 0, "tp": 0}
+
+    @property
+    def n_regions(self):
+        return len(self.ids)
+
+    def _add_ids(self, new_ids):
+        ## merges the new ids into the sorted table and moves the counts along
+        ids = np.union1d(self.ids, new_ids)
+        old_pos = np.searchsorted(ids, self.ids)
+        for name in ["n", "p", "n_true", "tp"]:
+            counts = np.zeros(len(ids), dtype=np.int64)
+            counts[old_pos] = getattr(self, name)
+            setattr(self, name, counts)
+        self.ids = ids
+
+    def add(self, region_ids, y_pred, y_true=None):
+        """
+        Adds a chunk of individuals.
+
+        Args:
+            region_ids (np.ndarray): Region id of every individual, -1 for none.
+            y_pred (np.ndarray): Predicted labels.
+            y_true (np.ndarray, optional): True labels. Defaults to None.
+
+        Raises:
+            ValueError: If the number of regions is fixed and an id is not below it.
+        """
+
+        region_ids = np.asarray(region_ids, dtype=np.int64)
+        y_pred = np.asarray(y_pred, dtype=np.int64)
+        y_true = np.zeros_like(y_pred) if y_true is None else np.asarray(y_true)
+        y_true = y_true.astype(np.int64)
+
+        inside = region_ids >= 0
+        ids = region_ids[inside]
+        if self.fixed:
+            if np.any(ids >= self.n_regions):
+                raise ValueError(
+                    f"Region id {ids.max()} is out of range for {self.n_regions} regions"
+                )
+            positions = ids
+        else:
+            new_ids = np.setdiff1d(ids, self.ids)
+            if len(new_ids) > 0:
+                self._add_ids(new_ids)
+            positions = np.searchsorted(self.ids, ids)
+
+        for name, weights in [
+            ("n", None),
+            ("p", y_pred),
+            ("n_true", y_true),
+            ("tp", y_pred * y_true),
+        ]:
+            self.totals[name] += len(y_pred) if weights is None else int(weights.sum())
+            getattr(self, name)[:] += np.bincount(
+                positions,
+                weights=None if weights is None else weights[inside],
+                minlength=self.n_regions,
+            ).astype(np.int64)
+
+
+def run_streaming_audit(
+    path,
+    signif_level=0.005,
+    n_worlds=400,
+    equal_opp=False,
+    region_col=None,
+    polygons=None,
+    lat_col="lat",
+    lon_col="lon",
+    pred_col="y_pred",
+    true_col="y_true",
+    n_regions=None,
+    chunk_size=1_000_000,
+    seed=42,
+    count_sampler="binomial",
+    with_info=False,
+    threshold_method="empirical",
+):
+    # the regions come either from an integer region id column (one region per row,
+    # -1 for none) or from the polygons containing the (lat_col, lon_col) coordinates.
+    # With region_col, the regions are the distinct ids in sorted order, or the ids
+    # 0..n_regions-1 if n_regions is given, see RegionCountsAccumulator
+    if (region_col is None) == (polygons is None):
+        raise ValueError("Provide either region_col or polygons")
+
+    from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+    from app.services.spatial_bias.utils.membership_utils import CountSpaceRegions
+    from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+    if region_col is not None:
+        location_cols = [region_col]
+    else:
+        location_cols = [lat_col, lon_col]
+        assign = get_polygon_region_ids(polygons)
+        n_regions = len(polygons)
+    columns = location_cols + [pred_col] + ([true_col] if equal_opp else [])
+
+    accumulator = RegionCountsAccumulator(n_regions)
+    for chunk in iter_table_chunks(path, columns, chunk_size):
+        region_ids = (
+            chunk[region_col].to_numpy()
+            if region_col is not None
+            else assign(chunk[lat_col].to_numpy(), chunk[lon_col].to_numpy())
+        )
+        accumulator.add(
+            region_ids,
+            chunk[pred_col].to_numpy(),
+            chunk[true_col].to_numpy() if equal_opp else None,
+        )
+
+    ## equal opportunity: the audit is restricted to the individuals with y_true == 1
+    if equal_opp:
+        n_s, p_s = accumulator.n_true, accumulator.tp
+        N, P = accumulator.totals["n_true"], accumulator.totals["tp"]
+    else:
+        n_s, p_s = accumulator.n, accumulator.p
+        N, P = accumulator.totals["n"], accumulator.totals["p"]
+
+    ## only the region sizes are known, and the counts engine only needs them
+    null_distr = scan_alt_worlds(
+        n_worlds,
+        CountSpaceRegions(n_s),
+        N,
+        P,
+        seed,
+        engine="counts",
+        count_sampler=count_sampler,
+    )
+    null_distr.threshold_method = threshold_method
+    signif_thresh = null_distr.threshold(signif_level)
+
+    _, _, scores = compute_statistics_vec(n_s, p_s, N, P)
+    df_scanned_regs = pd.DataFrame(
+        {
+            "region_id": accumulator.ids,
+            "n": n_s,
+            "p": p_s,
+            "signif": scores >= signif_thresh,
+            "statistic": scores,
+            "p_value": null_distr.p_values(scores),
+        }
+    )
+
+    sbi = np.mean(df_scanned_regs["statistic"])
+    if with_info:
+        info = {
+            "N": N,
+            "P": P,
+            "n_worlds": null_distr.n_worlds,
+            "signif_thresh_ci": null_distr.threshold_ci(signif_level),
+            "threshold_method": null_distr.tail_model(signif_level) or "empirical",
+        }
+        return df_scanned_regs, signif_thresh, sbi, info
+
+    return df_scanned_regs, signif_thresh, sbi
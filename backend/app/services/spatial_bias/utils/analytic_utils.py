@@ -0,0 +1,139 @@
+import math
+
+import numpy as np
+
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+
+def get_llr_tail_bound(llr):
+    """
+    Chernoff-type bound on the probability that the likelihood ratio of a region reaches
+    `llr` under the null.
+
+    Under a binomial null of rate r, the log-likelihood ratio of a region is at most
+    n * KL(p_in || r) + (N - n) * KL(p_out || r), two independent terms whose tails are
+    bounded by 2 * exp(-a) (the two-sided Chernoff bound), so their moment generating
+    functions at lambda < 1 are at most (1 + lambda) / (1 - lambda). The Chernoff bound
+    of the sum, at the optimal lambda = sqrt(1 - 4 / llr), is
+    ((1 + lambda) / (1 - lambda))^2 * exp(-lambda * llr). Plugging in the global rate
+    P / N only lowers the ratio, so the bound holds whatever the true rate.
+
+    Args:
+        llr (array-like): Log-likelihood ratios.
+
+    Returns:
+        np.ndarray: The bound of every ratio, capped at 1.
+    """
+
+    llr = np.asarray(llr, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lam = np.sqrt(np.clip(1 - 4 / llr, 0, 1))
+        bound = ((1 + lam) / (1 - lam)) ** 2 * np.exp(-lam * llr)
+
+    return np.where(llr > 4, np.minimum(np.nan_to_num(bound, nan=0.0), 1.0), 1.0)
+
+
+class AnalyticNullDistribution:
+    """
+    Conservative null distribution of the scan statistic without simulation.
+
+    The statistic of a region is its log-likelihood ratio divided by the absolute
+    log-likelihood of the whole data under the null. The family-wise probability that
+    any region reaches a ratio t is bounded by Bonferroni over the regions that can
+    reach t at all (whose ratio at their most extreme counts, given their size and P,
+    is at least t) times `get_llr_tail_bound(t)`. The threshold of a level is the
+    smallest t whose bound is below the level, and the p-value of a region is the bound
+    at its own ratio, so a region is significant exactly when its p-value is at most the
+    level. Both are valid under any dependence between the regions, and conservative.
+
+    It has the interface of `NullDistribution`, without worlds.
+    """
+
+    def __init__(self, n_s, N, P):
+        """
+        Args:
+            n_s (np.ndarray): Number of individuals per region.
+            N (int): Total number of elements.
+            P (int): Total number of positive elements.
+        """
+
+        n_s = np.asarray(n_s, dtype=float)
+        ## absolute log-likelihood of the whole data under the null, the scale of the
+        ## statistic
+        self.scale = -sum(k * math.log(k / N) for k in [P, N - P] if k > 0)
+
+        ## largest ratio every region can reach, at the bounds of its positives
+        p_min = np.maximum(0, P - (N - n_s))
+        p_max = np.minimum(n_s, P)
+        max_scores = np.maximum(
+            compute_statistics_vec(n_s, p_min, N, P)[2],
+            compute_statistics_vec(n_s, p_max, N, P)[2],
+        )
+        self._max_llrs = np.sort(max_scores * self.scale)
+
+    @property
+    def n_worlds(self):
+        return 0
+
+    @property
+    def maxima(self):
+        return np.zeros(0)
+
+    def _family_bound(self, llr):
+        llr = np.asarray(llr, dtype=float)
+        n_reachable = len(self._max_llrs) - np.searchsorted(
+            self._max_llrs, llr, side="left"
+        )
+        return np.minimum(n_reachable * get_llr_tail_bound(llr), 1.0)
+
+    def _llr_threshold(self, signif_level):
+        if self.scale <= 0 or len(self._max_llrs) == 0:
+            return math.inf
+
+        ## the bound decreases with the ratio: double then bisect
+        low, high = 0.0, max(4.0, math.log(len(self._max_llrs) / signif_level))
+        while self._family_bound(high) > signif_level:
+            low, high = high, 2 * high
+        for _ in range(100):
+            mid = (low + high) / 2
+            if self._family_bound(mid) > signif_level:
+                low = mid
+            else:
+                high = mid
+
+        return high
+
+    def threshold(self, signif_level):
+        """
+        Args:
+            signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+
+        Returns:
+            float: The conservative significance threshold of the statistic.
+        """
+
+        llr = self._llr_threshold(signif_level)
+
+        return llr / self.scale if math.isfinite(llr) else math.inf
+
+    def thresholds(self, signif_levels):
+        return [self.threshold(level) for level in signif_levels]
+
+    def threshold_ci(self, signif_level, confidence=0.95):
+        ## the threshold is exact, not estimated
+        threshold = self.threshold(signif_level)
+        return threshold, threshold
+
+    def p_values(self, statistics):
+        """
+        Args:
+            statistics (array-like): Observed statistics, e.g. of every region.
+
+        Returns:
+            np.ndarray: The conservative family-wise p-value of every statistic.
+        """
+
+        return self._family_bound(np.asarray(statistics, dtype=float) * self.scale)
+
+    def tail_model(self, signif_level):
+        return "analytic"
@@ -0,0 +1,154 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+
+def get_sample_fraction(N, approx_fraction=None, max_individuals=None):
+    """
+    Resolves the sampling fraction of an approximate audit.
+
+    Args:
+        N (int): Number of audited individuals.
+        approx_fraction (float, optional): Fraction of the individuals to sample.
+            Defaults to None.
+        max_individuals (int, optional): Maximum number of sampled individuals.
+            Defaults to None.
+
+    Returns:
+        float: The fraction, 1.0 for an exact audit.
+    """
+
+    fraction = 1.0 if approx_fraction is None else float(approx_fraction)
+    if max_individuals is not None and N > 0:
+        fraction = min(fraction, max_individuals / N)
+
+    return min(max(fraction, 0.0), 1.0)
+
+
+def get_stratified_sample_mask(membership, fraction, seed=None):
+    """
+    Samples the same fraction of the individuals of every region.
+
+    Every individual is assigned to the stratum of the first region it belongs to (the
+    individuals outside all the regions form one more stratum), and ceil(fraction *
+    size) individuals of every stratum are drawn without replacement, so every
+    non-empty stratum keeps at least one individual.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        fraction (float): Fraction of every stratum to sample.
+        seed (int, optional): Seed of the sample. Defaults to None.
+
+    Returns:
+        np.ndarray: Boolean mask of the sampled individuals.
+    """
+
+    N = membership.n_individuals
+    n_regions = membership.n_regions
+
+    stratum = np.full(N, n_regions, dtype=np.int64)
+    np.minimum.at(
+        stratum,
+        membership.indices,
+        np.repeat(np.arange(n_regions, dtype=np.int64), membership.sizes),
+    )
+
+    ## rank of every individual in a random order of its stratum, with one float sort
+    ## (keys below 0.5 so that stratum + key never rounds into the next stratum)
+    keys = np.random.default_rng(seed).random(N) / 2
+    order = np.argsort(stratum + keys)
+    sorted_stratum = stratum[order]
+    stratum_sizes = np.bincount(stratum, minlength=n_regions + 1)
+    stratum_starts = np.concatenate([[0], np.cumsum(stratum_sizes)[:-1]])
+    ranks = np.arange(N) - stratum_starts[sorted_stratum]
+    quotas = np.ceil(fraction * stratum_sizes).astype(np.int64)
+
+    mask = np.zeros(N, dtype=bool)
+    mask[order[ranks < quotas[sorted_stratum]]] = True
+
+    return mask
+
+
+def get_statistic_ci(
+    n_sample, p_sample, n_full, N_sample, P_sample, N_full, confidence=0.95
+):
+    """
+    Confidence intervals of the full-data statistic of every region, from a sample.
+
+    The positive rate of a region is the only quantity treated as uncertain: its
+    normal interval, with the finite population correction of a sample of n_sample
+    out of n_full individuals, is mapped through the statistic of the full region, with
+    the positive rate outside the region fixed to the one of the sample. The statistic
+    is minimal (zero) where the rate equals the rate outside, so its interval is
+    spanned by the rate bounds and that point.
+
+    Args:
+        n_sample (np.ndarray): Sampled individuals of every region.
+        p_sample (np.ndarray): Sampled positives of every region.
+        n_full (np.ndarray): Individuals of every region in the full data.
+        N_sample (int): Sampled individuals.
+        P_sample (int): Sampled positives.
+        N_full (int): Individuals in the full data.
+        confidence (float, optional): Confidence of the intervals. Defaults to 0.95.
+
+    Returns:
+        tuple: The lower and upper bounds of the statistic of every region.
+    """
+
+    n = np.asarray(n_sample, dtype=float)
+    p = np.asarray(p_sample, dtype=float)
+    n_full = np.asarray(n_full, dtype=float)
+    n_out = N_sample - n
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    rate = np.where(n > 0, p / np.where(n > 0, n, 1), 0.0)
+    rate_out = np.where(n_out > 0, (P_sample - p) / np.where(n_out > 0, n_out, 1), 0.0)
+    ## shrunk rate for the spread, so that 0 and 1 rates get a non-empty interval
+    rate_adj = (p + 0.5) / (n + 1)
+    fpc = np.clip((n_full - n) / np.maximum(n_full - 1, 1), 0, 1)
+    spread = z * np.sqrt(rate_adj * (1 - rate_adj) / np.maximum(n, 1) * fpc)
+
+    def statistic_at(r):
+        P = rate_out * (N_full - n_full) + r * n_full
+        return compute_statistics_vec(n_full, r * n_full, N_full, P)[2]
+
+    stat_low = statistic_at(np.clip(rate - spread, 0, 1))
+    stat_high = statistic_at(np.clip(rate + spread, 0, 1))
+    ci_low = np.minimum(stat_low, stat_high)
+    ci_high = np.maximum(stat_low, stat_high)
+    ci_low = np.where(np.abs(rate - rate_out) <= spread, 0.0, ci_low)
+
+    ## regions without sampled individuals are unknown
+    ci_low = np.where(n > 0, ci_low, 0.0)
+    ci_high = np.where(n > 0, ci_high, math.inf)
+
+    return ci_low, ci_high
+
+
+def get_ambiguous_regions(signif, ci_low, ci_high, full_signif_thresh):
+    """
+    Flags the regions whose significance in the exact audit is not settled by a sample.
+
+    A region is settled if the sample flags it and its whole interval is above the
+    threshold of the full data, or if the sample does not flag it and its whole
+    interval is below that threshold.
+
+    Args:
+        signif (np.ndarray): Significance of every region in the sample.
+        ci_low (np.ndarray): Lower bounds of the statistics, see `get_statistic_ci`.
+        ci_high (np.ndarray): Upper bounds of the statistics.
+        full_signif_thresh (float): Estimated threshold of the full data.
+
+    Returns:
+        np.ndarray: Boolean mask of the ambiguous regions.
+    """
+
+    signif = np.asarray(signif, dtype=bool)
+    settled = np.where(
+        signif, ci_low >= full_signif_thresh, ci_high < full_signif_thresh
+    )
+
+    return ~settled
@@ -2,10 +2,39 @@ import numpy as np
 import pandas as pd
 from app.services.spatial_bias.utils.scores import (
     compute_statistic,
-    compute_statistic_l0_l1,
+    compute_statistics_vec,
+    compute_statistics_table,
+    get_region_counts,
+    get_xlogx_table,
 )
+import contextlib
 import math
-from app.services.spatial_bias.utils.data_utils import get_pos_info_regions
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from app.services.spatial_bias.utils.analytic_utils import AnalyticNullDistribution
+from app.services.spatial_bias.utils.approx_utils import (
+    get_ambiguous_regions,
+    get_sample_fraction,
+    get_statistic_ci,
+    get_stratified_sample_mask,
+)
+from app.services.spatial_bias.utils.membership_utils import (
+    CountSpaceRegions,
+    RegionMembership,
+)
+from app.services.spatial_bias.utils.null_distribution import NullDistribution
+from app.services.spatial_bias.utils.null_cache import get_null_cache, get_null_key
+from app.services.spatial_bias.utils.rng_utils import get_world_rng, resolve_seed
+from app.services.spatial_bias.utils.numba_kernels import (
+    NUMBA_AVAILABLE,
+    fused_worlds_maxima,
+)
+
+## memory budget of a block of alternative worlds in the sparse engine
+MAX_BLOCK_BYTES = 256 * 1024**2
+## minimum number of worlds scanned by a worker task
+MIN_WORLDS_PER_CHUNK = 64
 
 
 def get_random_types(N, P, seed=None):
@@ -21,9 +50,60 @@ def get_random_types(N, P, seed=None):
         np.ndarray: A binary array of size N with approximately P positive values.
     """
 
-    if seed is not None:
-        np.random.seed(seed)
-    return np.random.binomial(size=N, n=1, p=P / N)
+    ## world 0 of the counter-based streams, without touching the global NumPy state
+    return get_random_world_types(N, P, resolve_seed(seed), 0).astype(int)
+
+
+def get_random_world_types(N, P, seed, world_idx):
+    """
+    Draws the labels of a single alternative world from its own stream.
+
+    Args:
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        seed (int): Seed of the whole simulation.
+        world_idx (int): Index of the world.
+
+    Returns:
+        np.ndarray: A binary uint8 array of size N with approximately P positive values.
+    """
+
+    return (get_world_rng(seed, world_idx).random(N) < P / N).astype(np.uint8)
+
+
+def get_random_region_counts(n_s, N, P, rng, count_sampler="binomial"):
+    """
+    Draws the positives of every region of a non-overlapping partitioning directly.
+
+    For non-overlapping regions the scan only depends on how many positives fall in each
+    region, so the counts are drawn in O(regions) instead of drawing N labels.
+
+    Args:
+        n_s (np.ndarray): Number of points per region.
+        N (int): Total number of elements, including the ones outside all regions.
+        P (int): Total number of positive elements.
+        rng (np.random.Generator): Random generator of the world.
+        count_sampler (str, optional): "binomial" draws each region independently with
+            rate P/N, which is the same null as `get_random_types`. "hypergeometric"
+            spreads exactly P positives over the regions. Defaults to "binomial".
+
+    Returns:
+        tuple: The positives per region and the total number of positives of the world.
+    """
+
+    uncovered = N - np.sum(n_s)
+
+    if count_sampler == "binomial":
+        counts = rng.binomial(n_s, P / N)
+        world_P = counts.sum() + rng.binomial(uncovered, P / N)
+    elif count_sampler == "hypergeometric":
+        drawn = rng.multivariate_hypergeometric(np.append(n_s, uncovered), P)
+        counts = drawn[:-1]
+        world_P = P
+    else:
+        raise ValueError(f"Unknown count sampler: {count_sampler}")
+
+    return counts, world_P
 
 
 # def scan_regions(regions, types, N, P, verbose=False):
@@ -388,64 +468,629 @@ def scan_regions(regions, types, N, P, verbose=False):
         tuple: The best region dictionary, the maximum likelihood value, and a list of statistics for all regions.
     """
 
-    # print(f"regions: {regions}")
-    # print(f"types: {types}")
-
-    statistics = []
-    max_likelihood = -np.inf
-    for region in regions:
-        n, p, _ = get_simple_stats(region, types)
-        _, l0, l1_i = compute_statistic_l0_l1(n, p, N, P)
-        cur_stat = 1 - l1_i / l0
-        # cur_stat = compute_statistic(n, p, N, P)
-        statistics.append(cur_stat)
-        if cur_stat > max_likelihood:
-            max_likelihood = cur_stat
+    n_s, p_s = get_region_counts(types, regions)
+    _, _, scores = compute_statistics_vec(n_s, p_s, N, P)
+    statistics = scores.tolist()
+    max_likelihood = np.amax(scores) if len(scores) > 0 else -np.inf
 
     if verbose:
         print("range", np.amin(statistics), np.amax(statistics))
         print("max likelihood", max_likelihood)
-        # n, p, _ = get_simple_stats(regions[idx]["points"], types)
-        compute_statistic(n, p, N, P, verbose=verbose)
+        idx = np.argmax(scores)
+        compute_statistic(n_s[idx], p_s[idx], N, P, verbose=verbose)
 
     return max_likelihood, statistics
 
 
-def scan_alt_worlds(n_alt_worlds, regions, N, P, seed=None, verbose=False):
+def iter_alt_world_blocks(
+    N, P, world_start, world_stop, seed=None, bytes_per_world=None, max_block_bytes=None
+):
     """
-    Scans multiple alternative worlds and ranks them by maximum likelihood.
+    Draws alternative worlds in memory-bounded blocks.
+
+    Each block of worlds is materialized as a (N x block) column-major uint8 matrix whose
+    columns are drawn by `get_random_world_types`.
+
+    Args:
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        world_start (int): Index of the first world to draw.
+        world_stop (int): Index after the last world to draw.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        bytes_per_world (int, optional): Memory needed per world of a block. Defaults to N.
+        max_block_bytes (int, optional): Memory budget of a block. Defaults to MAX_BLOCK_BYTES.
+
+    Yields:
+        tuple: (world_indices, worlds) with the (N x block) labels of the worlds.
+    """
+
+    seed = resolve_seed(seed)
+    max_block_bytes = MAX_BLOCK_BYTES if max_block_bytes is None else max_block_bytes
+    bytes_per_world = N if bytes_per_world is None else bytes_per_world
+    block_size = max(
+        1, min(world_stop - world_start, max_block_bytes // bytes_per_world)
+    )
+
+    for block_start in range(world_start, world_stop, block_size):
+        block_stop = min(block_start + block_size, world_stop)
+        worlds = np.empty((N, block_stop - block_start), dtype=np.uint8, order="F")
+        for j, world_idx in enumerate(range(block_start, block_stop)):
+            worlds[:, j] = get_random_world_types(N, P, seed, world_idx)
+
+        yield np.arange(block_start, block_stop), worlds
+
+
+def iter_alt_world_counts(
+    membership, N, P, world_start, world_stop, seed=None, max_block_bytes=None
+):
+    """
+    Draws alternative worlds in memory-bounded blocks and counts their positives per region.
+
+    The blocks of worlds are drawn by `iter_alt_world_blocks`, and the positives of all
+    regions in all worlds of a block are obtained with a single sparse-dense product
+    against the membership matrix.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        world_start (int): Index of the first world to draw.
+        world_stop (int): Index after the last world to draw.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        max_block_bytes (int, optional): Memory budget of a block. Defaults to MAX_BLOCK_BYTES.
+
+    Yields:
+        tuple: (world_indices, counts, worlds_P) with the (regions x block) positives
+        matrix and the total number of positives of every world in the block.
+    """
+
+    ## uint8 world, its int32 upcast in the product and the float temporaries of the scores
+    bytes_per_world = 5 * N + 48 * membership.n_regions
+    for world_indices, worlds in iter_alt_world_blocks(
+        N, P, world_start, world_stop, seed, bytes_per_world, max_block_bytes
+    ):
+        yield (
+            world_indices,
+            membership.region_counts(worlds),
+            worlds.sum(axis=0, dtype=np.int64),
+        )
+
+
+def iter_alt_world_region_counts(
+    n_s,
+    N,
+    P,
+    world_start,
+    world_stop,
+    seed=None,
+    count_sampler="binomial",
+    block_size=1024,
+):
+    """
+    Draws the region counts of alternative worlds directly in count space.
+
+    Only valid for non-overlapping regions, see `get_random_region_counts`. World `i` is
+    drawn from `get_world_rng(seed, i)`, so the counts do not depend on the blocking.
+
+    Args:
+        n_s (np.ndarray): Number of points per region.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        world_start (int): Index of the first world to draw.
+        world_stop (int): Index after the last world to draw.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        count_sampler (str, optional): "binomial" or "hypergeometric". Defaults to "binomial".
+        block_size (int, optional): Number of worlds per yielded block. Defaults to 1024.
+
+    Yields:
+        tuple: (world_indices, counts, worlds_P) like `iter_alt_world_counts`.
+    """
+
+    seed = resolve_seed(seed)
+
+    for block_start in range(world_start, world_stop, block_size):
+        block_stop = min(block_start + block_size, world_stop)
+        counts = np.empty((len(n_s), block_stop - block_start), dtype=np.int64)
+        worlds_P = np.empty(block_stop - block_start, dtype=np.int64)
+        for j, world_idx in enumerate(range(block_start, block_stop)):
+            counts[:, j], worlds_P[j] = get_random_region_counts(
+                n_s, N, P, get_world_rng(seed, world_idx), count_sampler
+            )
+
+        yield np.arange(block_start, block_stop), counts, worlds_P
+
+
+def resolve_engine(membership, engine="auto", keep_worlds=False):
+    """
+    Resolves the world scanning engine for a partitioning.
+
+    Args:
+        membership (RegionMembership or CountSpaceRegions): The regions.
+        engine (str, optional): Requested engine, see `scan_alt_worlds`. Defaults to "auto".
+        keep_worlds (bool, optional): Whether the world labels must be kept. Defaults to False.
+
+    Returns:
+        str: One of "sparse", "fused", "counts" or "loop".
+    """
+
+    assert engine in [
+        "auto",
+        "sparse",
+        "fused",
+        "counts",
+        "loop",
+    ], f"Invalid engine: {engine}"
+
+    if isinstance(membership, CountSpaceRegions):
+        if engine not in ["auto", "counts"] or keep_worlds:
+            raise ValueError("Regions known by their sizes need the counts engine")
+        return "counts"
+    if engine == "counts" and membership.is_overlapping():
+        raise ValueError("The counts engine requires non-overlapping regions")
+    if keep_worlds:
+        if engine == "counts":
+            raise ValueError("The counts engine does not draw the world labels")
+        ## the loop engine draws the same worlds as the sparse one, one at a time
+        return "loop"
+    if engine == "auto":
+        if not membership.is_overlapping():
+            return "counts"
+        engine = "fused"
+    if engine == "fused" and not NUMBA_AVAILABLE:
+        ## same worlds, scanned with the NumPy kernel
+        return "sparse"
+
+    return engine
+
+
+def get_stat_kernel(N, stat_kernel="float"):
+    """
+    Returns the vectorized statistic used to score the regions of the alternative worlds.
+
+    Args:
+        N (int): Total number of elements.
+        stat_kernel (str, optional): "float" for `compute_statistics_vec`, or "table" for
+            `compute_statistics_table` with a k*log(k) table built once for all the
+            worlds. Defaults to "float".
+
+    Returns:
+        callable: A function of (n_s, p_s, N, P) returning (l0max, l1max, scores).
+    """
+
+    if stat_kernel == "float":
+        return compute_statistics_vec
+    if stat_kernel == "table":
+        table = get_xlogx_table(N)
+        return lambda n_s, p_s, N, P: compute_statistics_table(n_s, p_s, N, P, table)
+
+    raise ValueError(f"Unknown statistic kernel: {stat_kernel}")
+
+
+def get_alt_worlds_maxima(
+    membership,
+    N,
+    P,
+    world_start,
+    world_stop,
+    seed=None,
+    engine="sparse",
+    count_sampler="binomial",
+    verbose=False,
+    worlds=None,
+    n_workers=1,
+    stat_kernel="float",
+    executor=None,
+):
+    """
+    Scans a range of alternative worlds and returns the maximum statistic of each one.
+
+    World `i` is always drawn from `get_world_rng(seed, i)`, so the result for a given
+    seed does not depend on how the range is split, neither on the number of workers.
+
+    Args:
+        membership (RegionMembership or CountSpaceRegions): The regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        world_start (int): Index of the first world.
+        world_stop (int): Index after the last world.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        engine (str, optional): A resolved engine, see `resolve_engine`. Defaults to "sparse".
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        verbose (bool, optional): If True, prints additional information. Defaults to False.
+        worlds (list, optional): If given, the labels of the worlds are appended to it
+            ("loop" engine only).
+        n_workers (int, optional): Number of worker processes, see
+            `get_alt_worlds_maxima_parallel`, or None for `get_n_workers()`. Defaults to 1.
+        stat_kernel (str, optional): Statistic of the "sparse" and "counts" engines, see
+            `get_stat_kernel`. Defaults to "float".
+        executor (ProcessPoolExecutor, optional): Pool of the parallel scan, see
+            `get_alt_worlds_executor`. Defaults to None (a pool per call).
+
+    Returns:
+        np.ndarray: The maximum statistic of every world in the range.
+    """
+
+    seed = resolve_seed(seed)
+    n_workers = get_n_workers() if n_workers is None else n_workers
+    if n_workers > 1 and worlds is None:
+        return get_alt_worlds_maxima_parallel(
+            membership,
+            N,
+            P,
+            world_start,
+            world_stop,
+            seed,
+            engine,
+            count_sampler,
+            n_workers,
+            stat_kernel,
+            executor,
+        )
+
+    maxima = np.empty(world_stop - world_start, dtype=float)
+
+    if engine in ["sparse", "counts"]:
+        compute_statistics = get_stat_kernel(N, stat_kernel)
+        n_s = membership.sizes[:, None]
+        if engine == "sparse":
+            world_counts = iter_alt_world_counts(
+                membership, N, P, world_start, world_stop, seed
+            )
+        else:
+            ## the cells are drawn, then summed into the regions
+            cells = (
+                membership
+                if isinstance(membership, CountSpaceRegions)
+                else CountSpaceRegions(membership.sizes)
+            )
+            world_counts = iter_alt_world_region_counts(
+                cells.cell_sizes, N, P, world_start, world_stop, seed, count_sampler
+            )
+        for world_indices, counts, worlds_P in world_counts:
+            if engine == "counts":
+                counts = cells.region_counts(counts)
+            _, _, scores = compute_statistics(n_s, counts, N, worlds_P)
+            maxima[world_indices - world_start] = scores.max(axis=0, initial=-np.inf)
+    elif engine == "fused":
+        for world_indices, worlds in iter_alt_world_blocks(
+            N, P, world_start, world_stop, seed
+        ):
+            maxima[world_indices - world_start] = fused_worlds_maxima(
+                membership, worlds, worlds.sum(axis=0, dtype=np.int64)
+            )
+    else:
+        regions = membership.to_lists()
+        for world_idx in range(world_start, world_stop):
+            alt_types = get_random_world_types(N, P, seed, world_idx)
+            cur_P = np.sum(alt_types)
+            maxima[world_idx - world_start], _ = scan_regions(
+                regions, alt_types, N, cur_P, verbose=verbose
+            )
+            if worlds is not None:
+                worlds.append(alt_types)
+
+    return maxima
+
+
+def _init_alt_worlds_worker(membership):
+    global _worker_membership
+    _worker_membership = membership
+
+    ## the processes already use the cores, one thread each for the compiled kernels
+    if NUMBA_AVAILABLE:
+        import numba
+
+        numba.set_num_threads(1)
+
+
+def _alt_worlds_maxima_task(
+    N, P, world_start, world_stop, seed, engine, count_sampler, stat_kernel
+):
+    return get_alt_worlds_maxima(
+        _worker_membership,
+        N,
+        P,
+        world_start,
+        world_stop,
+        seed,
+        engine,
+        count_sampler,
+        stat_kernel=stat_kernel,
+    )
+
+
+def get_alt_worlds_executor(membership, n_workers=None):
+    """
+    Starts a pool of worker processes holding the membership, so that several scans of
+    the same regions (e.g. the batches of the adaptive mode) share one pool.
+
+    The workers are spawned rather than forked: a process forked after the compiled
+    kernels started their thread pool deadlocks on its first parallel loop.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        n_workers (int, optional): Number of processes. Defaults to `get_n_workers()`.
+
+    Returns:
+        ProcessPoolExecutor: The pool, to be shut down by the caller.
+    """
+
+    n_workers = get_n_workers() if n_workers is None else n_workers
+
+    return ProcessPoolExecutor(
+        max_workers=max(1, n_workers),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_alt_worlds_worker,
+        initargs=(membership,),
+    )
+
+
+def get_alt_worlds_maxima_parallel(
+    membership,
+    N,
+    P,
+    world_start,
+    world_stop,
+    seed,
+    engine="sparse",
+    count_sampler="binomial",
+    n_workers=None,
+    stat_kernel="float",
+    executor=None,
+):
+    """
+    Scans a range of alternative worlds on a pool of worker processes.
+
+    The range is split in chunks that are scanned by `get_alt_worlds_maxima` in the
+    workers, which only send back the per-world maxima. The membership is shipped once
+    per worker, and once per pool when the pool is shared through `executor`. Since
+    every world has its own counter-based stream (see
+    `get_world_rng`), the result is identical to a serial scan with the same seed, for
+    any number of workers.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        world_start (int): Index of the first world.
+        world_stop (int): Index after the last world.
+        seed (int): Seed of the simulation.
+        engine (str, optional): A resolved engine, see `resolve_engine`. Defaults to "sparse".
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        n_workers (int, optional): Number of processes. Defaults to `get_n_workers()`.
+        stat_kernel (str, optional): Statistic kernel, see `get_stat_kernel`. Defaults to "float".
+        executor (ProcessPoolExecutor, optional): Pool started by
+            `get_alt_worlds_executor` for the same membership. Defaults to None (a pool
+            for this call only).
+
+    Returns:
+        np.ndarray: The maximum statistic of every world in the range.
+    """
+
+    n_workers = get_n_workers() if n_workers is None else n_workers
+    n_worlds = world_stop - world_start
+    ## a few chunks per worker to balance the load, but not too small ones
+    n_chunks = min(4 * n_workers, max(1, n_worlds // MIN_WORLDS_PER_CHUNK))
+    if n_workers <= 1 or n_chunks <= 1:
+        return get_alt_worlds_maxima(
+            membership,
+            N,
+            P,
+            world_start,
+            world_stop,
+            seed,
+            engine,
+            count_sampler,
+            stat_kernel=stat_kernel,
+        )
+
+    bounds = np.linspace(world_start, world_stop, n_chunks + 1).astype(int)
+    with (
+        get_alt_worlds_executor(membership, min(n_workers, n_chunks))
+        if executor is None
+        else contextlib.nullcontext(executor)
+    ) as executor:
+        futures = [
+            executor.submit(
+                _alt_worlds_maxima_task,
+                N,
+                P,
+                int(chunk_start),
+                int(chunk_stop),
+                seed,
+                engine,
+                count_sampler,
+                stat_kernel,
+            )
+            for chunk_start, chunk_stop in zip(bounds[:-1], bounds[1:])
+        ]
+        maxima = np.concatenate([future.result() for future in futures])
+
+    return maxima
+
+
+def get_n_workers():
+    """
+    Number of worker processes for the world simulation, read from the
+    SPATIAL_BIAS_N_WORKERS environment variable ("0" for one per CPU). Defaults to 1.
+    """
+
+    n_workers = int(os.getenv("SPATIAL_BIAS_N_WORKERS", "1"))
+
+    return os.cpu_count() if n_workers == 0 else n_workers
+
+
+def scan_alt_worlds(
+    n_alt_worlds,
+    regions,
+    N,
+    P,
+    seed=None,
+    verbose=False,
+    engine="auto",
+    count_sampler="binomial",
+    keep_worlds=False,
+    n_workers=None,
+    stat_kernel="float",
+    executor=None,
+):
+    """
+    Scans multiple alternative worlds and keeps the maximum likelihood of each one.
 
     Args:
         n_alt_worlds (int): Number of alternative worlds to generate.
-        regions (list): List of regions.
+        regions (list, RegionMembership or CountSpaceRegions): List of regions, or the
+            sizes of the regions (or of their cells) for the "counts" engine.
         N (int): Total number of elements.
         P (int): Total number of positive elements.
         seed (int, optional): Seed for reproducibility. Defaults to None.
         verbose (bool, optional): If True, prints additional information. Defaults to False.
+        engine (str, optional): "sparse" to scan the worlds in blocks through the CSR
+            membership matrix, "fused" to scan the same blocks with a compiled kernel
+            (see `fused_worlds_maxima`, falls back to "sparse" without numba), "loop" to
+            scan them one at a time (all three draw the same worlds), "counts" to draw the
+            region counts directly (non-overlapping regions only) or "auto" to use
+            "counts" when the regions do not overlap and "fused" otherwise.
+            Defaults to "auto".
+        count_sampler (str, optional): Null model of the "counts" engine, see
+            `get_random_region_counts`. Defaults to "binomial".
+        keep_worlds (bool, optional): Whether to keep the labels of every world, for
+            debugging only since it needs O(n_alt_worlds x N) memory. Defaults to False.
+        n_workers (int, optional): Number of worker processes (serial if `keep_worlds`).
+            Defaults to `get_n_workers()`.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        executor (ProcessPoolExecutor, optional): Shared pool of the workers, see
+            `get_alt_worlds_executor`. Defaults to None.
 
     Returns:
-        tuple: A list of alternative worlds sorted by likelihood and the highest likelihood value.
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
+
+    membership = RegionMembership.from_regions(regions, N)
+    engine = resolve_engine(membership, engine, keep_worlds)
+    n_workers = get_n_workers() if n_workers is None else n_workers
+
+    null_distr = NullDistribution(n_alt_worlds, keep_worlds=keep_worlds)
+    null_distr.add(
+        get_alt_worlds_maxima(
+            membership,
+            N,
+            P,
+            0,
+            n_alt_worlds,
+            seed,
+            engine,
+            count_sampler,
+            verbose=verbose,
+            worlds=null_distr.worlds,
+            n_workers=n_workers,
+            stat_kernel=stat_kernel,
+            executor=executor,
+        )
+    )
+
+    return null_distr
+
+
+def get_null_distribution(
+    n_alt_worlds,
+    regions,
+    N,
+    P,
+    seed,
+    engine="auto",
+    count_sampler="binomial",
+    n_workers=None,
+    cache=None,
+    stat_kernel="float",
+    executor=None,
+):
     """
+    Same as `scan_alt_worlds`, but looks the per-world maxima up in a cache first.
 
-    alt_worlds = []
-    current_seed = seed
+    Since world `i` is always drawn from `get_world_rng(seed, i)`, a stored simulation
+    with more worlds is cut to the first `n_alt_worlds`, and a stored simulation with fewer
+    worlds is extended by simulating only the missing ones, which gives exactly the
+    maxima of a fresh run. Without a seed the simulation is not reproducible, so it is
+    never cached.
 
-    for _ in range(n_alt_worlds):
-        alt_types = get_random_types(N, P, current_seed)
-        cur_P = np.sum(alt_types)
-        alt_max_likeli, _ = scan_regions(regions, alt_types, N, cur_P, verbose=verbose)
-        alt_worlds.append((alt_types, alt_max_likeli))
+    Args:
+        n_alt_worlds (int): Number of alternative worlds to generate.
+        regions (list or RegionMembership): List of regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        seed (int): Seed of the simulation.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        cache (NullCache, optional): The cache. Defaults to `get_null_cache()`.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        executor (ProcessPoolExecutor, optional): Shared pool of the workers, see
+            `get_alt_worlds_executor`. Defaults to None.
 
-        if current_seed is not None:
-            current_seed += 1
+    Returns:
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
 
-    alt_worlds.sort(key=lambda x: -x[1])
+    if seed is None:
+        return scan_alt_worlds(
+            n_alt_worlds,
+            regions,
+            N,
+            P,
+            engine=engine,
+            count_sampler=count_sampler,
+            n_workers=n_workers,
+            stat_kernel=stat_kernel,
+            executor=executor,
+        )
 
-    return alt_worlds
+    membership = RegionMembership.from_regions(regions, N)
+    engine = resolve_engine(membership, engine)
+    cache = get_null_cache() if cache is None else cache
+
+    key = get_null_key(membership, N, P, seed, engine, count_sampler, stat_kernel)
+    stored = cache.get(key)
+
+    null_distr = NullDistribution(n_alt_worlds)
+    if stored is not None:
+        null_distr.add(stored[:n_alt_worlds])
+
+    if null_distr.n_worlds < n_alt_worlds:
+        null_distr.add(
+            get_alt_worlds_maxima(
+                membership,
+                N,
+                P,
+                null_distr.n_worlds,
+                n_alt_worlds,
+                seed,
+                engine,
+                count_sampler,
+                n_workers=n_workers,
+                stat_kernel=stat_kernel,
+                executor=executor,
+            )
+        )
+        cache.put(key, null_distr.maxima)
+
+    return null_distr
 
 
 def get_signif_threshold(
-    signif_level, n_alt_worlds, regions, N, P, seed=None, verbose=False
+    signif_level,
+    n_alt_worlds,
+    regions,
+    N,
+    P,
+    seed=None,
+    verbose=False,
+    engine="auto",
+    count_sampler="binomial",
+    n_workers=None,
+    stat_kernel="float",
 ):
     """
     Computes the significance threshold based on alternative worlds.
@@ -458,49 +1103,730 @@ def get_signif_threshold(
         P (int): Total number of positive elements.
         seed (int, optional): Seed for reproducibility. Defaults to None.
         verbose (bool, optional): If True, prints additional information. Defaults to False.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
 
     Returns:
         float: The computed significance threshold.
     """
 
-    alt_worlds = scan_alt_worlds(n_alt_worlds, regions, N, P, seed, verbose)
-
-    k = int(signif_level * n_alt_worlds)
+    null_distr = scan_alt_worlds(
+        n_alt_worlds,
+        regions,
+        N,
+        P,
+        seed,
+        verbose,
+        engine,
+        count_sampler,
+        n_workers=n_workers,
+        stat_kernel=stat_kernel,
+    )
 
-    signif_thresh = alt_worlds[k][1]  ## get the max likelihood at position k
+    ## the max likelihood at position k of the worlds ranked by decreasing likelihood
+    signif_thresh = null_distr.threshold(signif_level)
 
     return signif_thresh
 
 
+def get_signif_threshold_adaptive(
+    signif_level,
+    regions,
+    N,
+    P,
+    seed=None,
+    tolerance=0.05,
+    max_worlds=100_000,
+    batch_size=400,
+    confidence=0.95,
+    engine="auto",
+    count_sampler="binomial",
+    n_workers=None,
+    cache=None,
+    stat_kernel="float",
+    threshold_method="empirical",
+    executor=None,
+):
+    """
+    Computes the significance threshold with a sequential Monte Carlo simulation.
+
+    Alternative worlds are simulated in batches until the confidence interval of the
+    threshold is narrower than `tolerance` (relative to the threshold) or `max_worlds`
+    worlds have been simulated. With a cache and a seed, the batches are first taken
+    from the stored worlds of the same simulation, see `get_null_distribution`. All the
+    batches are scanned on the same pool of workers.
+
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        regions (list, RegionMembership or CountSpaceRegions): List of regions, see
+            `scan_alt_worlds`.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        tolerance (float, optional): Maximum width of the confidence interval relative to
+            the threshold. Defaults to 0.05.
+        max_worlds (int, optional): Maximum number of worlds to simulate. Defaults to 100_000.
+        batch_size (int, optional): Number of worlds per batch. Defaults to 400.
+        confidence (float, optional): Confidence of the interval. Defaults to 0.95.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        cache (NullCache, optional): Cache of the simulated worlds. Defaults to None.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+        executor (ProcessPoolExecutor, optional): Shared pool of the workers, see
+            `get_alt_worlds_executor`. Defaults to None (a pool for all the batches).
+
+    Returns:
+        tuple: The significance threshold and the NullDistribution of the simulated worlds.
+    """
+
+    membership = RegionMembership.from_regions(regions, N)
+    engine = resolve_engine(membership, engine)
+    n_workers = get_n_workers() if n_workers is None else n_workers
+
+    stored = np.zeros(0)
+    if cache is not None and seed is not None:
+        key = get_null_key(membership, N, P, seed, engine, count_sampler, stat_kernel)
+        stored = cache.get(key)
+        stored = np.zeros(0) if stored is None else stored
+    else:
+        cache = None
+    ## one stream for all the batches
+    seed = resolve_seed(seed)
+
+    null_distr = NullDistribution(
+        min(max_worlds, 4 * batch_size), threshold_method=threshold_method
+    )
+    ## the pool is started (and the membership shipped) once for all the batches
+    with (
+        get_alt_worlds_executor(membership, n_workers)
+        if executor is None and n_workers > 1
+        else contextlib.nullcontext(executor)
+    ) as executor:
+        while null_distr.n_worlds < max_worlds:
+            world_start = null_distr.n_worlds
+            world_stop = min(world_start + batch_size, max_worlds)
+            if world_stop <= len(stored):
+                null_distr.add(stored[world_start:world_stop])
+            else:
+                null_distr.add(stored[world_start:])
+                null_distr.add(
+                    get_alt_worlds_maxima(
+                        membership,
+                        N,
+                        P,
+                        null_distr.n_worlds,
+                        world_stop,
+                        seed,
+                        engine,
+                        count_sampler,
+                        n_workers=n_workers,
+                        stat_kernel=stat_kernel,
+                        executor=executor,
+                    )
+                )
+
+            signif_thresh = null_distr.threshold(signif_level)
+            ci_low, ci_high = null_distr.threshold_ci(signif_level, confidence)
+            if ci_high - ci_low <= tolerance * abs(signif_thresh):
+                break
+
+    if cache is not None and null_distr.n_worlds > len(stored):
+        cache.put(key, null_distr.maxima)
+
+    return null_distr.threshold(signif_level), null_distr
+
+
+def get_scan_null_distribution(
+    signif_level,
+    n_alt_worlds,
+    regions,
+    N,
+    P,
+    seed=None,
+    engine="auto",
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    n_workers=None,
+    use_cache=True,
+    stat_kernel="float",
+    threshold_method="empirical",
+    executor=None,
+):
+    """
+    Simulates (or looks up) the null distribution of an audit.
+
+    Args:
+        signif_level (float): Significance level, used by the "auto" mode to stop.
+        n_alt_worlds (int or str): Number of alternative worlds, or "auto" to simulate
+            until the threshold converges (see `get_signif_threshold_adaptive`).
+        regions (list or RegionMembership): List of regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode. Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode. Defaults to 100_000.
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        use_cache (bool, optional): Whether to go through the null cache, see
+            `get_null_distribution`. Defaults to True.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        threshold_method (str, optional): Threshold estimator of the null distribution,
+            "empirical", "gpd", "gumbel" or "auto", see `NullDistribution`. Defaults to
+            "empirical".
+        executor (ProcessPoolExecutor, optional): Shared pool of the workers, see
+            `get_alt_worlds_executor`. Defaults to None.
+
+    Returns:
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
+
+    if n_alt_worlds == "auto":
+        _, null_distr = get_signif_threshold_adaptive(
+            signif_level,
+            regions,
+            N,
+            P,
+            seed,
+            tolerance=n_worlds_tol,
+            max_worlds=max_n_worlds,
+            engine=engine,
+            n_workers=n_workers,
+            stat_kernel=stat_kernel,
+            cache=get_null_cache() if use_cache else None,
+            threshold_method=threshold_method,
+            executor=executor,
+        )
+    elif use_cache:
+        null_distr = get_null_distribution(
+            n_alt_worlds,
+            regions,
+            N,
+            P,
+            seed,
+            engine=engine,
+            n_workers=n_workers,
+            stat_kernel=stat_kernel,
+            executor=executor,
+        )
+    else:
+        null_distr = scan_alt_worlds(
+            n_alt_worlds,
+            regions,
+            N,
+            P,
+            seed,
+            engine=engine,
+            n_workers=n_workers,
+            stat_kernel=stat_kernel,
+            executor=executor,
+        )
+    null_distr.threshold_method = threshold_method
+
+    return null_distr
+
+
+class AuditState:
+    """
+    The counts, statistics and null distribution of an audit, kept so that the audit can
+    be updated after a few predictions change instead of being recomputed.
+
+    A change of the prediction of an individual only changes the positives of the
+    regions it belongs to, found through the inverse (individuals x regions) membership,
+    so updating the counts costs O(changes x memberships per individual). The statistics
+    are recomputed for the touched regions only while P is unchanged, and for all the
+    regions (still without touching the individuals) otherwise. The null distribution
+    only depends on N and P, so it is reused while P is unchanged and looked up (or
+    simulated) again through the null cache when P changes.
+
+    Attributes:
+        membership (RegionMembership): CSR membership of the audited individuals.
+        y_pred (np.ndarray): Current predictions of the audited individuals.
+        p_s (np.ndarray): Current positives of every region.
+        scores (np.ndarray): Current statistic of every region.
+        null_distr (NullDistribution or AnalyticNullDistribution): Null distribution of
+            the current P.
+        full_sizes (np.ndarray): Sizes of the regions in the full data, None unless the
+            audited individuals are a sample.
+        full_N (int): Number of audited individuals in the full data.
+        null_model (callable): Null distribution of given N and P, None for the scan of
+            the regions.
+    """
+
+    def __init__(
+        self,
+        membership,
+        y_pred,
+        audit_index,
+        signif_level,
+        n_alt_worlds,
+        seed=None,
+        signif_levels=None,
+        full_sizes=None,
+        full_N=None,
+        ci_confidence=0.95,
+        significance="simulated",
+        null_model=None,
+        **simulation_kwargs,
+    ):
+        """
+        Args:
+            membership (RegionMembership): CSR membership of the audited individuals.
+            y_pred (np.ndarray): Predictions of the audited individuals.
+            audit_index (np.ndarray): Audited index of every original individual, -1 for
+                the individuals outside the audit (y_true == 0 for equal opportunity).
+            signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+            n_alt_worlds (int or str): Number of alternative worlds, or "auto".
+            seed (int, optional): Seed for reproducibility. Defaults to None.
+            signif_levels (list, optional): Extra significance levels. Defaults to None.
+            full_sizes (np.ndarray, optional): Sizes of the regions in the full data, when
+                the audited individuals are a sample (see `get_stratified_sample_mask`).
+                Defaults to None.
+            full_N (int, optional): Number of audited individuals in the full data, when
+                they are sampled. Defaults to None.
+            ci_confidence (float, optional): Confidence of the statistic intervals of a
+                sample. Defaults to 0.95.
+            significance (str, optional): "simulated" for the Monte Carlo null
+                distribution, or "analytic" for the conservative bound of
+                `AnalyticNullDistribution`. Defaults to "simulated".
+            null_model (callable, optional): Returns the null distribution of (N, P),
+                when the regions were selected from a larger scanned family (e.g. the
+                leaves of a quadtree, see `QuadTreeNullModel`). Defaults to None.
+            **simulation_kwargs: Extra arguments of `get_scan_null_distribution`.
+        """
+
+        self.membership = membership
+        self.y_pred = np.array(y_pred, dtype=np.int64)
+        self.audit_index = np.asarray(audit_index, dtype=np.int64)
+        self.signif_level = signif_level
+        self.n_alt_worlds = n_alt_worlds
+        self.seed = seed
+        self.signif_levels = [] if signif_levels is None else list(signif_levels)
+        self.full_sizes = full_sizes
+        self.full_N = full_N
+        self.ci_confidence = ci_confidence
+        self.significance = significance
+        self.null_model = null_model
+        self.simulation_kwargs = simulation_kwargs
+        self._inverse = None
+
+        self.N, self.P = len(self.y_pred), int(np.sum(self.y_pred))
+        self.n_s = membership.sizes
+        self.p_s = membership.region_counts(self.y_pred)
+        _, _, self.scores = compute_statistics_vec(self.n_s, self.p_s, self.N, self.P)
+        self.null_distr = self._get_null_distribution()
+
+    def _get_null_distribution(self):
+        if self.null_model is not None:
+            return self.null_model(self.N, self.P)
+        if self.significance == "analytic":
+            return AnalyticNullDistribution(self.n_s, self.N, self.P)
+
+        return get_scan_null_distribution(
+            self.signif_level,
+            self.n_alt_worlds,
+            self.membership,
+            self.N,
+            self.P,
+            self.seed,
+            **self.simulation_kwargs,
+        )
+
+    @property
+    def inverse(self):
+        """The (individuals x regions) membership, built on first use."""
+        if self._inverse is None:
+            matrix = self.membership.matrix.T.tocsr()
+            self._inverse = RegionMembership(
+                matrix.indptr, matrix.indices, self.membership.n_regions
+            )
+        return self._inverse
+
+    def apply_changes(self, changes):
+        """
+        Updates the audit after some predictions changed.
+
+        Args:
+            changes (array-like): (index, old, new) of every changed prediction, with
+                the index among all the original individuals.
+
+        Returns:
+            np.ndarray: The regions whose positives changed.
+        """
+
+        changes = np.asarray(changes, dtype=np.int64).reshape(-1, 3)
+        idx = self.audit_index[changes[:, 0]]
+        audited = idx >= 0
+        idx, old, new = idx[audited], changes[audited, 1], changes[audited, 2]
+
+        if np.any(self.y_pred[idx] != old):
+            raise ValueError("The changes do not match the audited predictions")
+        self.y_pred[idx] = new
+
+        ## positives of the regions of every changed individual
+        delta = new - old
+        starts, stops = self.inverse.indptr[idx], self.inverse.indptr[idx + 1]
+        touched = np.concatenate(
+            [self.inverse.indices[start:stop] for start, stop in zip(starts, stops)]
+            + [np.zeros(0, dtype=np.int64)]
+        )
+        np.add.at(self.p_s, touched, np.repeat(delta, stops - starts))
+        touched = np.unique(touched)
+
+        P = self.P + int(delta.sum())
+        if P != self.P:
+            ## P enters every statistic and the null distribution
+            self.P = P
+            _, _, self.scores = compute_statistics_vec(
+                self.n_s, self.p_s, self.N, self.P
+            )
+            self.null_distr = self._get_null_distribution()
+        elif len(touched) > 0:
+            _, _, self.scores[touched] = compute_statistics_vec(
+                self.n_s[touched], self.p_s[touched], self.N, self.P
+            )
+
+        return touched
+
+    def results(self):
+        """
+        Returns:
+            tuple: The scanned regions dataframe, the significance threshold and the
+            simulation info, see `get_signif_thresh_scanned_regions`.
+        """
+
+        signif_thresh = self.null_distr.threshold(self.signif_level)
+        df_scanned_regs = pd.DataFrame(
+            {
+                "signif": self.scores >= signif_thresh,
+                "statistic": self.scores,
+                "p_value": self.null_distr.p_values(self.scores),
+            }
+        )
+        info = {
+            "n_worlds": self.null_distr.n_worlds,
+            "signif_thresh_ci": self.null_distr.threshold_ci(self.signif_level),
+            "signif_threshs": dict(
+                zip(self.signif_levels, self.null_distr.thresholds(self.signif_levels))
+            ),
+            "threshold_method": self.null_distr.tail_model(self.signif_level)
+            or "empirical",
+            "approx_fraction": 1.0,
+        }
+
+        if self.full_sizes is not None:
+            ## the statistic is normalized by the log-likelihood of the whole data, which
+            ## grows linearly with N, while the null maxima of the log-likelihood ratio
+            ## do not depend on N, so the threshold of the full data is rescaled
+            full_signif_thresh = signif_thresh * self.N / self.full_N
+            ci_low, ci_high = get_statistic_ci(
+                self.n_s,
+                self.p_s,
+                self.full_sizes,
+                self.N,
+                self.P,
+                self.full_N,
+                self.ci_confidence,
+            )
+            df_scanned_regs["n_sampled"] = self.n_s
+            df_scanned_regs["statistic_ci_low"] = ci_low
+            df_scanned_regs["statistic_ci_high"] = ci_high
+            df_scanned_regs["ambiguous"] = get_ambiguous_regions(
+                df_scanned_regs["signif"].to_numpy(),
+                ci_low,
+                ci_high,
+                full_signif_thresh,
+            )
+            info["approx_fraction"] = self.N / self.full_N
+            info["full_signif_thresh"] = full_signif_thresh
+
+        return df_scanned_regs, signif_thresh, info
+
+
 def get_signif_thresh_scanned_regions(
-    signif_level, n_alt_worlds, regions, y_pred, y_true=None, seed=None
+    signif_level,
+    n_alt_worlds,
+    regions,
+    y_pred,
+    y_true=None,
+    seed=None,
+    engine="auto",
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    with_info=False,
+    n_workers=None,
+    use_cache=True,
+    stat_kernel="float",
+    signif_levels=None,
+    with_state=False,
+    approx_fraction=None,
+    max_individuals=None,
+    ci_confidence=0.95,
+    threshold_method="empirical",
+    significance="simulated",
+    null_model=None,
 ):
+    """
+    Scans the regions and flags the ones whose statistic exceeds the significance threshold.
+
+    All the outputs come from one simulation: the per-region Monte Carlo p-values are
+    binary searches of the statistics in the sorted null maxima, and the thresholds of
+    extra significance levels are read from the same maxima.
+
+    With `approx_fraction` or `max_individuals`, the audit runs on a sample stratified by
+    region (see `get_stratified_sample_mask`): the statistics, the null distribution and
+    the threshold are the ones of the sample, and every region gets a confidence
+    interval of its full-data statistic. The regions whose significance in the exact
+    audit is not settled by their interval and the rescaled threshold of the full data
+    are flagged as ambiguous (see `get_ambiguous_regions`), to be checked exactly.
 
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        n_alt_worlds (int or str): Number of alternative worlds, or "auto" to simulate
+            until the threshold converges (see `get_signif_threshold_adaptive`).
+        regions (list): List of regions, each containing point indices.
+        y_pred (np.ndarray): Predicted labels.
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode. Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode. Defaults to 100_000.
+        with_info (bool, optional): Whether to also return the simulation info. Defaults to False.
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        use_cache (bool, optional): Whether to reuse the null distributions of previous
+            calls with the same regions, N, P and seed, simulating only the worlds
+            that were not stored yet, see `get_null_distribution`. Defaults to True.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        signif_levels (list, optional): Extra significance levels whose thresholds are
+            returned in the info. Defaults to None.
+        with_state (bool, optional): Whether to also return the `AuditState`, to update
+            the audit after prediction changes. Defaults to False.
+        approx_fraction (float, optional): Fraction of the audited individuals to sample.
+            Defaults to None (exact audit).
+        max_individuals (int, optional): Maximum number of sampled individuals.
+            Defaults to None (exact audit).
+        ci_confidence (float, optional): Confidence of the statistic intervals of an
+            approximate audit. Defaults to 0.95.
+        threshold_method (str, optional): Threshold estimator, "empirical", "gpd",
+            "gumbel" or "auto" (a tail model when too few worlds exceed the threshold),
+            see `NullDistribution`. Defaults to "empirical".
+        significance (str, optional): "simulated", or "analytic" to skip the simulation
+            and use the conservative threshold and p-values of
+            `AnalyticNullDistribution`. Defaults to "simulated".
+        null_model (callable, optional): Null distribution of the audit's (N, P), used
+            instead of a simulation of the regions when they were selected from a
+            larger scanned family, see `AuditState`. Defaults to None.
+
+    Returns:
+        tuple: The scanned regions dataframe with "signif", "statistic" and "p_value"
+        columns (and "n_sampled", "statistic_ci_low", "statistic_ci_high" and
+        "ambiguous" for an approximate audit), the significance threshold, if
+        `with_info`, a dict with the number of worlds used ("n_worlds"), the confidence
+        interval of the threshold ("signif_thresh_ci"), the thresholds of
+        `signif_levels` ("signif_threshs", a dict from level to threshold), the
+        estimator of the threshold ("threshold_method", "empirical", "gpd", "gumbel"
+        or "analytic"), the sampled fraction ("approx_fraction") and, for an approximate audit, the
+        estimated threshold of the full data ("full_signif_thresh") and, if
+        `with_state`, the `AuditState`.
+    """
+
+    y_pred = np.asarray(y_pred)
+
+    ## the membership matrix is built once and shared by all the worlds
+    membership = RegionMembership.from_regions(regions, len(y_pred))
+    audit_index = np.arange(len(y_pred))
     if y_true is not None:
         assert len(y_pred) == len(y_true), "y_pred and y_true must have the same length"
 
-        y_pred_pos_indices, regions = get_pos_info_regions(y_true, regions)
-        y_pred = y_pred[y_pred_pos_indices]
-
-    N, P = len(y_pred), np.sum(y_pred)
-    signif_thresh = get_signif_threshold(
-        signif_level, n_alt_worlds, regions, N, P, seed
+        ## equal opportunity: the audit is restricted to the individuals with y_true == 1
+        pos_mask = np.asarray(y_true) == 1
+        membership = membership.subset(pos_mask)
+        y_pred = y_pred[pos_mask]
+        audit_index = np.where(pos_mask, np.cumsum(pos_mask) - 1, -1)
+
+    full_sizes, full_N = None, None
+    fraction = get_sample_fraction(len(y_pred), approx_fraction, max_individuals)
+    if fraction < 1 and null_model is not None:
+        raise ValueError("A null model cannot be combined with an approximate audit")
+    if fraction < 1:
+        full_sizes, full_N = membership.sizes, len(y_pred)
+        sample_mask = get_stratified_sample_mask(membership, fraction, seed)
+        membership = membership.subset(sample_mask)
+        y_pred = y_pred[sample_mask]
+        sample_index = np.where(sample_mask, np.cumsum(sample_mask) - 1, -1)
+        audit_index = np.where(audit_index >= 0, sample_index[audit_index], -1)
+
+    state = AuditState(
+        membership,
+        y_pred,
+        audit_index,
+        signif_level,
+        n_alt_worlds,
+        seed,
+        signif_levels=signif_levels,
+        full_sizes=full_sizes,
+        full_N=full_N,
+        ci_confidence=ci_confidence,
+        significance=significance,
+        null_model=null_model,
+        engine=engine,
+        n_worlds_tol=n_worlds_tol,
+        max_n_worlds=max_n_worlds,
+        n_workers=n_workers,
+        use_cache=use_cache,
+        stat_kernel=stat_kernel,
+        threshold_method=threshold_method,
     )
+    df_scanned_regs, signif_thresh, info = state.results()
+
+    outputs = (df_scanned_regs, signif_thresh)
+    if with_info:
+        outputs += (info,)
+    if with_state:
+        outputs += (state,)
+
+    return outputs
+
+
+def get_signif_thresh_scanned_regions_batch(
+    signif_level,
+    n_alt_worlds,
+    regions,
+    y_preds,
+    y_true=None,
+    seed=None,
+    engine="auto",
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    p_bucket=1,
+    n_workers=None,
+    use_cache=True,
+    stat_kernel="float",
+    threshold_method="empirical",
+    significance="simulated",
+):
+    """
+    Scans the regions for many prediction vectors at once.
 
-    _, statistics = scan_regions(regions, y_pred, N, P, verbose=False)
+    The membership is built once and the positives of every region for every vector are
+    obtained with one sparse product. The null distribution only depends on N and P,
+    so it is simulated once per distinct number of positives, or once per bucket of
+    `p_bucket` positives, and shared by all the vectors of that bucket.
 
-    scanned_regions = []
-    for i in range(len(regions)):
-        signif = False
-        if statistics[i] >= signif_thresh:
-            signif = True
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        n_alt_worlds (int or str): Number of alternative worlds, or "auto".
+        regions (list): List of regions, each containing point indices.
+        y_preds (np.ndarray): (models x N) matrix of predicted labels.
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        engine (str, optional): World scanning engine, see `scan_alt_worlds`. Defaults to "auto".
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode. Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode. Defaults to 100_000.
+        p_bucket (int, optional): Width of the buckets of P sharing a null distribution,
+            whose P is rounded to the closest multiple of `p_bucket`. Defaults to 1 (exact P).
+        n_workers (int, optional): Number of worker processes. Defaults to `get_n_workers()`.
+        use_cache (bool, optional): Whether to go through the null cache. Defaults to True.
+        stat_kernel (str, optional): Statistic kernel of the worlds, see `get_stat_kernel`.
+            Defaults to "float".
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+        significance (str, optional): "simulated" or "analytic", see
+            `get_signif_thresh_scanned_regions`. Defaults to "simulated".
+
+    Returns:
+        tuple: The scanned regions dataframe with one row per model and region ("model",
+        "region", "signif", "statistic" and "p_value" columns), the significance
+        threshold of every model and a dict with the number of worlds ("n_worlds") and
+        the P of the null distribution ("null_P") of every model.
+    """
+
+    y_preds = np.atleast_2d(np.asarray(y_preds))
+    n_models = y_preds.shape[0]
+
+    membership = RegionMembership.from_regions(regions, y_preds.shape[1])
+    if y_true is not None:
+        assert y_preds.shape[1] == len(
+            y_true
+        ), "y_preds and y_true must have the same length"
+
+        pos_mask = np.asarray(y_true) == 1
+        membership = membership.subset(pos_mask)
+        y_preds = y_preds[:, pos_mask]
 
-        reg = {
-            "signif": signif,
-            "statistic": statistics[i],
+    N = y_preds.shape[1]
+    Ps = y_preds.sum(axis=1)
+
+    ## (regions x models) positives with one sparse product
+    _, _, scores = compute_statistics_vec(
+        membership.sizes[:, None], membership.region_counts(y_preds.T), N, Ps
+    )
+
+    null_Ps = np.clip(np.rint(Ps / p_bucket).astype(np.int64) * p_bucket, 0, N)
+    n_workers = get_n_workers() if n_workers is None else n_workers
+    ## one pool of workers for the null distributions of all the buckets
+    with (
+        get_alt_worlds_executor(membership, n_workers)
+        if significance == "simulated" and n_workers > 1
+        else contextlib.nullcontext()
+    ) as executor:
+        null_distrs = {
+            null_P: (
+                AnalyticNullDistribution(membership.sizes, N, null_P)
+                if significance == "analytic"
+                else get_scan_null_distribution(
+                    signif_level,
+                    n_alt_worlds,
+                    membership,
+                    N,
+                    null_P,
+                    seed,
+                    engine=engine,
+                    n_worlds_tol=n_worlds_tol,
+                    max_n_worlds=max_n_worlds,
+                    n_workers=n_workers,
+                    use_cache=use_cache,
+                    stat_kernel=stat_kernel,
+                    threshold_method=threshold_method,
+                    executor=executor,
+                )
+            )
+            for null_P in np.unique(null_Ps).tolist()
         }
-        scanned_regions.append(reg)
 
-    df_scanned_regs = pd.DataFrame(scanned_regions)
+    signif_threshs = np.array(
+        [null_distrs[null_P].threshold(signif_level) for null_P in null_Ps.tolist()]
+    )
+    p_values = np.column_stack(
+        [
+            null_distrs[null_P].p_values(scores[:, m])
+            for m, null_P in enumerate(null_Ps.tolist())
+        ]
+    ).reshape(scores.shape)
+
+    df_scanned_regs = pd.DataFrame(
+        {
+            "model": np.repeat(np.arange(n_models), membership.n_regions),
+            "region": np.tile(np.arange(membership.n_regions), n_models),
+            "signif": (scores >= signif_threshs).T.ravel(),
+            "statistic": scores.T.ravel(),
+            "p_value": p_values.T.ravel(),
+        }
+    )
+
+    info = {
+        "n_worlds": np.array(
+            [null_distrs[null_P].n_worlds for null_P in null_Ps.tolist()]
+        ),
+        "null_P": null_Ps,
+    }
 
-    return df_scanned_regs, signif_thresh
+    return df_scanned_regs, signif_threshs, info
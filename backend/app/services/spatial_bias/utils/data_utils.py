@@ -1,6 +1,11 @@
 import pandas as pd
 import numpy as np
 from ast import literal_eval
+from app.services.spatial_bias.utils.membership_utils import (
+    RegionMembership,
+    build_region_membership,
+    flatten_region_ids,
+)
 from app.services.spatial_bias.methods.models.optimization_model import (
     SpatialOptimFairnessModel,
 )
@@ -115,16 +120,14 @@ def get_pos_info_regions(y_true, points_per_region):
 
     """
 
-    pos_y_true_indices = np.where(np.array(y_true) == 1)[0]
-    point_2_new_pos_set_idx = {point: i for i, point in enumerate(pos_y_true_indices)}
+    pos_mask = np.asarray(y_true) == 1
+    pos_y_true_indices = np.where(pos_mask)[0]
 
-    pos_points_per_region = [[] for _ in range(len(points_per_region))]
-    for region_idx, pts in enumerate(points_per_region):
-        for point in pts:
-            if point in pos_y_true_indices:
-                pos_points_per_region[region_idx].append(point_2_new_pos_set_idx[point])
+    pos_membership = RegionMembership.from_regions(
+        points_per_region, len(pos_mask)
+    ).subset(pos_mask)
 
-    return pos_y_true_indices, pos_points_per_region
+    return pos_y_true_indices, pos_membership.to_lists()
 
 
 def get_metric(metric_name, y_true, y_pred):
@@ -144,6 +147,16 @@ def get_metric(metric_name, y_true, y_pred):
 
 def get_positive_rates(y_pred, regions, y_true=None):
     y_pred = np.array(y_pred)
+    if isinstance(regions, RegionMembership):
+        ## one sparse product instead of a loop over the regions
+        if y_true is not None:
+            pos_mask = np.asarray(y_true) == 1
+            regions, y_pred = regions.subset(pos_mask), y_pred[pos_mask]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pr_regions = regions.region_counts(y_pred) / regions.sizes
+
+        return np.sum(y_pred) / len(y_pred), pr_regions.tolist()
+
     if y_true is not None:
         y_true = np.array(y_true)
         # For equal opportunity, we need to compute the positive regions
@@ -167,14 +180,60 @@ def get_positive_rates(y_pred, regions, y_true=None):
     return PR, pr_regions
 
 
+def get_prediction_changes(y_pred, new_y_pred):
+    """
+    Lists the predictions that differ between two prediction vectors.
+
+    Args:
+        y_pred (array-like): Previous predictions.
+        new_y_pred (array-like): New predictions.
+
+    Returns:
+        np.ndarray: (changes x 3) matrix of (index, old, new) of every changed prediction.
+    """
+
+    y_pred = np.asarray(y_pred, dtype=np.int64)
+    new_y_pred = np.asarray(new_y_pred, dtype=np.int64)
+    idx = np.flatnonzero(y_pred != new_y_pred)
+
+    return np.column_stack([idx, y_pred[idx], new_y_pred[idx]])
+
+
+def apply_prediction_changes(y_pred, changes):
+    """
+    Applies prediction changes to a copy of the predictions they were computed from.
+
+    Args:
+        y_pred (array-like): Previous predictions.
+        changes (array-like): (index, old, new) of every changed prediction, see
+            `get_prediction_changes`.
+
+    Raises:
+        ValueError: If an index is out of range or repeated, or if an old prediction
+            does not match y_pred.
+
+    Returns:
+        np.ndarray: The new predictions.
+    """
+
+    y_pred = np.array(y_pred)
+    changes = np.asarray(changes, dtype=np.int64).reshape(-1, 3)
+    idx = changes[:, 0]
+
+    if np.any((idx < 0) | (idx >= len(y_pred))):
+        raise ValueError("The changes refer to individuals out of range")
+    if len(np.unique(idx)) < len(idx):
+        raise ValueError("The changes refer to the same individual several times")
+    if np.any(y_pred[idx] != changes[:, 1]):
+        raise ValueError("The changes do not match the previous predictions")
+
+    y_pred[idx] = changes[:, 2]
+
+    return y_pred
+
+
 def get_regions(reg_ids_per_individual):
-    all_reg_ids = [reg_id for reg_ids in reg_ids_per_individual for reg_id in reg_ids]
-    unique_regions = set(all_reg_ids)
-    regions = {region_id: [] for region_id in unique_regions}
-    for i, region_ids in enumerate(reg_ids_per_individual):
-        for region_id in region_ids:
-            regions[region_id].append(i)
-
-    sorted_regions_ids = sorted(regions.keys())
-    sorted_regions = [regions[region_id] for region_id in sorted_regions_ids]
-    return sorted_regions
+    membership, _, _ = build_region_membership(
+        *flatten_region_ids(reg_ids_per_individual)
+    )
+    return membership.to_lists()
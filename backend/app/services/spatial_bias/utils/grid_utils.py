@@ -0,0 +1,289 @@
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+from app.services.spatial_bias.utils.membership_utils import CountSpaceRegions
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+
+def get_lattice_fractions(max_partition):
+    """
+    Computes the finest lattice shared by the splits of an axis in 1..max_partition parts.
+
+    Args:
+        max_partition (int): Maximum number of parts of the axis.
+
+    Returns:
+        list: The sorted distinct fractions k / i of the axis extent, from 0 to 1.
+    """
+
+    return sorted(
+        {Fraction(k, i) for i in range(1, max_partition + 1) for k in range(0, i + 1)}
+    )
+
+
+class GridFamily:
+    """
+    All the i x j grids (1 <= i <= max_rows latitude rows, 1 <= j <= max_cols longitude
+    columns) over a bounding box, as produced by `create_grid_partitioning`.
+
+    The individuals are binned once into the finest common lattice of all the grids, so
+    the counts of any cell of any grid are the sum of a rectangle of lattice cells, read
+    in O(1) from the 2D prefix sums (summed-area table) of the lattice counts.
+
+    Attributes:
+        grids (list): (rows, cols, row, col) of every cell of every grid, in grid order
+            and then row-major order.
+        lattice_cell (np.ndarray): Flat lattice cell of every individual.
+        lattice_shape (tuple): Number of lattice rows and columns.
+    """
+
+    def __init__(self, lats, lons, max_rows, max_cols, bounds=None, skip_whole=True):
+        """
+        Args:
+            lats (array-like): Latitude of every individual.
+            lons (array-like): Longitude of every individual.
+            max_rows (int): Maximum number of latitude rows.
+            max_cols (int): Maximum number of longitude columns.
+            bounds (tuple, optional): (lat_min, lat_max, lon_min, lon_max) of the grids.
+                Defaults to the extent of the individuals.
+            skip_whole (bool, optional): Whether to skip the 1 x 1 grid, which is the whole
+                set, like `create_grid_partitioning`. Defaults to True.
+        """
+
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if bounds is None:
+            bounds = (lats.min(), lats.max(), lons.min(), lons.max())
+        lat_min, lat_max, lon_min, lon_max = bounds
+
+        lat_fracs = get_lattice_fractions(max_rows)
+        lon_fracs = get_lattice_fractions(max_cols)
+        self.lattice_shape = (len(lat_fracs) - 1, len(lon_fracs) - 1)
+
+        ## lattice cell of every individual, the last cell is closed on both sides
+        lat_edges = lat_min + np.array(lat_fracs, dtype=float) * (lat_max - lat_min)
+        lon_edges = lon_min + np.array(lon_fracs, dtype=float) * (lon_max - lon_min)
+        lat_bin = np.clip(
+            np.searchsorted(lat_edges, lats, side="right") - 1,
+            0,
+            self.lattice_shape[0] - 1,
+        )
+        lon_bin = np.clip(
+            np.searchsorted(lon_edges, lons, side="right") - 1,
+            0,
+            self.lattice_shape[1] - 1,
+        )
+        self.lattice_cell = lat_bin * self.lattice_shape[1] + lon_bin
+
+        ## corners of every grid cell in the (rows + 1) x (cols + 1) prefix sums
+        lat_pos = {frac: i for i, frac in enumerate(lat_fracs)}
+        lon_pos = {frac: i for i, frac in enumerate(lon_fracs)}
+        self.grids = []
+        corners = []
+        for rows in range(1, max_rows + 1):
+            for cols in range(1, max_cols + 1):
+                if skip_whole and rows == 1 and cols == 1:
+                    continue
+                for row in range(rows):
+                    r0 = lat_pos[Fraction(row, rows)]
+                    r1 = lat_pos[Fraction(row + 1, rows)]
+                    for col in range(cols):
+                        c0 = lon_pos[Fraction(col, cols)]
+                        c1 = lon_pos[Fraction(col + 1, cols)]
+                        self.grids.append((rows, cols, row, col))
+                        corners.append((r0, r1, c0, c1))
+
+        width = self.lattice_shape[1] + 1
+        r0, r1, c0, c1 = np.array(corners, dtype=np.int64).reshape(-1, 4).T
+        ## flat indices of the (+, -, -, +) corners of every cell
+        self._corners = np.stack(
+            [r1 * width + c1, r0 * width + c1, r1 * width + c0, r0 * width + c0]
+        )
+
+    @property
+    def n_cells(self):
+        return len(self.grids)
+
+    @property
+    def n_lattice_cells(self):
+        return self.lattice_shape[0] * self.lattice_shape[1]
+
+    def lattice_counts(self, labels=None):
+        """
+        Counts the individuals (or the positives) of every lattice cell.
+
+        Args:
+            labels (np.ndarray, optional): Binary labels of the individuals. Defaults to
+                None (count the individuals).
+
+        Returns:
+            np.ndarray: The counts of the lattice cells, flat.
+        """
+
+        return np.bincount(
+            self.lattice_cell, weights=labels, minlength=self.n_lattice_cells
+        ).astype(np.int64)
+
+    def cell_counts(self, lattice_counts):
+        """
+        Sums the lattice counts over every cell of every grid with prefix sums.
+
+        Args:
+            lattice_counts (np.ndarray): Flat lattice counts, or a (worlds x lattice
+                cells) matrix of lattice counts.
+
+        Returns:
+            np.ndarray: The counts of every grid cell, of shape (cells,) or (cells x worlds).
+        """
+
+        lattice_counts = np.asarray(lattice_counts, dtype=np.int64)
+        batch_shape = lattice_counts.shape[:-1]
+        grid = lattice_counts.reshape(batch_shape + self.lattice_shape)
+
+        sat = np.zeros(
+            batch_shape + (self.lattice_shape[0] + 1, self.lattice_shape[1] + 1),
+            dtype=np.int64,
+        )
+        sat[..., 1:, 1:] = grid.cumsum(axis=-2).cumsum(axis=-1)
+        sat = sat.reshape(batch_shape + (-1,))
+
+        counts = (
+            sat[..., self._corners[0]]
+            - sat[..., self._corners[1]]
+            - sat[..., self._corners[2]]
+            + sat[..., self._corners[3]]
+        )
+
+        return counts.T
+
+    def region_counts(self, lattice_counts):
+        """
+        Aggregation of the lattice cells into the grid cells, see `CountSpaceRegions`.
+
+        Args:
+            lattice_counts (np.ndarray): (lattice cells x worlds) counts matrix.
+
+        Returns:
+            np.ndarray: The (cells x worlds) counts matrix.
+        """
+
+        return self.cell_counts(np.asarray(lattice_counts).T)
+
+
+def scan_alt_worlds_grids(
+    grid_family,
+    n_s_lattice,
+    N,
+    P,
+    n_alt_worlds,
+    seed=None,
+    count_sampler="binomial",
+    n_workers=None,
+):
+    """
+    Simulates the null distribution of the scan over all the cells of a grid family.
+
+    The lattice cells do not overlap, so the "counts" engine of `scan_alt_worlds` draws
+    the positives of the lattice cells directly, and the counts of all the grid cells
+    are read from the prefix sums of every world's lattice counts.
+
+    Args:
+        grid_family (GridFamily): The grids.
+        n_s_lattice (np.ndarray): Number of individuals per lattice cell.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        n_alt_worlds (int): Number of alternative worlds to generate.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        count_sampler (str, optional): Null model of the lattice counts, see
+            `get_random_region_counts`. Defaults to "binomial".
+        n_workers (int, optional): Number of worker processes. Defaults to
+            `get_n_workers()`.
+
+    Returns:
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
+
+    return scan_alt_worlds(
+        n_alt_worlds,
+        CountSpaceRegions(n_s_lattice, aggregation=grid_family),
+        N,
+        P,
+        seed,
+        engine="counts",
+        count_sampler=count_sampler,
+        n_workers=n_workers,
+    )
+
+
+def get_signif_thresh_scanned_grids(
+    signif_level,
+    n_alt_worlds,
+    lats,
+    lons,
+    y_pred,
+    max_rows,
+    max_cols,
+    y_true=None,
+    seed=None,
+    bounds=None,
+    threshold_method="empirical",
+):
+    """
+    Audits every cell of every i x j grid up to max_rows x max_cols at once.
+
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        n_alt_worlds (int): Number of alternative worlds to generate.
+        lats (array-like): Latitude of every individual.
+        lons (array-like): Longitude of every individual.
+        y_pred (np.ndarray): Predicted labels.
+        max_rows (int): Maximum number of latitude rows.
+        max_cols (int): Maximum number of longitude columns.
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        bounds (tuple, optional): (lat_min, lat_max, lon_min, lon_max) of the grids.
+            Defaults to the extent of all the individuals.
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+
+    Returns:
+        tuple: The scanned cells dataframe ("rows", "cols", "row", "col", "n", "signif",
+        "statistic" and "p_value" columns) and the significance threshold.
+    """
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    y_pred = np.asarray(y_pred)
+    if bounds is None:
+        bounds = (lats.min(), lats.max(), lons.min(), lons.max())
+
+    if y_true is not None:
+        pos_mask = np.asarray(y_true) == 1
+        lats, lons, y_pred = lats[pos_mask], lons[pos_mask], y_pred[pos_mask]
+
+    grid_family = GridFamily(lats, lons, max_rows, max_cols, bounds=bounds)
+    N, P = len(y_pred), int(np.sum(y_pred))
+
+    n_s_lattice = grid_family.lattice_counts()
+    null_distr = scan_alt_worlds_grids(
+        grid_family, n_s_lattice, N, P, n_alt_worlds, seed
+    )
+    null_distr.threshold_method = threshold_method
+    signif_thresh = null_distr.threshold(signif_level)
+
+    n_s = grid_family.cell_counts(n_s_lattice)
+    p_s = grid_family.cell_counts(grid_family.lattice_counts(y_pred))
+    _, _, scores = compute_statistics_vec(n_s, p_s, N, P)
+
+    df_scanned_cells = pd.DataFrame(
+        grid_family.grids, columns=["rows", "cols", "row", "col"]
+    )
+    df_scanned_cells["n"] = n_s
+    df_scanned_cells["signif"] = scores >= signif_thresh
+    df_scanned_cells["statistic"] = scores
+    df_scanned_cells["p_value"] = null_distr.p_values(scores)
+
+    return df_scanned_cells, signif_thresh
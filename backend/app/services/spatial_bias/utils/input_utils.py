@@ -6,8 +6,12 @@ from app.services.spatial_bias.utils.geo_utils import (
 )
 import numpy as np
 import pandas as pd
-from app.services.spatial_bias.utils.data_utils import get_regions
+from app.services.spatial_bias.utils.membership_utils import (
+    build_region_membership,
+    flatten_region_ids,
+)
 from app.services.spatial_bias.utils.geo_utils import generate_points_in_polygon
+from app.services.spatial_bias.utils.quadtree_utils import get_quadtree_region_ids
 
 
 import math
@@ -231,8 +235,10 @@ def precompute_synthetic_layout(
     return layout
 
 
-def prepare_inputs(req, synth_layout=None):
-    # Step 1: Prepare inputs
+def prepare_inputs(req, synth_layout=None, seed=42):
+    # Step 1: Prepare inputs. The quadtree partitioning also returns the null model of
+    # the tree ("null_model"), to audit its leaves with the threshold of all the nodes
+    # it visited; the seed is the one of the audit (see run_spatial_audit).
     df_indiv = pd.DataFrame([indiv.model_dump() for indiv in req.indiv_info])
 
     y_pred = df_indiv["y_pred"].values
@@ -253,12 +259,26 @@ def prepare_inputs(req, synth_layout=None):
         [region.polygon for region in req.region_info] if req.region_info else None
     )
 
+    null_model = None
     if region_ids_given:
         regions_ids = df_indiv["region_ids"].values
     elif indiv_coords_given and polygons is not None:
         regions_ids = assign_region_ids_with_strtree(
             [[lat, lon] for lat, lon in zip(lats, lons)], polygons
         )
+    elif indiv_coords_given and getattr(req, "partitioning", "cluster") == "quadtree":
+        regions_ids, polygons, null_model = get_quadtree_region_ids(
+            lats,
+            lons,
+            y_pred,
+            y_true=y_true,
+            signif_level=req.signif_level,
+            n_alt_worlds=req.n_worlds,
+            seed=seed,
+            n_worlds_tol=req.n_worlds_tol,
+            max_n_worlds=req.max_n_worlds,
+            threshold_method=req.threshold_method,
+        )
     elif indiv_coords_given:
         regions_ids = spatial_cluster_fast(np.column_stack((lats, lons)))
     else:
@@ -266,7 +286,10 @@ def prepare_inputs(req, synth_layout=None):
             "Neither region IDs nor coordinates provided; cannot partition space."
         )
 
-    region_indices = get_regions(regions_ids)
+    region_membership, _, overlap = build_region_membership(
+        *flatten_region_ids(regions_ids)
+    )
+    region_indices = region_membership.to_lists()
 
     polygons = (
         get_regions_ch(region_indices, lats, lons)
@@ -276,7 +299,7 @@ def prepare_inputs(req, synth_layout=None):
 
     if polygons is not None and not indiv_coords_given:
         poly_pts = [
-            generate_points_in_polygon(polygons[i], len(region_indices[i]))
+            generate_points_in_polygon(polygons[i], region_membership.sizes[i])
             for i in range(len(polygons))
         ]
         all_poly_pts = [pt for sublist in poly_pts for pt in sublist]
@@ -284,8 +307,6 @@ def prepare_inputs(req, synth_layout=None):
         lons = [pt[1] for pt in all_poly_pts]
         indiv_coords_given = True
 
-    overlap = any(len(reg_id) > 1 for reg_id in regions_ids)
-
     synth_layout = (
         precompute_synthetic_layout(region_indices, y_preds=y_pred)
         if synth_layout is None and not indiv_coords_given and polygons is None
@@ -295,6 +316,9 @@ def prepare_inputs(req, synth_layout=None):
     input_data = {
         "y_pred": y_pred,
         "y_true": y_true,
+        ## the audit takes the CSR membership as is, the lists are for the maps and
+        ## the mitigation models
+        "region_membership": region_membership,
         "region_indices": region_indices,
         "lats": lats,
         "lons": lons,
@@ -302,6 +326,7 @@ def prepare_inputs(req, synth_layout=None):
         "polygons": polygons,
         "overlap": overlap,
         "synth_layout": synth_layout,
+        "null_model": null_model,
     }
 
     return input_data
@@ -397,8 +422,14 @@ def prepare_inputs_thresholds(req):
             "Neither region IDs nor coordinates provided; cannot partition space."
         )
 
-    region_indices_train = get_regions(regions_ids_train)
-    region_indices_test = get_regions(regions_ids_test)
+    region_membership_train, _, overlap_train = build_region_membership(
+        *flatten_region_ids(regions_ids_train)
+    )
+    region_membership_test, _, overlap_test = build_region_membership(
+        *flatten_region_ids(regions_ids_test)
+    )
+    region_indices_train = region_membership_train.to_lists()
+    region_indices_test = region_membership_test.to_lists()
 
     polygons = (
         get_regions_ch(region_indices_test, lats_test, lons_test)
@@ -411,7 +442,7 @@ def prepare_inputs_thresholds(req):
 
     if polygons is not None and not indiv_coords_test_given:
         poly_pts = [
-            generate_points_in_polygon(polygons[i], len(region_indices_test[i]))
+            generate_points_in_polygon(polygons[i], region_membership_test.sizes[i])
             for i in range(len(polygons))
         ]
         all_poly_pts = [pt for sublist in poly_pts for pt in sublist]
@@ -425,9 +456,7 @@ def prepare_inputs_thresholds(req):
             )
         ]
 
-    overlap = any(len(reg_id) > 1 for reg_id in regions_ids_train) or any(
-        len(reg_id) > 1 for reg_id in regions_ids_test
-    )
+    overlap = overlap_train or overlap_test
 
     synth_layout = (
         precompute_synthetic_layout(
@@ -441,6 +470,7 @@ def prepare_inputs_thresholds(req):
         "y_pred_train": y_pred_train,
         "y_true_train": y_true_train,
         "y_pred_probs_train": y_pred_probs_train,
+        "region_membership_train": region_membership_train,
         "region_indices_train": region_indices_train,
         "lats_train": lats_train,
         "lons_train": lons_train,
@@ -448,6 +478,7 @@ def prepare_inputs_thresholds(req):
         "y_pred_test": y_pred_test,
         "y_true_test": y_true_test,
         "y_pred_probs_test": y_pred_probs_test,
+        "region_membership_test": region_membership_test,
         "region_indices_test": region_indices_test,
         "lats_test": lats_test,
         "lons_test": lons_test,
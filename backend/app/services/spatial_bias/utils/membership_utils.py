@@ -0,0 +1,265 @@
+import itertools
+
+import numpy as np
+from scipy import sparse
+
+
+class RegionMembership:
+    """
+    Compressed sparse row (CSR) representation of a partitioning.
+
+    Row `i` holds the indices of the individuals that belong to region `i`, so the
+    whole partitioning is stored in two flat arrays instead of a list of lists:
+    `indices[indptr[i]:indptr[i + 1]]` are the members of region `i`.
+
+    Attributes:
+        indptr (np.ndarray): Row pointers of length n_regions + 1.
+        indices (np.ndarray): Concatenated member indices of all regions.
+        n_individuals (int): Total number of individuals (columns of the matrix).
+    """
+
+    def __init__(self, indptr, indices, n_individuals):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.n_individuals = int(n_individuals)
+        self._matrix = None
+
+    @classmethod
+    def from_regions(cls, points_per_region, n_individuals=None):
+        """
+        Builds the membership from a list of regions.
+
+        Args:
+            points_per_region (list): List of regions, each containing point indices.
+            n_individuals (int, optional): Total number of individuals. Defaults to the
+                largest point index + 1.
+
+        Returns:
+            RegionMembership: The CSR membership of the regions.
+        """
+
+        if isinstance(points_per_region, (cls, CountSpaceRegions)):
+            return points_per_region
+
+        sizes = np.fromiter(
+            (len(pts) for pts in points_per_region),
+            dtype=np.int64,
+            count=len(points_per_region),
+        )
+        indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+
+        if indptr[-1] > 0:
+            indices = np.concatenate(
+                [np.asarray(pts, dtype=np.int64) for pts in points_per_region]
+            )
+        else:
+            indices = np.zeros(0, dtype=np.int64)
+
+        if n_individuals is None:
+            n_individuals = indices.max() + 1 if len(indices) > 0 else 0
+
+        return cls(indptr, indices, n_individuals)
+
+    @property
+    def n_regions(self):
+        return len(self.indptr) - 1
+
+    @property
+    def sizes(self):
+        """Number of individuals per region."""
+        return np.diff(self.indptr)
+
+    @property
+    def matrix(self):
+        """The (regions x individuals) membership as a `scipy.sparse.csr_matrix`."""
+        if self._matrix is None:
+            self._matrix = sparse.csr_matrix(
+                (
+                    np.ones(len(self.indices), dtype=np.int32),
+                    self.indices,
+                    self.indptr,
+                ),
+                shape=(self.n_regions, self.n_individuals),
+            )
+        return self._matrix
+
+    def is_overlapping(self):
+        """Whether some individual belongs to more than one region."""
+        if len(self.indices) == 0:
+            return False
+        return bool(np.bincount(self.indices, minlength=self.n_individuals).max() > 1)
+
+    def region_counts(self, types):
+        """
+        Counts the positives of every region with one sparse-dense product.
+
+        Args:
+            types (np.ndarray): Binary array of shape (N,) or a (N x worlds) matrix.
+
+        Returns:
+            np.ndarray: Positives per region, of shape (regions,) or (regions x worlds).
+        """
+
+        return np.asarray(self.matrix @ types, dtype=np.int64)
+
+    def subset(self, mask):
+        """
+        Restricts the regions to a subset of the individuals.
+
+        The members are renumbered in the order of the subset with a cumsum index map, so
+        the remapping is O(total memberships) instead of a lookup per membership.
+
+        Args:
+            mask (np.ndarray): Boolean array of length n_individuals, True for the subset.
+
+        Returns:
+            RegionMembership: The membership of the subset, over mask.sum() individuals.
+        """
+
+        mask = np.asarray(mask, dtype=bool)
+        new_index = np.cumsum(mask) - 1
+        keep = mask[self.indices]
+
+        ## number of kept members before every row pointer
+        n_kept = np.zeros(len(self.indices) + 1, dtype=np.int64)
+        np.cumsum(keep, out=n_kept[1:])
+
+        return RegionMembership(
+            n_kept[self.indptr], new_index[self.indices[keep]], np.sum(mask)
+        )
+
+    def to_lists(self):
+        """Returns the partitioning as a list of lists of point indices."""
+        return [
+            self.indices[self.indptr[i] : self.indptr[i + 1]].tolist()
+            for i in range(self.n_regions)
+        ]
+
+
+class CountSpaceRegions:
+    """
+    Regions known through their sizes only, e.g. the per-region counts of a streamed or
+    sharded audit, where the individuals are not kept.
+
+    The regions are either non-overlapping cells, or unions of non-overlapping cells
+    given by an aggregation (e.g. the cells of all the grids of a `GridFamily`, as
+    rectangles of lattice cells), which may overlap.
+
+    They can only be scanned by the "counts" engine of `scan_alt_worlds`, which draws
+    the positives of every cell in count space and never needs the members.
+
+    Attributes:
+        cell_sizes (np.ndarray): Number of individuals per cell.
+        aggregation (object): Object whose `region_counts(cell_counts)` method sums a
+            (cells x worlds) counts matrix into the (regions x worlds) one, or None if
+            the regions are the cells.
+        sizes (np.ndarray): Number of individuals per region.
+    """
+
+    def __init__(self, sizes, aggregation=None):
+        """
+        Args:
+            sizes (array-like): Number of individuals per cell.
+            aggregation (object, optional): Aggregation of the cells into the regions,
+                see the attributes. Defaults to None (the regions are the cells).
+        """
+
+        self.cell_sizes = np.asarray(sizes, dtype=np.int64)
+        self.aggregation = aggregation
+        self.sizes = self.region_counts(self.cell_sizes[:, None])[:, 0]
+
+    @property
+    def n_regions(self):
+        return len(self.sizes)
+
+    def is_overlapping(self):
+        return self.aggregation is not None
+
+    def region_counts(self, cell_counts):
+        """
+        Args:
+            cell_counts (np.ndarray): (cells x worlds) counts matrix.
+
+        Returns:
+            np.ndarray: The (regions x worlds) counts matrix.
+        """
+
+        if self.aggregation is None:
+            return cell_counts
+
+        return np.asarray(self.aggregation.region_counts(cell_counts), dtype=np.int64)
+
+
+def flatten_region_ids(reg_ids_per_individual):
+    """
+    Flattens the region ids of every individual into a single array.
+
+    Args:
+        reg_ids_per_individual (list): The region ids of every individual, as a list of
+            lists (or any iterable of iterables).
+
+    Returns:
+        tuple: (region_ids, offsets) where the ids of individual `i` are
+        `region_ids[offsets[i]:offsets[i + 1]]`.
+    """
+
+    n_ids = np.fromiter(
+        (len(reg_ids) for reg_ids in reg_ids_per_individual),
+        dtype=np.int64,
+        count=len(reg_ids_per_individual),
+    )
+    offsets = np.zeros(len(n_ids) + 1, dtype=np.int64)
+    np.cumsum(n_ids, out=offsets[1:])
+
+    region_ids = np.fromiter(
+        itertools.chain.from_iterable(reg_ids_per_individual),
+        dtype=np.int64,
+        count=offsets[-1],
+    )
+
+    return region_ids, offsets
+
+
+def build_region_membership(region_ids, offsets=None):
+    """
+    Builds the membership of the regions from the region ids of every individual.
+
+    The distinct ids are sorted and each region gets the index of its id in that order,
+    the individuals of every region are listed in increasing order, so the result is the
+    same as `data_utils.get_regions` but computed with a single stable sort of the ids
+    instead of Python loops.
+
+    Args:
+        region_ids (np.ndarray): Flattened region ids of all individuals (see
+            `flatten_region_ids`), or a plain integer array with one region id per
+            individual when `offsets` is None.
+        offsets (np.ndarray, optional): Offsets of the ids of every individual in
+            `region_ids`. Defaults to None (one region per individual).
+
+    Returns:
+        tuple: (membership, ids, overlap) with the RegionMembership of the regions, the
+        sorted distinct ids (region `i` has id `ids[i]`, and `np.searchsorted(ids, id)`
+        gives the index of an id) and whether some individual belongs to several regions.
+    """
+
+    region_ids = np.asarray(region_ids)
+    if offsets is None:
+        offsets = np.arange(len(region_ids) + 1, dtype=np.int64)
+    n_ids = np.diff(offsets)
+
+    owners = np.repeat(np.arange(len(n_ids), dtype=np.int64), n_ids)
+
+    ## stable, so the individuals of every region stay in increasing order
+    order = np.argsort(region_ids, kind="stable")
+    sorted_ids = region_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ## no region at all without ids
+    starts = starts[: len(sorted_ids)]
+    ids = sorted_ids[starts]
+    indptr = np.append(starts, len(sorted_ids)).astype(np.int64)
+
+    membership = RegionMembership(indptr, owners[order], len(n_ids))
+    overlap = bool(len(n_ids) > 0 and n_ids.max() > 1)
+
+    return membership, ids, overlap
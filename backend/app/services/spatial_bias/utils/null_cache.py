@@ -0,0 +1,195 @@
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import xxhash
+
+from app.services.spatial_bias.utils.rng_utils import WORLD_RNG
+
+
+def get_null_key(
+    membership, N, P, seed, engine, count_sampler="binomial", stat_kernel="float"
+):
+    """
+    Fingerprints a simulation of alternative worlds.
+
+    The null distribution only depends on the region structure, the number of
+    individuals and positives, the seed, the engine, the statistic kernel and the
+    generator (`WORLD_RNG`) that draw the worlds, so these are hashed with xxhash into a
+    key. The number of worlds is not part of the key since every world has its own
+    stream: the maxima of the first worlds of a simulation are the same whatever the
+    total number of worlds.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        seed (int): Seed of the simulation.
+        engine (str): A resolved engine, see `resolve_engine`.
+        count_sampler (str, optional): Null model of the "counts" engine. Defaults to "binomial".
+        stat_kernel (str, optional): Statistic kernel of the "sparse" and "counts"
+            engines, see `get_stat_kernel`. Defaults to "float".
+
+    Returns:
+        str: The hex digest of the simulation.
+    """
+
+    h = xxhash.xxh3_128()
+    h.update(np.ascontiguousarray(membership.indptr, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(membership.indices, dtype=np.int64).tobytes())
+    ## the count sampler only matters for the "counts" engine, and the kernel (whose
+    ## rounding differs) for the "sparse" and "counts" ones
+    sampler = count_sampler if engine == "counts" else ""
+    kernel = stat_kernel if engine in ["sparse", "counts"] else ""
+    h.update(
+        f"{int(N)}|{int(P)}|{int(seed)}|{engine}|{sampler}|{kernel}|{WORLD_RNG}".encode()
+    )
+
+    return h.hexdigest()
+
+
+class NullCache:
+    """
+    Cache of the per-world maxima of simulated null distributions, in world order.
+
+    The most recently used entries are kept in memory (LRU eviction). If a directory is
+    given, every entry is also stored there as a .npy file that is memory-mapped when
+    read, so that restarted processes also skip the simulation; the least recently
+    used files are deleted beyond `max_disk_entries`. The cache is shared by the
+    threads of a server, so the in-memory entries are guarded by a lock.
+    """
+
+    def __init__(self, max_entries=32, cache_dir=None, max_disk_entries=256):
+        """
+        Args:
+            max_entries (int, optional): Maximum number of entries kept in memory. Defaults to 32.
+            cache_dir (str, optional): Directory of the on-disk store. Defaults to None (memory only).
+            max_disk_entries (int, optional): Maximum number of files of the on-disk store.
+                Defaults to 256.
+        """
+
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def get(self, key):
+        """
+        Looks up an entry, first in memory and then on disk.
+
+        Args:
+            key (str): Key of the simulation, see `get_null_key`.
+
+        Returns:
+            np.ndarray or None: The per-world maxima (read-only), or None on a miss.
+        """
+
+        with self._lock:
+            maxima = self._entries.get(key)
+            if maxima is not None:
+                self._entries.move_to_end(key)
+                return maxima
+
+        if self.cache_dir is None:
+            return None
+
+        try:
+            maxima = np.load(self._path(key), mmap_mode="r")
+            ## the modification time orders the files for the eviction
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, maxima)
+
+        return maxima
+
+    def put(self, key, maxima):
+        """
+        Stores the per-world maxima of a simulation, replacing the stored ones.
+
+        Args:
+            key (str): Key of the simulation, see `get_null_key`.
+            maxima (np.ndarray): Maximum statistic of every world.
+        """
+
+        maxima = np.array(maxima, dtype=float)
+        maxima.setflags(write=False)
+
+        if self.cache_dir is not None:
+            ## written to a temporary file first so that readers never see partial files
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, maxima)
+            os.replace(tmp_path, self._path(key))
+            self._evict_files()
+
+        self._remember(key, maxima)
+
+    def clear(self):
+        """Empties the in-memory entries (the on-disk store is kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, maxima):
+        with self._lock:
+            self._entries[key] = maxima
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _evict_files(self):
+        ## other processes may share the directory: files can vanish at any time
+        mtimes = {}
+        for path in glob.glob(os.path.join(self.cache_dir, "*.npy")):
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+
+        for path in sorted(mtimes, key=mtimes.get)[
+            : max(0, len(mtimes) - self.max_disk_entries)
+        ]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+_null_cache = None
+_null_cache_lock = threading.Lock()
+
+
+def get_null_cache():
+    """
+    Returns the process-wide cache, configured by the SPATIAL_BIAS_NULL_CACHE_SIZE
+    (number of in-memory entries, defaults to 32), SPATIAL_BIAS_NULL_CACHE_DIR
+    (on-disk store, disabled if unset) and SPATIAL_BIAS_NULL_CACHE_DISK_SIZE (number
+    of files of the on-disk store, defaults to 256) environment variables.
+    """
+
+    global _null_cache
+    with _null_cache_lock:
+        if _null_cache is None:
+            _null_cache = NullCache(
+                max_entries=int(os.getenv("SPATIAL_BIAS_NULL_CACHE_SIZE", "32")),
+                cache_dir=os.getenv("SPATIAL_BIAS_NULL_CACHE_DIR") or None,
+                max_disk_entries=int(
+                    os.getenv("SPATIAL_BIAS_NULL_CACHE_DISK_SIZE", "256")
+                ),
+            )
+
+    return _null_cache
@@ -0,0 +1,325 @@
+import math
+from statistics import NormalDist
+
+import numpy as np
+
+from app.services.spatial_bias.utils.tail_utils import (
+    fit_gpd,
+    fit_gumbel_tail,
+    get_gpd_quantile,
+    get_gpd_sf,
+)
+
+
+class NullDistribution:
+    """
+    Null distribution of the scan statistic, stored as the maximum statistic of every
+    alternative world.
+
+    The maxima are kept in a preallocated float array (grown only if more worlds than
+    expected are added), so the memory is O(n_worlds) regardless of the number of
+    individuals. The labels of the worlds are only kept on request, for debugging.
+
+    The threshold of a level is an order statistic of the maxima, which is noisy when
+    only a few worlds exceed it (2 of 400 worlds at the 0.005 level). With a tail
+    `threshold_method`, the thresholds, their intervals and the p-values of the far
+    tail are read from a model of the excesses of the `tail_fraction` largest maxima
+    over the next one instead: a generalized Pareto distribution ("gpd"), or its
+    exponential special case of the Gumbel domain of attraction ("gumbel"), which the
+    maxima of many region statistics belong to and whose single parameter is far less
+    noisy. "auto" uses the Gumbel tail for the levels with fewer than
+    `min_exceedances` expected exceeding worlds, and the order statistic otherwise.
+
+    Attributes:
+        maxima (np.ndarray): Maximum statistic per world, in world order.
+        worlds (list or None): The labels of every world if `keep_worlds` was set.
+        threshold_method (str): "empirical", "gpd", "gumbel" or "auto".
+    """
+
+    def __init__(
+        self,
+        n_worlds=0,
+        keep_worlds=False,
+        threshold_method="empirical",
+        min_exceedances=10,
+        tail_fraction=0.2,
+    ):
+        """
+        Args:
+            n_worlds (int, optional): Expected number of worlds to preallocate. Defaults to 0.
+            keep_worlds (bool, optional): Whether to keep the world labels. Defaults to False.
+            threshold_method (str, optional): "empirical", "gpd", "gumbel" or "auto".
+                Defaults to "empirical".
+            min_exceedances (int, optional): Expected number of exceeding worlds below
+                which "auto" uses the tail model. Defaults to 10.
+            tail_fraction (float, optional): Fraction of the worlds in the tail.
+                Defaults to 0.2.
+        """
+
+        self._maxima = np.empty(n_worlds, dtype=float)
+        self._n_worlds = 0
+        self._sorted = None
+        self._tail_fits = {}
+        self.worlds = [] if keep_worlds else None
+        self.threshold_method = threshold_method
+        self.min_exceedances = min_exceedances
+        self.tail_fraction = tail_fraction
+
+    @property
+    def n_worlds(self):
+        return self._n_worlds
+
+    @property
+    def maxima(self):
+        return self._maxima[: self._n_worlds]
+
+    def add(self, maxima, worlds=None):
+        """
+        Appends the maxima of the next worlds.
+
+        Args:
+            maxima (array-like): Maximum statistic of each new world.
+            worlds (list, optional): Labels of the new worlds, kept if `keep_worlds` was set.
+        """
+
+        maxima = np.atleast_1d(np.asarray(maxima, dtype=float))
+        end = self._n_worlds + len(maxima)
+        if end > len(self._maxima):
+            grown = np.empty(max(end, 2 * len(self._maxima)), dtype=float)
+            grown[: self._n_worlds] = self.maxima
+            self._maxima = grown
+
+        self._maxima[self._n_worlds : end] = maxima
+        self._n_worlds = end
+        self._sorted = None
+        self._tail_fits = {}
+
+        if self.worlds is not None and worlds is not None:
+            self.worlds.extend(worlds)
+
+    def threshold(self, signif_level):
+        """
+        Computes the significance threshold, the maximum at position int(signif_level * n_worlds)
+        of the worlds ranked by decreasing maximum, with a partial selection instead of a sort,
+        or the quantile of the tail model of the level, see `tail_model`.
+
+        Args:
+            signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+
+        Returns:
+            float: The significance threshold.
+        """
+
+        if self._n_worlds == 0:
+            raise ValueError("The null distribution has no worlds")
+
+        model = self.tail_model(signif_level)
+        if model is not None:
+            return float(
+                self._tail_quantiles(self.maxima[None], model, signif_level)[0]
+            )
+
+        k = int(signif_level * self._n_worlds)
+        kth = self._n_worlds - 1 - k
+
+        return float(np.partition(self.maxima, kth)[kth])
+
+    def thresholds(self, signif_levels):
+        """
+        Computes the significance thresholds of several levels with one partial selection.
+
+        Args:
+            signif_levels (list): Significance levels.
+
+        Returns:
+            list: The significance threshold of every level, see `threshold`.
+        """
+
+        if self._n_worlds == 0:
+            raise ValueError("The null distribution has no worlds")
+
+        kths = [
+            self._n_worlds - 1 - int(level * self._n_worlds) for level in signif_levels
+        ]
+        if len(kths) == 0:
+            return []
+
+        ordered = np.partition(self.maxima, sorted(set(kths)))
+
+        return [
+            (
+                float(ordered[kth])
+                if self.tail_model(level) is None
+                else self.threshold(level)
+            )
+            for level, kth in zip(signif_levels, kths)
+        ]
+
+    def p_values(self, statistics):
+        """
+        Monte Carlo p-values of observed statistics, (1 + #{maxima >= stat}) / (n_worlds + 1).
+
+        The maxima are sorted once (and kept until new worlds are added), so every
+        p-value is a binary search. With a tail `threshold_method`, the statistics in
+        the tail ("gpd", "gumbel") or exceeded by fewer than `min_exceedances` worlds
+        ("auto") get the exceedance probability of the tail model instead.
+
+        Args:
+            statistics (array-like): Observed statistics, e.g. of every region.
+
+        Returns:
+            np.ndarray: The p-value of every statistic.
+        """
+
+        if self._sorted is None:
+            self._sorted = np.sort(self.maxima)
+
+        statistics = np.asarray(statistics, dtype=float)
+        n_greater_equal = self._n_worlds - np.searchsorted(
+            self._sorted, statistics, side="left"
+        )
+        p_values = (1 + n_greater_equal) / (self._n_worlds + 1)
+
+        ## the statistics exceeded by too few worlds get the p-value of the tail model
+        if self.threshold_method == "empirical" or not self._has_tail():
+            return p_values
+
+        if self.threshold_method == "auto":
+            u, zeta, xi, sigma = self._get_tail_fit("gumbel")
+            in_tail = n_greater_equal < self.min_exceedances
+        else:
+            u, zeta, xi, sigma = self._get_tail_fit(self.threshold_method)
+            in_tail = statistics >= u
+        p_values = np.array(p_values, dtype=float)
+        p_values[in_tail] = get_gpd_sf(statistics[in_tail], u, zeta, xi, sigma)
+
+        return p_values
+
+    def threshold_ci(self, signif_level, confidence=0.95):
+        """
+        Distribution-free confidence interval of the significance threshold.
+
+        The threshold is an order statistic of the maxima, so the interval is given by the
+        order statistics whose ranks are the normal-approximation bounds of the binomial
+        number of worlds below the target quantile. The thresholds of a tail model get
+        a bootstrap interval instead, see `tail_threshold_ci`.
+
+        Args:
+            signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+            confidence (float, optional): Confidence of the interval. Defaults to 0.95.
+
+        Returns:
+            tuple: The lower and upper bounds of the threshold.
+        """
+
+        if self._n_worlds == 0:
+            raise ValueError("The null distribution has no worlds")
+
+        model = self.tail_model(signif_level)
+        if model is not None:
+            return self.tail_threshold_ci(signif_level, model, confidence)
+
+        n = self._n_worlds
+        q = 1 - signif_level
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        spread = z * math.sqrt(n * q * (1 - q))
+        lower = int(min(max(math.floor(n * q - spread) - 1, 0), n - 1))
+        upper = int(min(max(math.ceil(n * q + spread) - 1, 0), n - 1))
+
+        ordered = np.partition(self.maxima, [lower, upper])
+
+        return float(ordered[lower]), float(ordered[upper])
+
+    def _n_tail(self):
+        return int(self.tail_fraction * self._n_worlds)
+
+    def _has_tail(self):
+        ## a tail model needs a few excesses to be fitted
+        return self._n_tail() >= 5
+
+    def tail_model(self, signif_level):
+        """
+        Model used for the threshold of a level.
+
+        Args:
+            signif_level (float): Significance level.
+
+        Returns:
+            str or None: "gpd" or "gumbel", or None for the order statistic.
+        """
+
+        if self.threshold_method == "empirical" or not self._has_tail():
+            return None
+        ## the tail only models the levels inside it
+        if signif_level >= self._n_tail() / self._n_worlds:
+            return None
+        if self.threshold_method == "auto":
+            if signif_level * self._n_worlds >= self.min_exceedances:
+                return None
+            return "gumbel"
+        return self.threshold_method
+
+    def _fit_tails(self, samples, model):
+        # fits the tail model to every row of (resamples x worlds) maxima
+        k = self._n_tail()
+        top = np.sort(np.partition(samples, -(k + 1), axis=-1)[:, -(k + 1) :], axis=-1)
+        u = top[:, 0]
+        fit = fit_gpd if model == "gpd" else fit_gumbel_tail
+        xi, sigma = fit(top[:, 1:] - u[:, None])
+
+        return u, k / samples.shape[-1], xi, sigma
+
+    def _get_tail_fit(self, model):
+        # parameters of the tail model of the maxima, kept until new worlds are added
+        if model not in self._tail_fits:
+            fits = self._fit_tails(self.maxima[None], model)
+            self._tail_fits[model] = tuple(float(np.ravel(value)[0]) for value in fits)
+        return self._tail_fits[model]
+
+    def _tail_quantiles(self, samples, model, signif_level):
+        u, zeta, xi, sigma = self._fit_tails(samples, model)
+        return get_gpd_quantile(u, zeta, xi, sigma, signif_level)
+
+    def tail_threshold_ci(
+        self, signif_level, model="gumbel", confidence=0.95, n_boot=200, seed=0
+    ):
+        """
+        Bootstrap confidence interval of the threshold of a tail model.
+
+        The maxima are resampled with replacement, the tail is fitted to every resample
+        (the estimators are closed-form, so all the resamples are fitted at once) and
+        the interval is given by the percentiles of the resampled thresholds.
+
+        Args:
+            signif_level (float): Significance level.
+            model (str, optional): "gpd" or "gumbel". Defaults to "gumbel".
+            confidence (float, optional): Confidence of the interval. Defaults to 0.95.
+            n_boot (int, optional): Number of bootstrap resamples. Defaults to 200.
+            seed (int, optional): Seed of the resamples. Defaults to 0.
+
+        Returns:
+            tuple: The lower and upper bounds of the threshold.
+        """
+
+        rng = np.random.default_rng(seed)
+        ## resamples in blocks of about 10M maxima
+        block = max(1, 10_000_000 // self._n_worlds)
+        quantiles = np.concatenate(
+            [
+                self._tail_quantiles(
+                    self.maxima[
+                        rng.integers(
+                            0, self._n_worlds, (min(block, n_boot - i), self._n_worlds)
+                        )
+                    ],
+                    model,
+                    signif_level,
+                )
+                for i in range(0, n_boot, block)
+            ]
+        )
+        lower, upper = np.quantile(
+            quantiles, [(1 - confidence) / 2, (1 + confidence) / 2]
+        )
+
+        return float(lower), float(upper)
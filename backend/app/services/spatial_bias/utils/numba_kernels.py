@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(cache=True)
+    def _xlogx_over(k, m):
+        ## k*log(k/m) with 0*log(0/m) = 0
+        if k > 0:
+            return k * math.log(k / m)
+        return 0.0
+
+    @njit(cache=True)
+    def _compute_statistic(n, p, N, P):
+        ## scalar counterpart of `compute_statistics_vec`
+        n_out = N - n
+        P_out = P - p
+        if n == 0 or n_out == 0:
+            return 0.0
+
+        l0max = _xlogx_over(P, N) + _xlogx_over(N - P, N)
+        if p * n_out == P_out * n:
+            l1max = l0max
+        else:
+            l1max = (
+                _xlogx_over(p, n)
+                + _xlogx_over(n - p, n)
+                + _xlogx_over(P_out, n_out)
+                + _xlogx_over(n_out - P_out, n_out)
+            )
+
+        if l0max == 0:
+            return 0.0
+        return 1 - l1max / l0max
+
+    @njit(parallel=True, cache=True)
+    def _fused_worlds_maxima(indptr, indices, worlds, worlds_P, N):
+        n_regions = len(indptr) - 1
+        n_worlds = worlds.shape[1]
+        maxima = np.empty(n_worlds, dtype=np.float64)
+
+        for w in prange(n_worlds):
+            world = worlds[:, w]
+            P = worlds_P[w]
+            best = -np.inf
+            for r in range(n_regions):
+                p = 0
+                for j in range(indptr[r], indptr[r + 1]):
+                    p += world[indices[j]]
+                score = _compute_statistic(
+                    float(indptr[r + 1] - indptr[r]), float(p), float(N), float(P)
+                )
+                if score > best:
+                    best = score
+            maxima[w] = best
+
+        return maxima
+
+
+def fused_worlds_maxima(membership, worlds, worlds_P):
+    """
+    Computes the maximum statistic of a block of worlds with a single compiled pass.
+
+    For every world (in parallel), the positives of each region are gathered from the
+    CSR membership, scored and only the running maximum is kept, so no (regions x worlds)
+    temporaries are allocated. The compiled kernel is cached to disk by Numba, so the JIT
+    cost is only paid once per installation.
+
+    Args:
+        membership (RegionMembership): CSR membership of the regions.
+        worlds (np.ndarray): (N x worlds) uint8 matrix of world labels, column-major.
+        worlds_P (np.ndarray): Total number of positives of every world.
+
+    Returns:
+        np.ndarray: The maximum statistic of every world.
+    """
+
+    if not NUMBA_AVAILABLE:
+        raise ImportError("The fused kernel requires numba")
+
+    return _fused_worlds_maxima(
+        membership.indptr,
+        membership.indices,
+        np.asfortranarray(worlds),
+        np.asarray(worlds_P, dtype=np.int64),
+        membership.n_individuals,
+    )
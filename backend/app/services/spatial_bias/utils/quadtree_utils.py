@@ -0,0 +1,470 @@
+import numpy as np
+import pandas as pd
+
+from app.services.spatial_bias.utils.audit_utils import (
+    get_signif_threshold_adaptive,
+    resolve_seed,
+    scan_alt_worlds,
+)
+from app.services.spatial_bias.utils.membership_utils import (
+    CountSpaceRegions,
+    RegionMembership,
+)
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+
+class QuadTree:
+    """
+    Quadtree over the lat/lon extent of a set of individuals, refined on demand.
+
+    A node at depth d is a cell of the 2^d x 2^d grid over the bounding box. Only the
+    non-empty children of a refined node are created, and the leaves of the tree always
+    partition the individuals, so the counts of every node are the sums of the counts
+    of its leaves.
+
+    Attributes:
+        depth, row, col (np.ndarray): Depth and grid cell of every node.
+        parent (np.ndarray): Parent node of every node, -1 for the initial nodes.
+        is_leaf (np.ndarray): Whether every node is a leaf.
+        leaf_of (np.ndarray): Leaf node of every individual.
+    """
+
+    def __init__(self, lats, lons, max_depth=8, start_depth=2, bounds=None):
+        """
+        Args:
+            lats (array-like): Latitude of every individual.
+            lons (array-like): Longitude of every individual.
+            max_depth (int, optional): Depth of the finest cells. Defaults to 8.
+            start_depth (int, optional): Depth of the initial grid. Defaults to 2 (4 x 4).
+            bounds (tuple, optional): (lat_min, lat_max, lon_min, lon_max) of the tree.
+                Defaults to the extent of the individuals.
+        """
+
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if bounds is None:
+            bounds = (lats.min(), lats.max(), lons.min(), lons.max())
+        self.bounds = bounds
+        self.max_depth = max_depth
+        lat_min, lat_max, lon_min, lon_max = bounds
+
+        ## finest cell of every individual, the cell at depth d is a right shift of it
+        size = 2**max_depth
+        lat_span = (lat_max - lat_min) or 1.0
+        lon_span = (lon_max - lon_min) or 1.0
+        self._rows = np.clip(
+            ((lats - lat_min) / lat_span * size).astype(np.int64), 0, size - 1
+        )
+        self._cols = np.clip(
+            ((lons - lon_min) / lon_span * size).astype(np.int64), 0, size - 1
+        )
+
+        self.depth = np.zeros(0, dtype=np.int64)
+        self.row = np.zeros(0, dtype=np.int64)
+        self.col = np.zeros(0, dtype=np.int64)
+        self.parent = np.zeros(0, dtype=np.int64)
+        self.is_leaf = np.zeros(0, dtype=bool)
+        self.leaf_of = np.full(len(lats), -1, dtype=np.int64)
+        self._split(np.arange(len(lats)), start_depth, -1)
+
+    @property
+    def n_nodes(self):
+        return len(self.depth)
+
+    @property
+    def leaves(self):
+        return np.flatnonzero(self.is_leaf)
+
+    def _split(self, indivs, depth, parent):
+        ## creates the non-empty cells at `depth` of `indivs` as leaves under `parent`
+        shift = self.max_depth - depth
+        keys = (self._rows[indivs] >> shift) * 2**depth + (self._cols[indivs] >> shift)
+        cells, cell_of = np.unique(keys, return_inverse=True)
+
+        first = self.n_nodes
+        self.depth = np.append(self.depth, np.full(len(cells), depth))
+        self.row = np.append(self.row, cells // 2**depth)
+        self.col = np.append(self.col, cells % 2**depth)
+        self.parent = np.append(self.parent, np.full(len(cells), parent))
+        self.is_leaf = np.append(self.is_leaf, np.ones(len(cells), dtype=bool))
+        self.leaf_of[indivs] = first + cell_of.ravel()
+
+    def refine(self, nodes):
+        """
+        Splits leaves into their non-empty children.
+
+        Args:
+            nodes (array-like): Leaf nodes to split, above the maximum depth.
+        """
+
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 0:
+            return
+
+        ## individuals of every split leaf, grouped with one sort
+        order = np.argsort(self.leaf_of, kind="stable")
+        leaf_starts = np.searchsorted(self.leaf_of[order], np.arange(self.n_nodes + 1))
+        self.is_leaf[nodes] = False
+        for node in nodes:
+            indivs = order[leaf_starts[node] : leaf_starts[node + 1]]
+            self._split(indivs, self.depth[node] + 1, node)
+
+    def ancestry(self):
+        """
+        Builds the (nodes x leaves) membership of the leaves in every node.
+
+        Returns:
+            tuple: The membership and the leaf nodes, in the column order of the membership.
+        """
+
+        leaves = self.leaves
+
+        ## walk up from all the leaves at once, one level per step
+        node_ids, leaf_ids = [], []
+        current = leaves
+        cols = np.arange(len(leaves))
+        while len(current) > 0:
+            node_ids.append(current)
+            leaf_ids.append(cols)
+            has_parent = self.parent[current] >= 0
+            current, cols = self.parent[current[has_parent]], cols[has_parent]
+
+        node_ids = np.concatenate(node_ids)
+        leaf_ids = np.concatenate(leaf_ids)
+        order = np.lexsort((leaf_ids, node_ids))
+        indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(node_ids, minlength=self.n_nodes), out=indptr[1:])
+
+        return RegionMembership(indptr, leaf_ids[order], len(leaves)), leaves
+
+    def node_bounds(self):
+        """
+        Returns:
+            np.ndarray: (nodes x 4) lat_min, lat_max, lon_min, lon_max of every node.
+        """
+
+        lat_min, lat_max, lon_min, lon_max = self.bounds
+        cell_lat = (lat_max - lat_min) / 2.0**self.depth
+        cell_lon = (lon_max - lon_min) / 2.0**self.depth
+
+        return np.column_stack(
+            [
+                lat_min + self.row * cell_lat,
+                lat_min + (self.row + 1) * cell_lat,
+                lon_min + self.col * cell_lon,
+                lon_min + (self.col + 1) * cell_lon,
+            ]
+        )
+
+
+def scan_alt_worlds_quadtree(
+    ancestry,
+    n_s_leaves,
+    N,
+    P,
+    n_alt_worlds,
+    seed=None,
+    signif_level=0.005,
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    batch_size=400,
+    n_workers=None,
+):
+    """
+    Simulates the null distribution of the scan over all the nodes of a quadtree.
+
+    The leaves do not overlap, so the "counts" engine of `scan_alt_worlds` draws the
+    positives of the leaves directly, and the counts of all the nodes are the sums over
+    their leaves.
+
+    Args:
+        ancestry (RegionMembership): (nodes x leaves) membership, see `QuadTree.ancestry`.
+        n_s_leaves (np.ndarray): Number of individuals per leaf.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        n_alt_worlds (int or str): Number of alternative worlds to generate, or "auto" to
+            simulate batches until the threshold converges, see
+            `get_signif_threshold_adaptive`.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        signif_level (float, optional): Significance level of the "auto" mode.
+            Defaults to 0.005.
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode.
+            Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode.
+            Defaults to 100_000.
+        batch_size (int, optional): Number of worlds per batch of the "auto" mode.
+            Defaults to 400.
+        n_workers (int, optional): Number of worker processes. Defaults to
+            `get_n_workers()`.
+
+    Returns:
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
+
+    regions = CountSpaceRegions(n_s_leaves, aggregation=ancestry)
+    if n_alt_worlds != "auto":
+        return scan_alt_worlds(
+            n_alt_worlds, regions, N, P, seed, engine="counts", n_workers=n_workers
+        )
+
+    _, null_distr = get_signif_threshold_adaptive(
+        signif_level,
+        regions,
+        N,
+        P,
+        seed,
+        tolerance=n_worlds_tol,
+        max_worlds=max_n_worlds,
+        batch_size=batch_size,
+        engine="counts",
+        n_workers=n_workers,
+    )
+
+    return null_distr
+
+
+class QuadTreeNullModel:
+    """
+    Null model of an audit of the leaves of a quadtree built by
+    `get_signif_thresh_quadtree`.
+
+    The leaves were chosen by refining the tree where the statistic of the same
+    predictions was high, so a null distribution simulated over the leaves alone
+    ignores all the nodes the refinement looked at and gives a too low threshold. This
+    model simulates the maximum over all the visited nodes instead, which gives the
+    leaves the threshold and p-values of the tree itself. They are still conditional
+    on the visited nodes, which depend on the predictions, so they remain slightly
+    optimistic.
+
+    Calling the model with (N, P) returns the null distribution of these totals, so that
+    an `AuditState` can follow prediction changes.
+    """
+
+    def __init__(
+        self,
+        ancestry,
+        n_s_leaves,
+        n_alt_worlds,
+        seed,
+        threshold_method="empirical",
+        **simulation_kwargs,
+    ):
+        """
+        Args:
+            ancestry (RegionMembership): (nodes x leaves) membership of the visited nodes.
+            n_s_leaves (np.ndarray): Number of audited individuals per leaf.
+            n_alt_worlds (int or str): Number of alternative worlds, or "auto".
+            seed (int): Seed of the simulation.
+            threshold_method (str, optional): Threshold estimator, see
+                `NullDistribution`. Defaults to "empirical".
+            **simulation_kwargs: Extra arguments of `scan_alt_worlds_quadtree`.
+        """
+
+        self.ancestry = ancestry
+        self.n_s_leaves = n_s_leaves
+        self.n_alt_worlds = n_alt_worlds
+        self.seed = seed
+        self.threshold_method = threshold_method
+        self.simulation_kwargs = simulation_kwargs
+        self._null_distrs = {}
+
+    def __call__(self, N, P):
+        if (N, P) not in self._null_distrs:
+            self._null_distrs[(N, P)] = scan_alt_worlds_quadtree(
+                self.ancestry,
+                self.n_s_leaves,
+                N,
+                P,
+                self.n_alt_worlds,
+                self.seed,
+                **self.simulation_kwargs,
+            )
+            self._null_distrs[(N, P)].threshold_method = self.threshold_method
+
+        return self._null_distrs[(N, P)]
+
+
+def get_signif_thresh_quadtree(
+    signif_level,
+    n_alt_worlds,
+    lats,
+    lons,
+    y_pred,
+    y_true=None,
+    seed=None,
+    max_depth=8,
+    start_depth=2,
+    prune_ratio=0.5,
+    min_size=10,
+    bounds=None,
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    threshold_method="empirical",
+):
+    """
+    Audits a quadtree refined only where the statistic is high enough.
+
+    The tree starts from the 2^start_depth x 2^start_depth grid. At every round, the
+    threshold of the nodes visited so far is simulated from the leaf counts, and the
+    leaves whose statistic reaches prune_ratio times that threshold (and that have at
+    least min_size individuals) are split, until no leaf qualifies or max_depth is
+    reached. The returned threshold is the one of all the visited nodes.
+
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        n_alt_worlds (int or str): Number of alternative worlds to generate per round,
+            or "auto", see `scan_alt_worlds_quadtree`.
+        lats (array-like): Latitude of every individual.
+        lons (array-like): Longitude of every individual.
+        y_pred (np.ndarray): Predicted labels.
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        max_depth (int, optional): Depth of the finest cells. Defaults to 8.
+        start_depth (int, optional): Depth of the initial grid. Defaults to 2.
+        prune_ratio (float, optional): Fraction of the threshold a leaf must reach to be
+            split. Defaults to 0.5.
+        min_size (int, optional): Minimum number of audited individuals of a split leaf.
+            Defaults to 10.
+        bounds (tuple, optional): (lat_min, lat_max, lon_min, lon_max) of the tree.
+            Defaults to the extent of all the individuals.
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode.
+            Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode.
+            Defaults to 100_000.
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+
+    Returns:
+        tuple: The nodes dataframe ("depth", "row", "col", "lat_min", "lat_max",
+        "lon_min", "lon_max", "n", "is_leaf", "signif", "statistic" and "p_value"
+        columns), the significance threshold, the leaf (row of the dataframe) of every
+        individual and the `QuadTreeNullModel` of the final tree.
+    """
+
+    y_pred = np.asarray(y_pred)
+    ## the tree covers all the individuals, only the audited ones are counted
+    audited = (
+        np.asarray(y_true) == 1 if y_true is not None else np.ones(len(y_pred), bool)
+    )
+    N, P = int(audited.sum()), int(np.sum(y_pred[audited]))
+    seed = resolve_seed(seed)
+
+    tree = QuadTree(lats, lons, max_depth, start_depth, bounds)
+    while True:
+        ancestry, leaves = tree.ancestry()
+        leaf_pos = np.searchsorted(leaves, tree.leaf_of)
+        n_s_leaves = np.bincount(leaf_pos, weights=audited, minlength=len(leaves))
+        p_s_leaves = np.bincount(
+            leaf_pos, weights=audited * y_pred, minlength=len(leaves)
+        )
+        n_s_leaves = n_s_leaves.astype(np.int64)
+
+        null_model = QuadTreeNullModel(
+            ancestry,
+            n_s_leaves,
+            n_alt_worlds,
+            seed,
+            threshold_method=threshold_method,
+            signif_level=signif_level,
+            n_worlds_tol=n_worlds_tol,
+            max_n_worlds=max_n_worlds,
+        )
+        null_distr = null_model(N, P)
+        signif_thresh = null_distr.threshold(signif_level)
+
+        n_s = ancestry.region_counts(n_s_leaves)
+        _, _, scores = compute_statistics_vec(
+            n_s, ancestry.region_counts(p_s_leaves.astype(np.int64)), N, P
+        )
+
+        to_split = leaves[
+            (scores[leaves] >= prune_ratio * signif_thresh)
+            & (n_s[leaves] >= min_size)
+            & (tree.depth[leaves] < max_depth)
+        ]
+        if len(to_split) == 0:
+            break
+        tree.refine(to_split)
+
+    df_nodes = pd.DataFrame(
+        {"depth": tree.depth, "row": tree.row, "col": tree.col, "parent": tree.parent}
+    )
+    df_nodes[["lat_min", "lat_max", "lon_min", "lon_max"]] = tree.node_bounds()
+    df_nodes["n"] = n_s
+    df_nodes["is_leaf"] = tree.is_leaf
+    df_nodes["signif"] = scores >= signif_thresh
+    df_nodes["statistic"] = scores
+    df_nodes["p_value"] = null_distr.p_values(scores)
+
+    return df_nodes, signif_thresh, tree.leaf_of, null_model
+
+
+def get_quadtree_region_ids(
+    lats,
+    lons,
+    y_pred,
+    y_true=None,
+    signif_level=0.005,
+    n_alt_worlds=400,
+    seed=None,
+    n_worlds_tol=0.05,
+    max_n_worlds=100_000,
+    threshold_method="empirical",
+):
+    """
+    Partitions the individuals into the leaves of a significance-guided quadtree.
+
+    The leaves depend on the statistic of the same predictions, so they should be
+    audited with the returned null model (see `QuadTreeNullModel`), not with a null
+    distribution of the leaves alone.
+
+    Args:
+        lats (array-like): Latitude of every individual.
+        lons (array-like): Longitude of every individual.
+        y_pred (np.ndarray): Predicted labels.
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        signif_level (float, optional): Significance level. Defaults to 0.005.
+        n_alt_worlds (int or str, optional): Number of alternative worlds per round, or
+            "auto". Defaults to 400.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        n_worlds_tol (float, optional): Relative tolerance of the "auto" mode.
+            Defaults to 0.05.
+        max_n_worlds (int, optional): Maximum number of worlds of the "auto" mode.
+            Defaults to 100_000.
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+
+    Returns:
+        tuple: The region ids of every individual (one leaf each), the rectangle of
+        every region as a polygon of [lon, lat] points and the null model of the tree.
+    """
+
+    df_nodes, _, leaf_of, null_model = get_signif_thresh_quadtree(
+        signif_level,
+        n_alt_worlds,
+        lats,
+        lons,
+        y_pred,
+        y_true=y_true,
+        seed=seed,
+        n_worlds_tol=n_worlds_tol,
+        max_n_worlds=max_n_worlds,
+        threshold_method=threshold_method,
+    )
+
+    leaves = np.flatnonzero(df_nodes["is_leaf"].values)
+    region_ids = [[int(r)] for r in np.searchsorted(leaves, leaf_of)]
+    polygons = [
+        [
+            [lon_min, lat_min],
+            [lon_max, lat_min],
+            [lon_max, lat_max],
+            [lon_min, lat_max],
+            [lon_min, lat_min],
+        ]
+        for lat_min, lat_max, lon_min, lon_max in df_nodes.loc[
+            leaves, ["lat_min", "lat_max", "lon_min", "lon_max"]
+        ].itertuples(index=False)
+    ]
+
+    return region_ids, polygons, null_model
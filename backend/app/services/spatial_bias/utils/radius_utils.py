@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+from app.services.spatial_bias.utils.audit_utils import (
+    iter_alt_world_blocks,
+    resolve_seed,
+)
+from app.services.spatial_bias.utils.null_distribution import NullDistribution
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+
+class RadiusScan:
+    """
+    The nested square regions around a set of seeds, as produced by `create_regions`,
+    without materializing their points.
+
+    The individuals are sorted once per seed by their distance to the seed, in the
+    max-norm of the `query_range` boxes, so the region of any radius is a prefix of that
+    order and its counts are read from the prefix sums of the labels in that order. With
+    no radii, every distinct distance is a radius (a continuous radius scan).
+
+    Attributes:
+        regions (list): (center_lat, center_lon, radius) of every region, in seed order
+            and then radius order.
+        sizes (np.ndarray): Number of individuals of every region.
+    """
+
+    def __init__(self, lats, lons, seeds, radii=None, max_radius=None):
+        """
+        Args:
+            lats (array-like): Latitude of every individual.
+            lons (array-like): Longitude of every individual.
+            seeds (list): (lat, lon) of every seed, e.g. from `create_seeds`.
+            radii (list, optional): Radii of the regions around every seed. Defaults to
+                None (every distinct distance to the seed).
+            max_radius (float, optional): Largest radius of the continuous scan. Defaults
+                to None (no limit). Ignored when radii are given.
+        """
+
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        self.n_individuals = len(lats)
+
+        self.regions = []
+        sizes = []
+        self._orders = []
+        self._cuts = []
+        self._region_cuts = []
+        for lat, lon in seeds:
+            dists = np.maximum(np.abs(lats - lat), np.abs(lons - lon))
+            order = np.argsort(dists, kind="stable")
+            sorted_dists = dists[order]
+
+            if radii is not None:
+                region_radii = np.asarray(radii, dtype=float)
+                ## the boxes of `query_range` are closed
+                region_sizes = np.searchsorted(sorted_dists, region_radii, side="right")
+            else:
+                ## one region per distinct distance, ending after its last tie
+                region_sizes = np.append(
+                    np.flatnonzero(np.diff(sorted_dists)) + 1, self.n_individuals
+                )
+                if max_radius is not None:
+                    region_sizes = region_sizes[
+                        sorted_dists[region_sizes - 1] <= max_radius
+                    ]
+                region_radii = sorted_dists[region_sizes - 1]
+
+            ## regions of equal size share their counts, only the distinct positive
+            ## sizes are scored
+            cuts = np.unique(region_sizes[region_sizes > 0])
+            self._orders.append(order[: cuts[-1]] if len(cuts) > 0 else order[:0])
+            self._cuts.append(cuts)
+            ## position of every region among the distinct sizes, -1 if empty
+            self._region_cuts.append(
+                np.where(region_sizes > 0, np.searchsorted(cuts, region_sizes), -1)
+            )
+
+            self.regions.extend((lat, lon, float(r)) for r in region_radii)
+            sizes.append(region_sizes)
+
+        self.sizes = np.concatenate(sizes).astype(np.int64)
+
+    @property
+    def n_regions(self):
+        return len(self.regions)
+
+    def _prefix_counts(self, seed_idx, labels):
+        ## positives up to every distinct size of a seed, for (N,) or (N x worlds) labels
+        cuts = self._cuts[seed_idx]
+        if len(cuts) == 0:
+            return np.zeros((0,) + labels.shape[1:], dtype=np.int64)
+        sorted_labels = labels[self._orders[seed_idx]]
+        starts = np.concatenate([[0], cuts[:-1]])
+
+        return np.add.reduceat(sorted_labels, starts, axis=0, dtype=np.int64).cumsum(
+            axis=0
+        )
+
+    def positive_counts(self, labels):
+        """
+        Counts the positives of every region.
+
+        Args:
+            labels (np.ndarray): Binary labels of the individuals.
+
+        Returns:
+            np.ndarray: The positives of every region.
+        """
+
+        labels = np.asarray(labels)
+        counts = []
+        for seed_idx, region_cuts in enumerate(self._region_cuts):
+            ## prepend 0 for the empty regions
+            prefix = np.concatenate([[0], self._prefix_counts(seed_idx, labels)])
+            counts.append(prefix[region_cuts + 1])
+
+        return np.concatenate(counts).astype(np.int64)
+
+    def worlds_maxima(self, worlds, worlds_P):
+        """
+        Computes the maximum statistic over all regions of a block of worlds.
+
+        Args:
+            worlds (np.ndarray): (N x worlds) uint8 matrix of world labels.
+            worlds_P (np.ndarray): Total number of positives of every world.
+
+        Returns:
+            np.ndarray: The maximum statistic of every world.
+        """
+
+        maxima = np.full(worlds.shape[1], -np.inf)
+        for seed_idx, cuts in enumerate(self._cuts):
+            if len(cuts) == 0:
+                continue
+            _, _, scores = compute_statistics_vec(
+                cuts[:, None],
+                self._prefix_counts(seed_idx, worlds),
+                self.n_individuals,
+                worlds_P,
+            )
+            np.maximum(maxima, scores.max(axis=0), out=maxima)
+
+        return maxima
+
+
+def scan_alt_worlds_radii(radius_scan, N, P, n_alt_worlds, seed=None):
+    """
+    Simulates the null distribution of the scan over all the regions of a radius scan.
+
+    Every block of worlds is drawn by `iter_alt_world_blocks`, so the worlds are the
+    same as with the other engines for the same seed, and the positives of all the
+    radii of a seed are the prefix sums of the world labels in the seed's order.
+
+    Args:
+        radius_scan (RadiusScan): The regions.
+        N (int): Total number of elements.
+        P (int): Total number of positive elements.
+        n_alt_worlds (int): Number of alternative worlds to generate.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+
+    Returns:
+        NullDistribution: The per-world maxima of the alternative worlds.
+    """
+
+    seed = resolve_seed(seed)
+    max_cuts = max((len(cuts) for cuts in radius_scan._cuts), default=0)
+    ## world labels, their gathered copy and the int64 counts and float scores of a seed
+    bytes_per_world = 2 * N + 24 * max_cuts
+
+    null_distr = NullDistribution(n_alt_worlds)
+    for _, worlds in iter_alt_world_blocks(
+        N, P, 0, n_alt_worlds, seed, bytes_per_world=bytes_per_world
+    ):
+        worlds_P = worlds.sum(axis=0, dtype=np.int64)
+        null_distr.add(radius_scan.worlds_maxima(worlds, worlds_P))
+
+    return null_distr
+
+
+def get_signif_thresh_scanned_radii(
+    signif_level,
+    n_alt_worlds,
+    lats,
+    lons,
+    y_pred,
+    seeds,
+    radii=None,
+    y_true=None,
+    seed=None,
+    max_radius=None,
+    threshold_method="empirical",
+):
+    """
+    Audits the nested square regions of every radius around every seed at once.
+
+    Args:
+        signif_level (float): Significance level (e.g., 0.05 for 5% significance).
+        n_alt_worlds (int): Number of alternative worlds to generate.
+        lats (array-like): Latitude of every individual.
+        lons (array-like): Longitude of every individual.
+        y_pred (np.ndarray): Predicted labels.
+        seeds (list): (lat, lon) of every seed, e.g. from `create_seeds`.
+        radii (list, optional): Radii of the regions. Defaults to None (every distinct
+            distance to every seed).
+        y_true (np.ndarray, optional): True labels, for equal opportunity. Defaults to None.
+        seed (int, optional): Seed for reproducibility. Defaults to None.
+        max_radius (float, optional): Largest radius of the continuous scan. Defaults to
+            None (no limit).
+        threshold_method (str, optional): Threshold estimator, see `NullDistribution`.
+            Defaults to "empirical".
+
+    Returns:
+        tuple: The scanned regions dataframe ("center_lat", "center_lon", "radius", "n",
+        "signif", "statistic" and "p_value" columns) and the significance threshold.
+    """
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    y_pred = np.asarray(y_pred)
+
+    if y_true is not None:
+        pos_mask = np.asarray(y_true) == 1
+        lats, lons, y_pred = lats[pos_mask], lons[pos_mask], y_pred[pos_mask]
+
+    radius_scan = RadiusScan(lats, lons, seeds, radii=radii, max_radius=max_radius)
+    N, P = len(y_pred), int(np.sum(y_pred))
+
+    null_distr = scan_alt_worlds_radii(radius_scan, N, P, n_alt_worlds, seed)
+    null_distr.threshold_method = threshold_method
+    signif_thresh = null_distr.threshold(signif_level)
+
+    n_s = radius_scan.sizes
+    p_s = radius_scan.positive_counts(y_pred)
+    _, _, scores = compute_statistics_vec(n_s, p_s, N, P)
+
+    df_scanned_regions = pd.DataFrame(
+        radius_scan.regions, columns=["center_lat", "center_lon", "radius"]
+    )
+    df_scanned_regions["n"] = n_s
+    df_scanned_regions["signif"] = scores >= signif_thresh
+    df_scanned_regions["statistic"] = scores
+    df_scanned_regions["p_value"] = null_distr.p_values(scores)
+
+    return df_scanned_regions, signif_thresh
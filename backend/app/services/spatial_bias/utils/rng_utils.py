@@ -0,0 +1,57 @@
+from functools import lru_cache
+
+import numpy as np
+
+## generator of the world streams, part of the null cache key so that the maxima
+## stored by another generator are never mixed with new worlds
+WORLD_RNG = "philox"
+
+
+@lru_cache(maxsize=64)
+def get_seed_key(seed):
+    """
+    Hashes a seed of any size (e.g. the 128-bit entropy of `resolve_seed`) into the
+    64-bit word of the Philox keys.
+
+    Args:
+        seed (int): Seed of the simulation.
+
+    Returns:
+        int: The 64-bit key word.
+    """
+
+    return int(np.random.SeedSequence(seed).generate_state(1, np.uint64)[0])
+
+
+def get_world_rng(seed, world_idx, stream_idx=0):
+    """
+    Creates the random generator of a single alternative world.
+
+    The generator is the counter-based Philox bit generator keyed by (seed, world_idx):
+    the draws of a world are the encryptions of a counter under the key of the world,
+    so any world (or any subset of worlds) can be drawn on its own, on any worker and
+    in any order, and always gets the same numbers. Sub-streams of a world (e.g. one per
+    shard of the data) start at disjoint counters, in the highest word of the counter.
+
+    Args:
+        seed (int): Seed of the whole simulation.
+        world_idx (int): Index of the world.
+        stream_idx (int, optional): Index of the sub-stream of the world. Defaults to 0.
+
+    Returns:
+        np.random.Generator: The generator of the world.
+    """
+
+    key = np.array([get_seed_key(seed), world_idx], dtype=np.uint64)
+    counter = np.array([0, 0, 0, stream_idx], dtype=np.uint64)
+
+    return np.random.Generator(np.random.Philox(key=key, counter=counter))
+
+
+def resolve_seed(seed=None):
+    """
+    Returns `seed`, or fresh entropy if it is None, so that all the worlds of a
+    simulation share the same key.
+    """
+
+    return np.random.SeedSequence().entropy if seed is None else seed
@@ -242,6 +242,160 @@ def compute_statistic_with_info(n, p, N, P, verbose=False):
     return statistic, rho_in, rho_out
 
 
+def compute_statistics_vec(n_s, p_s, N, P):
+    """
+    Vectorized counterpart of `compute_statistic_l0_l1` for many regions at once.
+
+    Every log term is of the form k*log(k/m), so the degenerate cases of
+    `compute_max_likeli` are handled with xlogy-style masking (0*log(0) = 0)
+    instead of branches. `n_s`/`p_s` and `N`/`P` are broadcast against each
+    other, e.g. (regions, 1) counts with a (worlds,) vector of totals.
+
+    Args:
+        n_s (array-like): Number of points per region.
+        p_s (array-like): Number of positive labels per region.
+        N (int or array-like): Total number of points.
+        P (int or array-like): Total number of positive labels.
+
+    Returns:
+        tuple: (l0max, l1max, scores) where `scores` is 1 - l1max / l0max. Regions with
+        n == 0 or n == N get l0max = l1max = 0 and a score of 0, like `compute_statistic_l0_l1`.
+    """
+
+    n = np.asarray(n_s, dtype=float)
+    p = np.asarray(p_s, dtype=float)
+    N = np.asarray(N, dtype=float)
+    P = np.asarray(P, dtype=float)
+
+    def xlogx_over(k, m):
+        # k*log(k/m) with 0*log(0/m) = 0, safe for m == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(
+                k > 0, k * np.log(np.where(k > 0, k, 1) / np.where(m > 0, m, 1)), 0.0
+            )
+
+    n_out = N - n
+    P_out = P - p
+
+    l0max = xlogx_over(P, N) + xlogx_over(N - P, N)
+    l1max = (
+        xlogx_over(p, n)
+        + xlogx_over(n - p, n)
+        + xlogx_over(P_out, n_out)
+        + xlogx_over(n_out - P_out, n_out)
+    )
+
+    ## rho_in == rho_out, compared exactly on the integer counts
+    l1max = np.where(p * n_out == P_out * n, l0max, l1max)
+
+    ## n == 0 or n == N: rho_in == 0/0 or rho_out == 0/0
+    degenerate = (n == 0) | (n_out == 0)
+    l0max, l1max = np.broadcast_arrays(l0max, l1max)
+    l0max = np.where(degenerate, 0.0, l0max)
+    l1max = np.where(degenerate, 0.0, l1max)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(l0max != 0, 1 - l1max / np.where(l0max != 0, l0max, 1), 0.0)
+
+    return l0max, l1max, scores
+
+
+def get_xlogx_table(N):
+    """
+    Tabulates k*log(k) for every integer k in [0, N], with 0*log(0) = 0.
+
+    Args:
+        N (int): Total number of points.
+
+    Returns:
+        np.ndarray: Float array of length N + 1.
+    """
+
+    k = np.arange(N + 1, dtype=float)
+
+    return k * np.log(np.maximum(k, 1))
+
+
+def compute_statistics_table(n_s, p_s, N, P, table=None):
+    """
+    Same as `compute_statistics_vec`, but evaluates the likelihoods with a k*log(k) table.
+
+    Every term k*log(k/m) has integer k and m <= N, and the terms come in pairs whose k
+    sum to m, so with T[k] = k*log(k):
+
+        l0max = T[P] + T[N - P] - T[N]
+        l1max = T[p] + T[n - p] - T[n] + T[P - p] + T[N - n - P + p] - T[N - n]
+
+    The table is built once per audit (see `get_xlogx_table`) and shared by all the
+    worlds, so the kernel only gathers and adds, without any log call.
+
+    Args:
+        n_s (array-like): Number of points per region.
+        p_s (array-like): Number of positive labels per region.
+        N (int): Total number of points.
+        P (int or array-like): Total number of positive labels.
+        table (np.ndarray, optional): `get_xlogx_table(N)`, built if not given.
+
+    Returns:
+        tuple: (l0max, l1max, scores), like `compute_statistics_vec`.
+    """
+
+    table = get_xlogx_table(N) if table is None else table
+
+    n = np.asarray(n_s, dtype=np.int64)
+    p = np.asarray(p_s, dtype=np.int64)
+    P = np.asarray(P, dtype=np.int64)
+
+    n_out = N - n
+    P_out = P - p
+
+    l0max = table[P] + table[N - P] - table[N]
+    l1max = (
+        table[p]
+        + table[n - p]
+        - table[n]
+        + table[P_out]
+        + table[n_out - P_out]
+        - table[n_out]
+    )
+
+    ## rho_in == rho_out, compared exactly on the integer counts
+    l1max = np.where(p * n_out == P_out * n, l0max, l1max)
+
+    ## n == 0 or n == N: rho_in == 0/0 or rho_out == 0/0
+    degenerate = (n == 0) | (n_out == 0)
+    l0max, l1max = np.broadcast_arrays(l0max, l1max)
+    l0max = np.where(degenerate, 0.0, l0max)
+    l1max = np.where(degenerate, 0.0, l1max)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(l0max != 0, 1 - l1max / np.where(l0max != 0, l0max, 1), 0.0)
+
+    return l0max, l1max, scores
+
+
+def get_region_counts(labels, points_per_region):
+    """
+    Computes the number of points and positive labels of every region.
+
+    Args:
+        labels (np.ndarray): Array of binary labels for all points.
+        points_per_region (list): List of regions, where each region contains indices of points.
+
+    Returns:
+        tuple: (n_s, p_s) integer arrays with the size and the positives of each region.
+    """
+
+    labels = np.asarray(labels)
+    n_s = np.array([len(pts) for pts in points_per_region], dtype=np.int64)
+    p_s = np.array(
+        [labels[pts].sum() if len(pts) > 0 else 0 for pts in points_per_region],
+        dtype=np.int64,
+    )
+
+    return n_s, p_s
+
+
 def get_sbi(labels, points_per_region, with_stats=False):
     """
     Computes the Mean Likelihood Ratio (SBI) for a set of regions based on the label distribution.
@@ -254,17 +408,14 @@ def get_sbi(labels, points_per_region, with_stats=False):
         float: The Mean Likelihood Ratio (SBI) across all regions.
     """
 
+    labels = np.asarray(labels)
     P = np.sum(labels)
     N = len(labels)
-    list_stats = []
 
-    for i in range(len(points_per_region)):
-        n = len(points_per_region[i])
-        if n == 0:
-            continue
-        p = np.sum(labels[points_per_region[i]])
-        _, l0, l1_i = compute_statistic_l0_l1(n, p, N, P)
-        list_stats.append(1 - l1_i / l0)
+    n_s, p_s = get_region_counts(labels, points_per_region)
+    non_empty = n_s > 0
+    _, _, scores = compute_statistics_vec(n_s[non_empty], p_s[non_empty], N, P)
+    list_stats = scores.tolist()
 
     sbi = np.mean(list_stats)
     if with_stats:
@@ -285,17 +436,14 @@ def get_statistics(labels, points_per_region):
         float: The Mean Likelihood Ratio (SBI) across all regions.
     """
 
+    labels = np.asarray(labels)
     P = np.sum(labels)
     N = len(labels)
-    list_stats = []
 
-    for i in range(len(points_per_region)):
-        n = len(points_per_region[i])
-        if n == 0:
-            continue
-        p = np.sum(labels[points_per_region[i]])
-        stat, _, _ = compute_statistic_l0_l1(n, p, N, P)
-        list_stats.append(stat)
+    n_s, p_s = get_region_counts(labels, points_per_region)
+    non_empty = n_s > 0
+    l0max, l1max, _ = compute_statistics_vec(n_s[non_empty], p_s[non_empty], N, P)
+    list_stats = (l1max - l0max).tolist()
 
     return list_stats
 
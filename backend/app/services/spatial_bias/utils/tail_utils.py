@@ -0,0 +1,100 @@
+import numpy as np
+
+
+def fit_gpd(excesses):
+    """
+    Fits a generalized Pareto distribution to excesses over a threshold.
+
+    Uses the probability-weighted moments estimator of Hosking & Wallis (1987), which is
+    closed-form (so it is vectorized over bootstrap resamples) and more stable than the
+    maximum likelihood for the few tens of excesses of a moderate number of worlds.
+
+    Args:
+        excesses (np.ndarray): Non-negative excesses, sorted ascending along the last axis.
+
+    Returns:
+        tuple: The shape (xi) and the scale (sigma), of the shape of the leading axes.
+    """
+
+    excesses = np.asarray(excesses, dtype=float)
+    k = excesses.shape[-1]
+    weights = 1 - (np.arange(1, k + 1) - 0.35) / k
+
+    a0 = excesses.mean(axis=-1)
+    a1 = (excesses * weights).mean(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xi = 2 - a0 / (a0 - 2 * a1)
+        sigma = 2 * a0 * a1 / (a0 - 2 * a1)
+
+    ## the estimator only exists for xi < 1, degenerate excesses get an empty tail
+    xi = np.clip(np.nan_to_num(xi), -1, 0.9)
+    sigma = np.maximum(np.nan_to_num(sigma), 0)
+
+    return xi, sigma
+
+
+def fit_gumbel_tail(excesses):
+    """
+    Fits the exponential tail of a distribution of the Gumbel domain (a GPD with a zero
+    shape) to excesses over a threshold, whose scale is the mean excess.
+
+    Args:
+        excesses (np.ndarray): Non-negative excesses along the last axis.
+
+    Returns:
+        tuple: The shape (zero) and the scale (sigma), of the shape of the leading axes.
+    """
+
+    sigma = np.asarray(excesses, dtype=float).mean(axis=-1)
+
+    return np.zeros_like(sigma), sigma
+
+
+def get_gpd_quantile(u, zeta, xi, sigma, signif_level):
+    """
+    Value exceeded with probability `signif_level` under a GPD tail.
+
+    Args:
+        u (float): Threshold of the tail.
+        zeta (float): Probability of exceeding u.
+        xi (np.ndarray): Shape of the tail.
+        sigma (np.ndarray): Scale of the tail.
+        signif_level (float): Exceedance probability, below zeta.
+
+    Returns:
+        np.ndarray: The quantile.
+    """
+
+    ratio = signif_level / zeta
+    with np.errstate(divide="ignore", invalid="ignore"):
+        power = np.where(np.abs(xi) > 1e-9, (ratio**-xi - 1) / xi, -np.log(ratio))
+
+    return u + sigma * power
+
+
+def get_gpd_sf(stats, u, zeta, xi, sigma):
+    """
+    Probability of exceeding statistics above the threshold of a GPD tail.
+
+    Args:
+        stats (np.ndarray): Statistics, at least u.
+        u (float): Threshold of the tail.
+        zeta (float): Probability of exceeding u.
+        xi (float): Shape of the tail.
+        sigma (float): Scale of the tail.
+
+    Returns:
+        np.ndarray: The exceedance probability of every statistic.
+    """
+
+    if sigma <= 0:
+        return np.where(np.asarray(stats) > u, 0.0, zeta)
+
+    z = (np.asarray(stats, dtype=float) - u) / sigma
+    if abs(xi) <= 1e-9:
+        return zeta * np.exp(-z)
+
+    ## beyond the upper end point of a bounded (xi < 0) tail the probability is zero
+    base = np.maximum(1 + xi * z, 0)
+    with np.errstate(divide="ignore"):
+        return zeta * np.where(base > 0, base ** (-1 / xi), 0.0)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def make_regions():
+    """
+    Factory of random regions over n_individuals, as lists of point indices.
+
+    Overlapping regions are random subsets of 20 to 300 individuals. Disjoint regions
+    give every individual one region id, -1 (no region) included.
+    """
+
+    def make(n_individuals, n_regions=40, overlapping=True, seed=0):
+        rng = np.random.default_rng(seed)
+        if overlapping:
+            return [
+                rng.choice(n_individuals, rng.integers(20, 300), replace=False)
+                for _ in range(n_regions)
+            ]
+
+        region_ids = rng.integers(-1, n_regions, n_individuals)
+        return [np.flatnonzero(region_ids == i) for i in range(n_regions)]
+
+    return make
+
+
+@pytest.fixture
+def make_predictions():
+    """Factory of random (y_pred, y_true) binary labels of n_individuals."""
+
+    def make(n_individuals, rate=0.5, seed=0):
+        rng = np.random.default_rng(seed)
+        return (
+            (rng.random(n_individuals) < rate).astype(np.int64),
+            rng.integers(0, 2, n_individuals),
+        )
+
+    return make
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.utils.audit_utils import (
+    get_alt_worlds_executor,
+    get_alt_worlds_maxima,
+    get_signif_threshold_adaptive,
+    scan_alt_worlds,
+)
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
+from app.services.spatial_bias.utils.null_cache import NullCache
+
+N, P = 2000, 600
+SEED = 7
+
+
+def test_engines_draw_the_same_worlds(make_regions):
+    membership = RegionMembership.from_regions(make_regions(N), N)
+
+    maxima = {
+        engine: get_alt_worlds_maxima(membership, N, P, 0, 200, SEED, engine)
+        for engine in ["sparse", "fused", "loop"]
+    }
+
+    np.testing.assert_allclose(maxima["fused"], maxima["sparse"], rtol=1e-9)
+    np.testing.assert_allclose(maxima["loop"], maxima["sparse"], rtol=1e-9)
+
+
+def test_counts_engine_agrees_in_distribution(make_regions):
+    regions = make_regions(N, overlapping=False)
+
+    null_sparse = scan_alt_worlds(2000, regions, N, P, SEED, engine="sparse")
+    null_counts = scan_alt_worlds(2000, regions, N, P, SEED, engine="counts")
+
+    ## different draws of the same null model: the quantiles only agree up to noise
+    for level in [0.5, 0.1]:
+        assert null_counts.threshold(level) == pytest.approx(
+            null_sparse.threshold(level), rel=0.1
+        )
+
+
+def test_counts_engine_rejects_overlapping_regions(make_regions):
+    with pytest.raises(ValueError):
+        scan_alt_worlds(10, make_regions(N), N, P, SEED, engine="counts")
+
+
+@pytest.mark.parametrize("engine", ["sparse", "fused"])
+def test_parallel_scan_matches_serial(engine, make_regions):
+    regions = make_regions(N)
+
+    serial = scan_alt_worlds(300, regions, N, P, SEED, engine=engine, n_workers=1)
+    parallel = scan_alt_worlds(300, regions, N, P, SEED, engine=engine, n_workers=3)
+
+    np.testing.assert_array_equal(parallel.maxima, serial.maxima)
+
+
+def test_split_ranges_match_one_range(make_regions):
+    membership = RegionMembership.from_regions(make_regions(N), N)
+
+    whole = get_alt_worlds_maxima(membership, N, P, 0, 300, SEED)
+    split = np.concatenate(
+        [
+            get_alt_worlds_maxima(membership, N, P, start, stop, SEED)
+            for start, stop in [(0, 50), (50, 51), (51, 300)]
+        ]
+    )
+
+    np.testing.assert_array_equal(split, whole)
+
+
+def test_shared_executor_matches_serial(make_regions):
+    regions = make_regions(N)
+    membership = RegionMembership.from_regions(regions, N)
+
+    ## separate caches, otherwise the second run would read the worlds of the first
+    serial = get_signif_threshold_adaptive(
+        0.05,
+        regions,
+        N,
+        P,
+        SEED,
+        max_worlds=2000,
+        engine="sparse",
+        n_workers=1,
+        cache=NullCache(),
+    )
+    with get_alt_worlds_executor(membership, 2) as executor:
+        parallel = get_signif_threshold_adaptive(
+            0.05,
+            regions,
+            N,
+            P,
+            SEED,
+            max_worlds=2000,
+            engine="sparse",
+            n_workers=2,
+            cache=NullCache(),
+            executor=executor,
+        )
+
+    assert parallel[0] == serial[0]
+    np.testing.assert_array_equal(parallel[1].maxima, serial[1].maxima)
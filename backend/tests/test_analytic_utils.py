@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.utils.analytic_utils import AnalyticNullDistribution
+from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
+
+N = 2000
+P = 600
+
+
+@pytest.mark.parametrize("overlapping", [True, False])
+def test_analytic_threshold_bounds_empirical(make_regions, overlapping):
+    regions = make_regions(N, overlapping=overlapping)
+    membership = RegionMembership.from_regions(regions, N)
+
+    analytic = AnalyticNullDistribution(membership.sizes, N, P)
+    empirical = scan_alt_worlds(1000, membership, N, P, 0, n_workers=1)
+
+    for signif_level in [0.05, 0.01, 0.005]:
+        assert analytic.threshold(signif_level) >= empirical.threshold(signif_level)
+
+
+def test_analytic_p_values_are_probabilities(make_regions):
+    regions = make_regions(N)
+    membership = RegionMembership.from_regions(regions, N)
+    analytic = AnalyticNullDistribution(membership.sizes, N, P)
+
+    statistics = np.concatenate([[0.0, 1e-6, 10.0], np.linspace(0, 0.1, 50)])
+    p_values = analytic.p_values(statistics)
+    assert np.all((p_values >= 0) & (p_values <= 1))
+
+    ## a statistic is significant exactly when its p-value is at most the level
+    signif_thresh = analytic.threshold(0.01)
+    assert analytic.p_values([signif_thresh])[0] <= 0.01
+    assert np.all(p_values[statistics < signif_thresh] > 0.01)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from app.services.spatial_bias.utils.approx_utils import (
+    get_ambiguous_regions,
+    get_statistic_ci,
+    get_stratified_sample_mask,
+)
+from app.services.spatial_bias.utils.membership_utils import RegionMembership
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+N = 20_000
+N_REGIONS = 40
+
+
+def test_stratified_sample_keeps_every_stratum(make_regions):
+    regions = make_regions(N, N_REGIONS, overlapping=False)
+    membership = RegionMembership.from_regions(regions, N)
+    outside = np.setdiff1d(np.arange(N), np.concatenate(regions))
+
+    mask = get_stratified_sample_mask(membership, 0.1, seed=0)
+
+    for members in regions + [outside]:
+        assert mask[members].sum() == np.ceil(0.1 * len(members))
+
+
+def test_statistic_ci_covers_full_statistic(make_regions):
+    regions = make_regions(N, N_REGIONS, overlapping=False)
+    membership = RegionMembership.from_regions(regions, N)
+    ## not the seed of the samples, whose keys would pick the positives
+    rng = np.random.default_rng(100)
+    y_pred = (rng.random(N) < 0.3).astype(np.int64)
+    for members in regions[::5]:
+        y_pred[members] = rng.random(len(members)) < 0.4
+
+    n_full = membership.sizes
+    p_full = np.array([y_pred[members].sum() for members in regions])
+    _, _, full_scores = compute_statistics_vec(n_full, p_full, N, y_pred.sum())
+
+    covered = []
+    for seed in range(5):
+        mask = get_stratified_sample_mask(membership, 0.2, seed=seed)
+        n_sample = np.array([mask[members].sum() for members in regions])
+        p_sample = np.array(
+            [y_pred[members[mask[members]]].sum() for members in regions]
+        )
+        ci_low, ci_high = get_statistic_ci(
+            n_sample, p_sample, n_full, mask.sum(), y_pred[mask].sum(), N
+        )
+        covered.append((ci_low <= full_scores) & (full_scores <= ci_high))
+
+    ## 95% intervals
+    assert np.mean(covered) >= 0.9
+
+
+def test_regions_near_threshold_are_ambiguous():
+    signif = np.array([True, True, False, False])
+    ci_low = np.array([0.02, 0.008, 0.008, 0.001])
+    ci_high = np.array([0.03, 0.012, 0.012, 0.005])
+
+    np.testing.assert_array_equal(
+        get_ambiguous_regions(signif, ci_low, ci_high, 0.01),
+        [False, True, True, False],
+    )
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.methods.audit import (
+    run_spatial_audit,
+    run_spatial_audit_batch,
+)
+
+N = 2000
+
+
+@pytest.mark.parametrize("equal_opp", [False, True])
+def test_batch_matches_single_audits(equal_opp, make_regions, make_predictions):
+    regions = make_regions(N)
+    _, y_true = make_predictions(N)
+    y_true = y_true if equal_opp else None
+    ## the third model has as many positives as the first, so they may share a null
+    y_preds = np.stack(
+        [
+            make_predictions(N, rate=rate, seed=seed)[0]
+            for rate, seed in [(0.3, 1), (0.5, 2)]
+        ]
+    )
+    y_preds = np.vstack([y_preds, y_preds[0][::-1]])
+
+    df_batch, signif_threshs, sbis = run_spatial_audit_batch(
+        y_preds, y_true, regions, n_worlds=200, n_worlds_tol=None, seed=7
+    )
+
+    for m, y_pred in enumerate(y_preds):
+        df, signif_thresh, sbi = run_spatial_audit(
+            y_pred, y_true, regions, n_worlds=200, n_worlds_tol=None, seed=7
+        )
+        df_model = df_batch[df_batch["model"] == m]
+
+        assert signif_threshs[m] == signif_thresh
+        assert sbis[m] == pytest.approx(sbi)
+        np.testing.assert_allclose(df_model["statistic"], df["statistic"])
+        np.testing.assert_array_equal(df_model["signif"], df["signif"])
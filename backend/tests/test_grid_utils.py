@@ -0,0 +1,53 @@
+import numpy as np
+
+from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+from app.services.spatial_bias.utils.grid_utils import GridFamily, scan_alt_worlds_grids
+
+N = 3000
+
+
+def get_grid_regions(lats, lons, grids):
+    """Members of every (rows, cols, row, col) grid cell, binned explicitly."""
+
+    lat_pos = (lats - lats.min()) / (lats.max() - lats.min())
+    lon_pos = (lons - lons.min()) / (lons.max() - lons.min())
+    regions = []
+    for rows, cols, row, col in grids:
+        cell_row = np.clip(np.floor(lat_pos * rows), 0, rows - 1)
+        cell_col = np.clip(np.floor(lon_pos * cols), 0, cols - 1)
+        regions.append(np.flatnonzero((cell_row == row) & (cell_col == col)))
+
+    return regions
+
+
+def test_prefix_sums_match_explicit_grid_cells(make_predictions):
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(40, 41, N), rng.uniform(-74, -73, N)
+    y_pred, _ = make_predictions(N, rate=0.3)
+
+    grid_family = GridFamily(lats, lons, 4, 5)
+    regions = get_grid_regions(lats, lons, grid_family.grids)
+
+    np.testing.assert_array_equal(
+        grid_family.cell_counts(grid_family.lattice_counts()),
+        [len(members) for members in regions],
+    )
+    np.testing.assert_array_equal(
+        grid_family.cell_counts(grid_family.lattice_counts(y_pred)),
+        [y_pred[members].sum() for members in regions],
+    )
+
+
+def test_grid_null_matches_counts_engine():
+    ## a single 1 x 2 grid (the 1 x 1 one is skipped), whose cells are the lattice cells
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(40, 41, N), rng.uniform(-74, -73, N)
+    grid_family = GridFamily(lats, lons, 1, 2)
+    regions = get_grid_regions(lats, lons, grid_family.grids)
+
+    null_distr = scan_alt_worlds_grids(
+        grid_family, grid_family.lattice_counts(), N, 900, 200, seed=3, n_workers=1
+    )
+    fresh = scan_alt_worlds(200, regions, N, 900, 3, engine="counts", n_workers=1)
+
+    np.testing.assert_array_equal(null_distr.maxima, fresh.maxima)
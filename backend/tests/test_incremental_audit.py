@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.methods.audit import (
+    rerun_spatial_audit,
+    run_spatial_audit,
+)
+from app.services.spatial_bias.utils.audit_utils import (
+    get_null_distribution,
+    scan_alt_worlds,
+)
+from app.services.spatial_bias.utils.data_utils import get_prediction_changes
+from app.services.spatial_bias.utils.null_cache import NullCache
+
+N = 2000
+SEED = 7
+
+
+@pytest.mark.parametrize("engine", ["sparse", "counts"])
+def test_extended_null_matches_fresh(engine, make_regions):
+    regions = make_regions(N, overlapping=engine == "sparse")
+    cache = NullCache()
+
+    get_null_distribution(100, regions, N, 600, SEED, engine=engine, cache=cache)
+    extended = get_null_distribution(
+        300, regions, N, 600, SEED, engine=engine, cache=cache
+    )
+    fresh = scan_alt_worlds(300, regions, N, 600, SEED, engine=engine, n_workers=1)
+
+    np.testing.assert_array_equal(extended.maxima, fresh.maxima)
+
+
+def test_kernels_do_not_share_cached_worlds(make_regions):
+    regions = make_regions(N)
+    cache = NullCache()
+
+    get_null_distribution(100, regions, N, 600, SEED, engine="sparse", cache=cache)
+    extended = get_null_distribution(
+        300, regions, N, 600, SEED, engine="sparse", cache=cache, stat_kernel="table"
+    )
+    fresh = scan_alt_worlds(
+        300, regions, N, 600, SEED, engine="sparse", n_workers=1, stat_kernel="table"
+    )
+
+    assert len(cache) == 2
+    np.testing.assert_array_equal(extended.maxima, fresh.maxima)
+
+
+def test_cut_null_matches_fresh(make_regions):
+    regions = make_regions(N)
+    cache = NullCache()
+
+    get_null_distribution(300, regions, N, 600, SEED, engine="sparse", cache=cache)
+    cut = get_null_distribution(
+        100, regions, N, 600, SEED, engine="sparse", cache=cache
+    )
+    fresh = scan_alt_worlds(100, regions, N, 600, SEED, engine="sparse", n_workers=1)
+
+    np.testing.assert_array_equal(cut.maxima, fresh.maxima)
+
+
+@pytest.mark.parametrize("equal_opp", [False, True])
+@pytest.mark.parametrize("keep_P", [False, True])
+def test_rerun_matches_fresh_audit(equal_opp, keep_P, make_regions, make_predictions):
+    regions = make_regions(N)
+    y_pred, y_true = make_predictions(N)
+    y_true = y_true if equal_opp else None
+
+    rng = np.random.default_rng(1)
+    new_y_pred = y_pred.copy()
+    if keep_P:
+        ## swap some positives and negatives, so that P is unchanged
+        pos, neg = np.flatnonzero(y_pred == 1), np.flatnonzero(y_pred == 0)
+        if equal_opp:
+            pos, neg = pos[y_true[pos] == 1], neg[y_true[neg] == 1]
+        n_swaps = min(len(pos), len(neg), 50)
+        new_y_pred[rng.choice(pos, n_swaps, replace=False)] = 0
+        new_y_pred[rng.choice(neg, n_swaps, replace=False)] = 1
+    else:
+        flipped = rng.choice(N, 100, replace=False)
+        new_y_pred[flipped] = 1 - new_y_pred[flipped]
+
+    *_, state = run_spatial_audit(
+        y_pred, y_true, regions, n_worlds=200, n_worlds_tol=None, with_state=True
+    )
+    df_rerun, thresh_rerun, sbi_rerun = rerun_spatial_audit(
+        state, get_prediction_changes(y_pred, new_y_pred)
+    )
+    df_fresh, thresh_fresh, sbi_fresh = run_spatial_audit(
+        new_y_pred, y_true, regions, n_worlds=200, n_worlds_tol=None
+    )
+
+    assert thresh_rerun == thresh_fresh
+    assert sbi_rerun == pytest.approx(sbi_fresh)
+    np.testing.assert_allclose(
+        df_rerun["statistic"].to_numpy(), df_fresh["statistic"].to_numpy()
+    )
+    np.testing.assert_array_equal(
+        df_rerun["signif"].to_numpy(), df_fresh["signif"].to_numpy()
+    )
+
+
+def test_rerun_rejects_stale_changes(make_regions, make_predictions):
+    regions = make_regions(N)
+    y_pred, _ = make_predictions(N)
+
+    *_, state = run_spatial_audit(
+        y_pred, None, regions, n_worlds=200, n_worlds_tol=None, with_state=True
+    )
+    changes = get_prediction_changes(y_pred, 1 - y_pred)[:5]
+    changes[:, 1] = 1 - changes[:, 1]
+
+    with pytest.raises(ValueError):
+        rerun_spatial_audit(state, changes)
@@ -0,0 +1,78 @@
+import numpy as np
+
+from app.services.spatial_bias.methods.monitor import (
+    RegionWindowCounts,
+    SpatialBiasMonitor,
+    run_monitor,
+)
+from app.services.spatial_bias.utils import audit_utils
+
+
+def test_window_counts_expire_old_buckets():
+    counts = RegionWindowCounts(2, window=10, n_buckets=10)
+    counts.add(0.5, 0, 1)
+    counts.add(3.5, 1, 0)
+    counts.add(3.7, -1, 1)
+
+    np.testing.assert_array_equal(counts.n, [1, 1])
+    np.testing.assert_array_equal(counts.p, [1, 0])
+    assert (counts.N, counts.P) == (3, 2)
+
+    ## the bucket of t=0.5 leaves the window at t=10
+    counts.advance(10.2)
+    np.testing.assert_array_equal(counts.n, [0, 1])
+    assert (counts.N, counts.P) == (2, 1)
+
+    ## events older than the window are ignored
+    counts.add(0.1, 0, 1)
+    assert counts.N == 2
+
+    counts.advance(100)
+    np.testing.assert_array_equal(counts.n, [0, 0])
+    assert (counts.N, counts.P) == (0, 0)
+
+
+def test_steady_traffic_reuses_the_null(monkeypatch):
+    scan_steps = []
+    scan_alt_worlds = audit_utils.scan_alt_worlds
+
+    def count_scans(*args, **kwargs):
+        scan_steps.append(step)
+        return scan_alt_worlds(*args, **kwargs)
+
+    monkeypatch.setattr(audit_utils, "scan_alt_worlds", count_scans)
+
+    n_regions = 300
+    rng = np.random.default_rng(0)
+    monitor = SpatialBiasMonitor(n_regions, windows={"w": 100}, n_worlds=100)
+    for step in range(50):
+        for ts in np.sort(rng.uniform(step * 10, (step + 1) * 10, 2000)):
+            monitor.update(ts, rng.integers(-1, n_regions), rng.random() < 0.3)
+        monitor.check((step + 1) * 10)
+
+    ## the window fills up during the first 10 checks, then the traffic is steady and
+    ## at most the neighbour rate bucket (the rate is close to a bucket edge) is added
+    assert len([step for step in scan_steps if step >= 10]) <= 2
+
+
+def test_alerts_follow_a_biased_region():
+    rng = np.random.default_rng(0)
+    monitor = SpatialBiasMonitor(10, windows={"w": 100}, n_worlds=200)
+    alerts = []
+
+    def get_events(start, stop, biased):
+        for ts in np.arange(start, stop, 0.05):
+            region = int(rng.integers(0, 10))
+            rate = 0.9 if biased and region == 3 else 0.3
+            yield {"ts": ts, "region_id": region, "y_pred": int(rng.random() < rate)}
+
+    run_monitor(monitor, get_events(0, 100, True), 10, alerts.append)
+    assert (alerts[0]["region"], alerts[0]["event"]) == (3, "signif")
+    assert alerts[0]["window"] == "w"
+
+    ## once the biased events left the window, the alert is cleared
+    n_biased_alerts = len(alerts)
+    run_monitor(monitor, get_events(100, 300, False), 10, alerts.append)
+    region_3_alerts = [a["event"] for a in alerts[n_biased_alerts:] if a["region"] == 3]
+    assert region_3_alerts == ["cleared"]
+    assert not monitor.signif["w"][3]
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+from app.services.spatial_bias.utils.membership_utils import CountSpaceRegions
+from app.services.spatial_bias.utils.null_distribution import NullDistribution
+
+SIGNIF_LEVEL = 0.002
+
+
+@pytest.fixture(scope="module")
+def large_null():
+    rng = np.random.default_rng(0)
+    sizes = rng.integers(20, 300, 40)
+    N = int(1.2 * sizes.sum())
+
+    return scan_alt_worlds(
+        20_000, CountSpaceRegions(sizes), N, N // 3, 1, engine="counts", n_workers=1
+    )
+
+
+@pytest.mark.parametrize("model", ["gpd", "gumbel"])
+def test_tail_threshold_matches_empirical_on_large_null(large_null, model):
+    tail_null = NullDistribution(threshold_method=model)
+    tail_null.add(large_null.maxima)
+
+    assert tail_null.tail_model(SIGNIF_LEVEL) == model
+    assert tail_null.threshold(SIGNIF_LEVEL) == pytest.approx(
+        large_null.threshold(SIGNIF_LEVEL), rel=0.03
+    )
+
+
+@pytest.mark.parametrize("model", ["gpd", "gumbel"])
+def test_tail_ci_of_small_null_brackets_large_null_threshold(large_null, model):
+    ## 4 expected exceeding worlds out of 2000, the tail model extrapolates
+    small_null = NullDistribution(threshold_method=model)
+    small_null.add(large_null.maxima[:2000])
+
+    ci_low, ci_high = small_null.threshold_ci(SIGNIF_LEVEL)
+    assert ci_low <= small_null.threshold(SIGNIF_LEVEL) <= ci_high
+    assert ci_low <= large_null.threshold(SIGNIF_LEVEL) <= ci_high
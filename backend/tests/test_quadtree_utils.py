@@ -0,0 +1,49 @@
+import numpy as np
+
+from app.services.spatial_bias.utils.audit_utils import (
+    get_random_region_counts,
+    get_world_rng,
+)
+from app.services.spatial_bias.utils.quadtree_utils import (
+    QuadTree,
+    QuadTreeNullModel,
+)
+from app.services.spatial_bias.utils.scores import compute_statistics_vec
+
+N = 3000
+P = 900
+SEED = 3
+
+
+def test_null_model_matches_scan_of_the_tree_nodes():
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(40, 41, N), rng.uniform(-74, -73, N)
+    tree = QuadTree(lats, lons, max_depth=5, start_depth=1)
+    tree.refine(tree.leaves[:2])
+    tree.refine(tree.leaves[-3:])
+
+    ancestry, leaves = tree.ancestry()
+    leaf_pos = np.searchsorted(leaves, tree.leaf_of)
+    n_s_leaves = np.bincount(leaf_pos, minlength=len(leaves))
+    null_distr = QuadTreeNullModel(ancestry, n_s_leaves, 200, SEED, n_workers=1)(N, P)
+
+    ## the leaves of every node, found from the rectangles of the nodes
+    node_leaves = []
+    for lat_min, lat_max, lon_min, lon_max in tree.node_bounds():
+        inside = (
+            (lats >= lat_min) & (lats < lat_max) & (lons >= lon_min) & (lons < lon_max)
+        )
+        node_leaves.append(np.unique(leaf_pos[inside]))
+    n_s = np.array([n_s_leaves[ids].sum() for ids in node_leaves])
+
+    maxima = []
+    for world_idx in range(200):
+        leaf_counts, world_P = get_random_region_counts(
+            n_s_leaves, N, P, get_world_rng(SEED, world_idx)
+        )
+        p_s = np.array([leaf_counts[ids].sum() for ids in node_leaves])
+        _, _, scores = compute_statistics_vec(n_s, p_s, N, world_P)
+        maxima.append(scores.max())
+
+    np.testing.assert_array_equal(n_s, ancestry.region_counts(n_s_leaves))
+    np.testing.assert_allclose(null_distr.maxima, maxima)
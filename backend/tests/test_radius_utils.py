@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from app.services.spatial_bias.utils.audit_utils import scan_alt_worlds
+from app.services.spatial_bias.utils.radius_utils import (
+    RadiusScan,
+    scan_alt_worlds_radii,
+)
+
+N = 2000
+SEEDS = [(0.5, 0.5), (2.0, 3.0), (4.9, 0.1)]
+
+
+def get_square_regions(lats, lons, regions):
+    """Members of every (center_lat, center_lon, radius) closed box, by brute force."""
+
+    return [
+        np.flatnonzero(np.maximum(np.abs(lats - lat), np.abs(lons - lon)) <= radius)
+        for lat, lon, radius in regions
+    ]
+
+
+@pytest.mark.parametrize(
+    "radii, max_radius", [([0.0, 0.05, 0.3, 1.0, 2.5, 10.0], None), (None, 1.2)]
+)
+def test_prefix_sums_match_brute_force(make_predictions, radii, max_radius):
+    ## coordinates on a lattice, so that many individuals are at the same distance
+    rng = np.random.default_rng(0)
+    lats, lons = rng.integers(0, 50, (2, N)) / 10
+    y_pred, _ = make_predictions(N, rate=0.3)
+
+    radius_scan = RadiusScan(lats, lons, SEEDS, radii=radii, max_radius=max_radius)
+    regions = get_square_regions(lats, lons, radius_scan.regions)
+
+    np.testing.assert_array_equal(
+        radius_scan.sizes, [len(members) for members in regions]
+    )
+    np.testing.assert_array_equal(
+        radius_scan.positive_counts(y_pred),
+        [y_pred[members].sum() for members in regions],
+    )
+
+
+def test_radius_null_matches_scan_of_brute_force_regions():
+    rng = np.random.default_rng(0)
+    lats, lons = rng.uniform(0, 5, (2, N))
+    radius_scan = RadiusScan(lats, lons, SEEDS, radii=[0.2, 0.5, 1.0, 2.0])
+    regions = get_square_regions(lats, lons, radius_scan.regions)
+
+    null_distr = scan_alt_worlds_radii(radius_scan, N, 600, 200, seed=3)
+    fresh = scan_alt_worlds(200, regions, N, 600, 3, engine="sparse", n_workers=1)
+
+    np.testing.assert_allclose(null_distr.maxima, fresh.maxima)
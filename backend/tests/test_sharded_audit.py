@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.spatial_bias.methods.audit import run_spatial_audit
+from app.services.spatial_bias.methods.sharded_audit import (
+    get_chunk_membership,
+    run_sharded_audit,
+)
+
+N = 3000
+N_REGIONS = 30
+
+
+def write_shards(tmp_path, region_cells, y_pred, n_shards=3):
+    paths = []
+    for i, rows in enumerate(np.array_split(np.arange(len(y_pred)), n_shards)):
+        path = str(tmp_path / f"shard_{i}.csv")
+        pd.DataFrame(
+            {"region_ids": [region_cells[r] for r in rows], "y_pred": y_pred[rows]}
+        ).to_csv(path, index=False)
+        paths.append(path)
+
+    return paths
+
+
+def test_chunk_membership_skips_uncovered_cells():
+    membership = get_chunk_membership(
+        np.array(["0|1", "-1", np.nan, "", "2"], dtype=object), 3
+    )
+
+    np.testing.assert_array_equal(
+        membership.toarray(),
+        [[1, 1, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 1]],
+    )
+
+
+def test_chunk_membership_rejects_unknown_regions():
+    with pytest.raises(ValueError):
+        get_chunk_membership(np.array(["0|3"], dtype=object), 3)
+
+
+def test_disjoint_shards_match_in_memory_audit(
+    tmp_path, make_regions, make_predictions
+):
+    regions = make_regions(N, N_REGIONS, overlapping=False)
+    y_pred, _ = make_predictions(N, rate=0.3)
+    region_cells = np.full(N, -1)
+    for i, members in enumerate(regions):
+        region_cells[members] = i
+
+    df_sharded, thresh_sharded, sbi_sharded, info = run_sharded_audit(
+        write_shards(tmp_path, region_cells, y_pred),
+        str(tmp_path / "work"),
+        N_REGIONS,
+        n_worlds=200,
+        n_workers=2,
+        with_info=True,
+    )
+    df, thresh, sbi = run_spatial_audit(y_pred, None, regions, n_worlds=200)
+
+    assert info["null_mode"] == "counts"
+    assert thresh_sharded == thresh
+    assert sbi_sharded == pytest.approx(sbi)
+    np.testing.assert_allclose(df_sharded["statistic"], df["statistic"])
+    np.testing.assert_array_equal(df_sharded["signif"], df["signif"])
+
+
+def test_overlapping_shards_match_in_memory_statistics(
+    tmp_path, make_regions, make_predictions
+):
+    regions = make_regions(N, N_REGIONS)
+    y_pred, _ = make_predictions(N, rate=0.3)
+    region_ids = [[] for _ in range(N)]
+    for i, members in enumerate(regions):
+        for member in members:
+            region_ids[member].append(i)
+    ## the last shard only has single regions and empty cells, read as floats
+    last_shard = np.array_split(np.arange(N), 3)[-1]
+    for member in last_shard:
+        region_ids[member] = region_ids[member][:1]
+    region_ids[0] = []
+    region_cells = ["|".join(map(str, ids)) if ids else "" for ids in region_ids]
+    region_cells[0] = "-1"
+
+    df_sharded, _, sbi_sharded, info = run_sharded_audit(
+        write_shards(tmp_path, region_cells, y_pred),
+        str(tmp_path / "work"),
+        N_REGIONS,
+        n_worlds=50,
+        n_workers=1,
+        with_info=True,
+    )
+    in_memory_regions = [
+        [j for j, ids in enumerate(region_ids) if i in ids] for i in range(N_REGIONS)
+    ]
+    df, _, sbi = run_spatial_audit(y_pred, None, in_memory_regions, n_worlds=50)
+
+    assert info["null_mode"] == "shards"
+    assert sbi_sharded == pytest.approx(sbi)
+    np.testing.assert_array_equal(
+        df_sharded["n"], [len(members) for members in in_memory_regions]
+    )
+    np.testing.assert_allclose(df_sharded["statistic"], df["statistic"])
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.spatial_bias.methods.audit import run_spatial_audit
+from app.services.spatial_bias.methods.streaming_audit import (
+    RegionCountsAccumulator,
+    run_streaming_audit,
+)
+
+N = 3000
+
+
+@pytest.mark.parametrize("equal_opp", [False, True])
+def test_streaming_matches_in_memory_audit(tmp_path, make_predictions, equal_opp):
+    ## sparse 10-digit ids, and individuals outside all the regions
+    rng = np.random.default_rng(0)
+    codes = np.sort(rng.choice(10**10, 30, replace=False))
+    region_ids = np.where(rng.random(N) < 0.2, -1, rng.choice(codes, N))
+    y_pred, y_true = make_predictions(N, rate=0.3)
+    path = str(tmp_path / "data.csv")
+    pd.DataFrame({"region": region_ids, "y_pred": y_pred, "y_true": y_true}).to_csv(
+        path, index=False
+    )
+
+    df_stream, thresh_stream, sbi_stream = run_streaming_audit(
+        path,
+        n_worlds=200,
+        equal_opp=equal_opp,
+        region_col="region",
+        chunk_size=500,
+    )
+    ids = np.unique(region_ids[region_ids >= 0])
+    regions = [np.flatnonzero(region_ids == region_id) for region_id in ids]
+    df, thresh, sbi = run_spatial_audit(
+        y_pred, y_true if equal_opp else None, regions, n_worlds=200
+    )
+
+    np.testing.assert_array_equal(df_stream["region_id"], ids)
+    assert thresh_stream == thresh
+    assert sbi_stream == pytest.approx(sbi)
+    np.testing.assert_allclose(df_stream["statistic"], df["statistic"])
+    np.testing.assert_array_equal(df_stream["signif"], df["signif"])
+
+
+def test_accumulator_keeps_one_entry_per_seen_id():
+    accumulator = RegionCountsAccumulator()
+    accumulator.add([10**9, -1, 7], [1, 1, 0])
+    accumulator.add([7, 42, 10**9], [1, 0, 1])
+
+    np.testing.assert_array_equal(accumulator.ids, [7, 42, 10**9])
+    np.testing.assert_array_equal(accumulator.n, [2, 1, 2])
+    np.testing.assert_array_equal(accumulator.p, [1, 0, 2])
+    assert accumulator.totals["n"] == 6
+
+
+def test_accumulator_rejects_ids_beyond_n_regions():
+    accumulator = RegionCountsAccumulator(3)
+    accumulator.add([0, 2, -1], [1, 0, 1])
+
+    np.testing.assert_array_equal(accumulator.n, [1, 0, 1])
+    with pytest.raises(ValueError):
+        accumulator.add([3], [1])